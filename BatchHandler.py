@@ -12,9 +12,28 @@ from imblearn.over_sampling import RandomOverSampler
 import sys
 import time
 
+
+def _stack_batch(samples, batch_size, dtype):
+    # [batch, ...] array of the first batch_size samples, from a [batch, ...] array or a sequence of per sample arrays
+    if isinstance(samples, pd.Series):
+        samples = samples.values
+    if isinstance(samples, np.ndarray) and samples.dtype != object:
+        return np.asarray(samples[:batch_size], dtype=dtype)
+    return np.asarray(np.stack(list(samples[:batch_size])), dtype=dtype)
+
+
 class BatchHandler:
-    def __init__(self, data_pool, parameters, training):
+    # array_pool is the DensePool or WindowPool that data_pool was selected from (SequenceWrangler.dense_pool), and
+    # pool_rows the row of array_pool that each row of data_pool is (SequenceWrangler.crossfold_rows or test_rows).
+    # With them, the sample arrays of each minibatch are gathered straight from the array pool. Without them, only the
+    # rows of the batch are stacked from the columns of data_pool.
+    def __init__(self, data_pool, parameters, training, array_pool=None, pool_rows=None):
         self.data_pool = data_pool
+        self.array_pool = None
+        self.pool_rows = None
+        if array_pool is not None and pool_rows is not None:
+            self.array_pool = array_pool
+            self.pool_rows = np.asarray(pool_rows)
         self.parameters = parameters
         self.batch_size = parameters['batch_size']
         self.training = training
@@ -30,13 +49,8 @@ class BatchHandler:
         self.d_thresh = None
         self.reduced_pool = None
         self.distance_pool_cache = {}
-        self.input_mask = pd.Series([np.tile(self.parameters['input_mask']
-                                  ,
-                                  (self.parameters['observation_steps'],1)
-                                 )
-                             for x in range(self.batch_size)
-                             ],
-                            dtype=object,index=([0]*self.batch_size))
+        # Applied to every timestep of the encoder samples
+        self.input_mask = np.asarray(self.parameters['input_mask'])
 
         # Generate balanced index list
         ros = RandomOverSampler()
@@ -98,56 +112,89 @@ class BatchHandler:
     # Function that gets the data as a list of sequences, (which are time length lists of features)
     # i.e. a list of length batch size, containing [time, input_size] elements
     # and converts it to a list of length time, containing [batch input_size] elements
+    # The lists are views into the arrays of format_minibatch_arrays.
     def format_minibatch_data(self, X, Y, batchwise_padding, trackwise_padding=None):
-        if type(X) is not list:
-            X = list(X)
-        if type(Y) is not list:
-            Y = list(Y)
-        if type(batchwise_padding) is not list:
-            batchwise_padding = list(batchwise_padding)
-        if trackwise_padding is not None:
-            if type(trackwise_padding) is not list:
-                trackwise_padding = list(trackwise_padding)
-
         batch_observation_inputs, batch_future_inputs, batch_weights, batch_labels, formatted_trackwise_padding = \
-            [], [], [], [], []
-
-        # Batch encoder inputs are just re-indexed encoder_inputs.
-        # Need to re-index to make an encoder_steps long list of shape [batch input_size]
-        # currently it is a list of length batch containing shape [timesteps input_size]
-        for length_idx in xrange(self.parameters['observation_steps']):
-            batch_observation_inputs.append(
-                    np.array([X[batch_idx][length_idx]
-                    for batch_idx in xrange(self.batch_size)], dtype=np.float32))
-
-        for length_idx in xrange(self.parameters['prediction_steps']):
-            batch_future_inputs.append(
-                    np.array([Y[batch_idx][length_idx]
-                    for batch_idx in xrange(self.batch_size)], dtype=np.float32))
-            batch_weight = np.logical_not(batchwise_padding) * np.ones(self.batch_size, dtype=np.float32)
-            batch_weights.append(batch_weight)
-            if trackwise_padding is not None:
-                formatted_trackwise_padding.append(
-                        np.array([trackwise_padding[batch_idx][length_idx]
-                                 for batch_idx in xrange(self.batch_size)], dtype=np.bool))
+            self.format_minibatch_arrays(X, Y, batchwise_padding, trackwise_padding)
 
         # Encapsulate the label data in a list of size 1 to mimic a decoder seq of len 1
         if self.parameters['prediction_steps'] == 0:
-            batch_labels = [Y]
-            batch_weights = [np.logical_not(batchwise_padding) * np.ones(self.batch_size, dtype=np.float32)]
-        if trackwise_padding is None:
-            formatted_trackwise_padding = None
+            batch_labels = [Y if type(Y) is list else list(Y)]
+        else:
+            batch_labels = []
+        if formatted_trackwise_padding is not None:
+            formatted_trackwise_padding = list(formatted_trackwise_padding)
         # Batch_observation_inputs is now list of len encoder_steps, shape batch, input_size.
         #  Similarly with batch_future_inputs
+        return list(batch_observation_inputs), list(batch_future_inputs), list(batch_weights), batch_labels, \
+            formatted_trackwise_padding
+
+    # The batch as time major arrays. X, Y and trackwise_padding are [batch, time, ...] arrays, as from
+    # get_minibatch_arrays, or sequences of per sample arrays such as the columns of the batch frame. Each is stacked
+    # once, and returned as a [time, batch, ...] view:
+    # observation inputs [observation_steps, batch, input_size] float32, future inputs [prediction_steps, batch, ...]
+    # float32, weights [prediction_steps, batch] float32, labels (Y as a [batch, ...] array when there are no
+    # prediction steps, else None) and trackwise padding [prediction_steps, batch] bool, or None.
+    def format_minibatch_arrays(self, X, Y, batchwise_padding, trackwise_padding=None):
+        observation_steps = self.parameters['observation_steps']
+        prediction_steps = self.parameters['prediction_steps']
+
+        batch_observation_inputs = np.swapaxes(
+            _stack_batch(X, self.batch_size, np.float32)[:, :observation_steps], 0, 1)
+        future_block = _stack_batch(Y, self.batch_size, np.float32)
+        batch_future_inputs = np.swapaxes(future_block[:, :prediction_steps], 0, 1)
+        batch_weight = np.logical_not(np.asarray(batchwise_padding, dtype=bool)) * \
+            np.ones(self.batch_size, dtype=np.float32)
+        # The label of a classifier is a decoder seq of len 1
+        batch_weights = np.tile(batch_weight, (max(prediction_steps, 1), 1))
+        batch_labels = None
+        if prediction_steps == 0:
+            batch_labels = future_block
+        formatted_trackwise_padding = None
+        if trackwise_padding is not None:
+            formatted_trackwise_padding = np.swapaxes(
+                _stack_batch(trackwise_padding, self.batch_size, np.bool)[:, :prediction_steps], 0, 1)
         return batch_observation_inputs, batch_future_inputs, batch_weights, batch_labels, formatted_trackwise_padding
 
-
     # This function collects the mini-batch for training
     # If the network is under test, it will sequentially feed the testing data in size minibatch
     # The last mini-batch for the dataset is padded with junk data (taken from the start of the sequence)
     # The batch_complete flag signals the last mini-batch for the batch, so the system should collate results
     # pad_vector is TRUE if the data is junk (padding data)
     def get_minibatch(self):
+        # The minibatch as a dataframe of pool rows. See get_minibatch_arrays for the batch without the dataframe.
+        batch_idxs = self._sample_batch_idxs()
+        batch_frame = self.data_pool.iloc[batch_idxs].copy()
+        encoder_block = self._get_encoder_block(batch_idxs)
+        encoder_column = np.empty(self.batch_size, dtype=object)
+        for batch_idx in xrange(self.batch_size):
+            encoder_column[batch_idx] = encoder_block[batch_idx]
+        batch_frame.encoder_sample = encoder_column
+
+        batch_frame = batch_frame.assign(batchwise_padding=np.zeros(self.batch_size, dtype=bool))
+        return batch_frame # batch_X, batch_Y, batch_weights
+
+    def get_minibatch_arrays(self):
+        # The same sampling and augmentation as get_minibatch, but only the sample arrays of the batch are gathered.
+        # Returns a dict of [batch, ...] arrays for encoder_sample, batchwise_padding and whichever of decoder_sample,
+        # dest_1_hot and trackwise_padding the pool has, so it can be used in place of the batch frame. batch_idxs are
+        # the rows of the pool in the batch.
+        batch_idxs = self._sample_batch_idxs()
+        batch = {'batch_idxs': batch_idxs,
+                 'encoder_sample': self._get_encoder_block(batch_idxs),
+                 'batchwise_padding': np.zeros(self.batch_size, dtype=bool)}
+        for column_name in ['decoder_sample', 'dest_1_hot', 'trackwise_padding']:
+            if column_name in self.data_pool.columns:
+                batch[column_name] = self._get_batch_array(column_name, batch_idxs)
+        return batch
+
+    def _get_batch_array(self, column_name, batch_idxs):
+        # [batch, ...] array of a per sample array column, for the rows batch_idxs of data_pool
+        if self.array_pool is not None:
+            return np.asarray(self.array_pool.get_array(column_name, self.pool_rows[batch_idxs]))
+        return np.stack(self.data_pool[column_name].values[batch_idxs])
+
+    def _sample_batch_idxs(self):
         # TODO Research
         # Bias sampling, importance sampling, weighted sampling
 
@@ -156,46 +203,31 @@ class BatchHandler:
             batch_idxs = np.random.choice(self.balanced_idxs, self.batch_size, replace=False)
         else:
             # Select uniformly at random
-            batch_idxs = np.random.choice(range(len(self.data_pool)), self.batch_size, replace=False)
+            batch_idxs = np.random.choice(len(self.data_pool), self.batch_size, replace=False)
 
         # class_dict = {}  # BALANCER VERIFICATION CODE
         # for class_t in data_pool.track_class.unique():
         #     class_dict[class_t] = len(bf[bf.track_class==class_t])/float(len(bf))
         # print class_dict
+        return batch_idxs
 
-        batch_frame = self.data_pool.iloc[batch_idxs].copy()
-        num_columns = batch_frame.encoder_sample.iloc[0].shape[1]
+    def _get_encoder_block(self, batch_idxs):
+        # [batch, observation_steps, features] encoder samples, with the augmentation and input mask applied to the
+        # whole block at once
+        encoder_block = self._get_batch_array('encoder_sample', batch_idxs)
+        num_columns = encoder_block.shape[2]
 
         if self.training and self.parameters['augmentation_chance'] > 0.001:
-            # Generate same size matrix that contains the offsets
-            # i.e. e,n,0,0 * REPMATRIX(encoder_length) for all samples
-            # np.tile([randomx,randomy,0,0],(len_enc_samples,1))
-            aug = pd.Series([
-                            np.tile([
-                                  self.parameters['aug_function'](*self.parameters['aug_range']),
-                                  self.parameters['aug_function'](*self.parameters['aug_range'])
-                                  ]+[0.0]*(num_columns-2)
-                                  ,
-                                  (self.parameters['observation_steps'],1)
-                                 )
-                             for x in range(self.batch_size)
-                             ],
-                            dtype=object,index=([0]*self.batch_size))
-            aug_mask = pd.Series([
-                                np.tile([np.random.choice([1.0,0.0],p=[self.parameters['augmentation_chance'],
-                                                               1-self.parameters['augmentation_chance']])]
-                                         * num_columns
-                                        ,
-                                        (self.parameters['observation_steps'], 1)
-                                        )
-                                for x in range(self.batch_size)
-                                ],
-                            dtype=object, index=([0] * self.batch_size))
-            batch_frame.encoder_sample = batch_frame.encoder_sample + (aug*aug_mask)
-        batch_frame.encoder_sample = batch_frame.encoder_sample*self.input_mask
-
-        batch_frame = batch_frame.assign(batchwise_padding=np.zeros(self.batch_size, dtype=bool))
-        return batch_frame # batch_X, batch_Y, batch_weights
+            # Each sample gets an offset of [randomx,randomy,0,0] on every timestep, with augmentation_chance
+            offsets = np.zeros([self.batch_size, num_columns])
+            offsets[:, 0:2] = [[self.parameters['aug_function'](*self.parameters['aug_range']),
+                                self.parameters['aug_function'](*self.parameters['aug_range'])]
+                               for x in range(self.batch_size)]
+            aug_mask = np.random.choice([1.0, 0.0], size=self.batch_size,
+                                        p=[self.parameters['augmentation_chance'],
+                                           1-self.parameters['augmentation_chance']])
+            encoder_block = encoder_block + (offsets * aug_mask[:, np.newaxis])[:, np.newaxis, :]
+        return encoder_block * self.input_mask
 
         # Testing / validating
     def get_sequential_minibatch(self):
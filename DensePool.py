@@ -0,0 +1,123 @@
+# Dense layout of a sample pool, such as the SequenceWrangler master pool.
+# The per sample arrays (encoder_sample, decoder_sample, trackwise_padding, dest_1_hot) are held as single contiguous
+# [N, ...] arrays, e.g. encoder[N, observation_steps, features], rather than as one small ndarray per row of an object
+# column. Everything else (track_idx, track_time_idx, distance, labels...) is a metadata table, kept as a TrackStore
+# holding a single 'track' of N rows.
+#
+# On disk the pool is a directory of .npy files, so it can be memory mapped and shared between processes. to_frame
+# gives back the original dataframe layout, with each row's arrays being views into the dense arrays.
+
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import TrackStore
+
+DENSE_POOL_VERSION = 1
+# Columns that hold an array per sample, and the name of their dense array
+DENSE_COLUMNS = [('encoder_sample', 'encoder'),
+                 ('decoder_sample', 'decoder'),
+                 ('trackwise_padding', 'padding'),
+                 ('dest_1_hot', 'dest_1_hot')]
+
+
+class DensePool:
+    def __init__(self, column_names, arrays, metadata):
+        # Column order of the dataframe layout
+        self.column_names = list(column_names)
+        # dense name -> [N, ...] array
+        self.arrays = arrays
+        self.metadata = metadata
+
+    @classmethod
+    def from_frame(cls, pool_df):
+        arrays = {}
+        for column_name, array_name in DENSE_COLUMNS:
+            if column_name in pool_df.columns:
+                arrays[array_name] = cls._stack(pool_df[column_name].values)
+        metadata_names = [name for name in pool_df.columns if name not in cls._dense_names()]
+        metadata = TrackStore.TrackStore.from_track_list([pool_df[metadata_names]])
+        return cls(pool_df.columns, arrays, metadata)
+
+    @staticmethod
+    def _stack(samples):
+        if len(samples) == 0:
+            return np.empty(0)
+        return np.stack(samples)
+
+    @staticmethod
+    def _dense_names():
+        return dict(DENSE_COLUMNS)
+
+    def __len__(self):
+        return len(self.metadata.index)
+
+    def get_array(self, column_name, rows=None):
+        # Dense [N, ...] array of a per sample array column, e.g. get_array('encoder_sample'), for all rows or an array
+        # of row indices
+        array = self.arrays[self._dense_names()[column_name]]
+        return array if rows is None else array[rows]
+
+    def get_metadata(self, rows=None):
+        # Metadata table, for all rows or an array of row indices
+        metadata_df = self.metadata.get_rows(0, len(self))
+        if rows is not None:
+            metadata_df = metadata_df.iloc[rows]
+        return metadata_df
+
+    def to_frame(self, rows=None):
+        # The pool in the dataframe layout, for all rows or an array of row indices.
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows)
+        metadata_df = self.get_metadata(rows)
+        data = {}
+        for name in self.column_names:
+            if name in self._dense_names():
+                # np.asarray so a memory mapped array gives plain ndarray views
+                dense = np.asarray(self.get_array(name))
+                column = np.empty(len(rows), dtype=object)
+                for sample_idx in xrange(len(rows)):
+                    column[sample_idx] = dense[rows[sample_idx]]
+                data[name] = column
+            else:
+                data[name] = metadata_df[name].values
+        return pd.DataFrame(data, columns=self.column_names, index=metadata_df.index)
+
+    def save(self, path):
+        # Write to a temporary directory and then move it into place, so an interrupted write is never loaded.
+        temp_path = path + '.tmp'
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        for array_name, array in self.arrays.iteritems():
+            np.save(os.path.join(temp_path, array_name + '.npy'), array)
+        self.metadata.save(os.path.join(temp_path, 'metadata.tracks'))
+        description = {'version': DENSE_POOL_VERSION,
+                       'column_names': self.column_names,
+                       'arrays': sorted(self.arrays.keys())}
+        with open(os.path.join(temp_path, 'pool.json'), 'w') as json_file:
+            json.dump(description, json_file)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode='c'):
+        # Returns None if there is no (compatible) pool at path.
+        # The default copy-on-write mapping lets consumers modify samples without changing the file.
+        if not os.path.isfile(os.path.join(path, 'pool.json')):
+            return None
+        with open(os.path.join(path, 'pool.json'), 'r') as json_file:
+            description = json.load(json_file)
+        if description['version'] != DENSE_POOL_VERSION:
+            return None
+        metadata = TrackStore.TrackStore.load(os.path.join(path, 'metadata.tracks'), mmap_mode=mmap_mode)
+        if metadata is None:
+            return None
+        # json gives back unicode
+        arrays = {}
+        for array_name in description['arrays']:
+            arrays[str(array_name)] = np.load(os.path.join(path, str(array_name) + '.npy'), mmap_mode=mmap_mode)
+        return cls([str(name) for name in description['column_names']], arrays, metadata)
@@ -0,0 +1,167 @@
+# Registry of the intersection geometry used to label the ibeo recordings.
+# The gates, the clockwise ring of directions and the per-entrance origin/rotation of each intersection are declared in
+# intersections.json, and a recording is matched to an intersection by substrings of its csv name. Adding an
+# intersection only needs a new entry in that file.
+#
+# Each intersection compiles its gates into [gate, 4] bound arrays, so a gate test over all points and all gates is a
+# single array operation.
+
+import numpy as np
+import json
+import os
+import hashlib
+from collections import OrderedDict
+
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intersections.json')
+NO_GATE = -1
+
+_registry = None
+
+
+def get_registry(path=None):
+    # The registry is only read once per process.
+    global _registry
+    if path is not None:
+        return IntersectionRegistry.load(path)
+    if _registry is None:
+        _registry = IntersectionRegistry.load(REGISTRY_PATH)
+    return _registry
+
+
+def _to_str(value):
+    # json gives back unicode
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_to_str(item) for item in value]
+    if isinstance(value, OrderedDict):
+        return OrderedDict((_to_str(key), _to_str(item)) for key, item in value.iteritems())
+    return value
+
+
+class Intersection:
+    def __init__(self, definition):
+        self.name = definition['name']
+        self.match = definition['match']
+        # Fingerprint of the definition, for caches of data labelled with this geometry
+        self.fingerprint = hashlib.md5(json.dumps(definition)).hexdigest()
+        # Plain dicts, filled in file order. Where gates overlap the last gate in iteration order is the one used.
+        self.dest_gates = dict()
+        for label, gate in definition['dest_gates'].iteritems():
+            self.dest_gates[label] = gate
+        self.origin_gates = dict()
+        for label, gate in definition['origin_gates'].iteritems():
+            self.origin_gates[label] = gate
+        self.relative_ring = definition['relative_ring']
+
+        # format: x_min,x_max,y_min,y_max
+        self.dest_labels = [label for label, gate in self.dest_gates.iteritems()]
+        self.dest_bounds = np.array([gate for label, gate in self.dest_gates.iteritems()],
+                                    dtype=np.float64).reshape(-1, 4)
+        self.origin_labels = [label for label, gate in self.origin_gates.iteritems()]
+        self.origin_bounds = np.array([gate for label, gate in self.origin_gates.iteritems()],
+                                      dtype=np.float64).reshape(-1, 4)
+
+        # Origin and direction of travel of each entrance, used to transform tracks into the entrance frame
+        self.entrance_labels = list(definition['entrances'].keys())
+        self.entrance_origins = np.array([definition['entrances'][label]['origin']
+                                          for label in self.entrance_labels], dtype=np.float64).reshape(-1, 2)
+        self.entrance_rotations = np.array([definition['entrances'][label]['rotation']
+                                            for label in self.entrance_labels], dtype=np.float64).reshape(-1, 2)
+
+    def matches(self, csv_name):
+        return any(pattern in csv_name for pattern in self.match)
+
+    def _bounds(self, gate_type):
+        if gate_type == 'origin':
+            return self.origin_bounds
+        if gate_type == 'dest':
+            return self.dest_bounds
+        raise ValueError("gate_type must be 'origin' or 'dest', not " + str(gate_type))
+
+    def gate_index(self, gate_type, label):
+        if gate_type == 'origin':
+            return self.origin_labels.index(label)
+        return self.dest_labels.index(label)
+
+    def gate_hits(self, x, y, gate_type):
+        # [gate, point] array of whether each point is within each gate.
+        bounds = self._bounds(gate_type)
+        x = np.asarray(x)[np.newaxis, :]
+        y = np.asarray(y)[np.newaxis, :]
+        return ((x >= bounds[:, 0:1]) &
+                (x <= bounds[:, 1:2]) &
+                (y >= bounds[:, 2:3]) &
+                (y <= bounds[:, 3:4]))
+
+    def which_gate(self, x, y, gate_type):
+        # Index into the origin_labels/dest_labels of the gate containing each point, or NO_GATE.
+        # Where gates overlap, the last one wins.
+        hits = self.gate_hits(x, y, gate_type)
+        if hits.shape[0] == 0:
+            return np.full(hits.shape[1], NO_GATE, dtype=np.int64)
+        last_hit = hits.shape[0] - 1 - np.argmax(hits[::-1], axis=0)
+        return np.where(hits.any(axis=0), last_hit, NO_GATE)
+
+    def in_gate(self, x, y, gate_type, gate_idx):
+        # Whether each point is within the gate of each point, for an array of gate indices (or a single index)
+        bounds = self._bounds(gate_type)[gate_idx].T
+        return ((x >= bounds[0]) &
+                (x <= bounds[1]) &
+                (y >= bounds[2]) &
+                (y <= bounds[3]))
+
+    def entrance_transform(self, entrance):
+        # Origin and rotation vector of an entrance
+        entrance_idx = self.entrance_labels.index(entrance)
+        return self.entrance_origins[entrance_idx], self.entrance_rotations[entrance_idx]
+
+    def entrance_index(self, entrances):
+        # Index of each entrance label, for a single label or a sequence of labels
+        if isinstance(entrances, str):
+            return self.entrance_labels.index(entrances)
+        return np.array([self.entrance_labels.index(entrance) for entrance in entrances], dtype=np.int64)
+
+    def to_relative(self, x, y, orientation, entrance_idx):
+        # Transform points into the frame of the entrance they came from, with the origin at the entrance.
+        # entrance_idx is a single entrance index or one per point, so this works on whole recordings as well as on
+        # single points as they arrive.
+        # The regular coordinates were x forward, y left, carteasian angles (ccw, from x=0 axis)
+        # The relative coords are now y forward, x right, and ccw angles from y=0
+        # This makes graphing easy and convienent, but angles are annoying.
+        # Having zero at the top, +- pi radians, and the vehicles travelling upwards avoids rollover
+        origins = self.entrance_origins[entrance_idx]
+        rotations = self.entrance_rotations[entrance_idx]
+        # Angle from the entrance direction to the y axis
+        a = np.arctan2(1, 0) - np.arctan2(rotations[..., 1], rotations[..., 0])
+        # Subtract origin first, then rotate.
+        # This means the new origin does not need to be rotated
+        x_z = x - origins[..., 0]
+        y_z = y - origins[..., 1]
+        relative_x = x_z * np.cos(a) - y_z * np.sin(a)
+        relative_y = x_z * np.sin(a) + y_z * np.cos(a)
+        relative_angle = orientation + a
+        relative_angle += np.pi / 2
+        # shift to -pi and pi
+        relative_angle = ((relative_angle + 2 * np.pi) % (2 * np.pi))
+        relative_angle -= np.pi
+        return relative_x, relative_y, relative_angle
+
+
+class IntersectionRegistry:
+    def __init__(self, intersections):
+        self.intersections = intersections
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as json_file:
+            description = _to_str(json.load(json_file, object_pairs_hook=OrderedDict))
+        return cls([Intersection(definition) for definition in description['intersections']])
+
+    def lookup(self, csv_name):
+        # The intersection a recording was taken at, or None. If several entries match, the last one is used.
+        found = None
+        for intersection in self.intersections:
+            if intersection.matches(csv_name):
+                found = intersection
+        return found
@@ -0,0 +1,122 @@
+# Reads a large csv directly, in parallel, without first splitting it on disk with tools/csv_splitter.py.
+# The file is memory mapped and cut into byte ranges that start and end on a line boundary, so every range can be
+# parsed on its own by a worker process. Ranges are returned in file order with a running row index, so the rows are
+# the same as a single pd.read_csv. Tracks that straddle two ranges are joined back together by the importer.
+
+import pandas as pd
+import io
+import mmap
+import os
+import pathos.multiprocessing as mp
+
+DEFAULT_RANGE_BYTES = 64 * 2**20
+
+
+def _read_range(args):
+    # Parse the rows in [start, end) of the file. Run in a worker process.
+    file_path, start, end, column_names, usecols, dtype = args
+    with open(file_path, 'rb') as csv_file:
+        file_map = mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            range_bytes = file_map[start:end]
+        finally:
+            file_map.close()
+    return pd.read_csv(io.BytesIO(range_bytes), header=None, names=column_names, usecols=usecols, dtype=dtype)
+
+
+class ParallelCSVReader:
+    def __init__(self, file_path, workers=1):
+        self.file_path = file_path
+        self.workers = workers
+        self.file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as csv_file:
+            header = csv_file.readline()
+            # A sample of rows, to estimate the size of a row
+            sample_lines = [csv_file.readline() for _ in range(1000)]
+        self.data_start = len(header)
+        self.column_names = list(pd.read_csv(io.BytesIO(header), nrows=0).columns)
+        sample_bytes = sum(len(line) for line in sample_lines)
+        sample_rows = max(1, len([line for line in sample_lines if len(line) > 0]))
+        self.row_bytes = max(1, sample_bytes // sample_rows)
+
+    def get_byte_ranges(self, range_bytes):
+        # [start, end) byte offsets of ranges of about range_bytes, each ending just after a newline
+        ranges = []
+        if self.data_start >= self.file_size:
+            return ranges
+        with open(self.file_path, 'rb') as csv_file:
+            file_map = mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                start = self.data_start
+                while start < self.file_size:
+                    end = start + range_bytes
+                    if end >= self.file_size:
+                        end = self.file_size
+                    else:
+                        newline = file_map.find('\n', end - 1)
+                        end = self.file_size if newline == -1 else newline + 1
+                    ranges.append((start, end))
+                    start = end
+            finally:
+                file_map.close()
+        return ranges
+
+    def iter_ranges(self, usecols=None, dtype=None, range_bytes=DEFAULT_RANGE_BYTES):
+        # Yields a dataframe per byte range, in file order. The index continues across ranges, as it would with
+        # pd.read_csv(chunksize=...). Only a few ranges per worker are in flight, which bounds memory.
+        args = [(self.file_path, start, end, self.column_names, usecols, dtype)
+                for start, end in self.get_byte_ranges(range_bytes)]
+        pool = None
+        if self.workers > 1:
+            pool = mp.Pool(processes=self.workers)
+        batch_size = 2 * self.workers
+        first_row = 0
+        try:
+            for batch_start in range(0, len(args), batch_size):
+                batch = args[batch_start:batch_start + batch_size]
+                if pool is not None:
+                    range_dfs = pool.map(_read_range, batch)
+                else:
+                    range_dfs = [_read_range(range_args) for range_args in batch]
+                for range_df in range_dfs:
+                    range_df.index = pd.RangeIndex(first_row, first_row + len(range_df))
+                    first_row += len(range_df)
+                    yield range_df
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def iter_chunks(self, chunk_rows, usecols=None, dtype=None, range_bytes=None):
+        # Yields dataframes of chunk_rows rows (the last may be shorter), the same chunks as
+        # pd.read_csv(chunksize=chunk_rows). The byte ranges are parsed in parallel and cut again at the row
+        # boundaries, so the chunks do not depend on the number of workers.
+        if range_bytes is None:
+            range_bytes = chunk_rows * self.row_bytes
+        pending_dfs = []
+        pending_rows = 0
+        for range_df in self.iter_ranges(usecols, dtype, range_bytes):
+            pending_dfs.append(range_df)
+            pending_rows += len(range_df)
+            if pending_rows < chunk_rows:
+                continue
+            rows_df = pd.concat(pending_dfs)
+            whole_rows = pending_rows - pending_rows % chunk_rows
+            for start in range(0, whole_rows, chunk_rows):
+                # Copied, so the chunk can be modified without pandas warning about setting values on a slice
+                yield rows_df.iloc[start:start + chunk_rows].copy()
+            pending_dfs = [rows_df.iloc[whole_rows:]]
+            pending_rows -= whole_rows
+        if pending_rows > 0:
+            yield pd.concat(pending_dfs).copy()
+
+    def read(self, usecols=None, dtype=None, range_bytes=None):
+        # The whole file as one dataframe, the same as pd.read_csv(file_path, usecols=usecols, dtype=dtype)
+        if range_bytes is None:
+            # One range per worker, unless that would be very large
+            range_bytes = min(DEFAULT_RANGE_BYTES, self.file_size // max(1, self.workers) + 1)
+        range_dfs = list(self.iter_ranges(usecols, dtype, range_bytes))
+        if len(range_dfs) == 0:
+            # No rows, only a header
+            return pd.read_csv(self.file_path, usecols=usecols, dtype=dtype)
+        return pd.concat(range_dfs)
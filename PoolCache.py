@@ -0,0 +1,194 @@
+# Manifest of the wrangled pools kept in data_pool/.
+# Every pool is an entry of one or more files/directories, with when it was made and last used, its size, and the
+# fingerprint it is keyed on. The manifest is data_pool/manifest.json. With a disk budget, the least recently used
+# pools are removed until the cache fits.
+#
+# Several wrangler processes may share the cache. Every change is made under a lock on data_pool/manifest.json.lock,
+# to the manifest as it is on disk at the time, so no process loses the entries of another. Pools that were used
+# recently, or by another process that is still running, are never evicted, as they may be memory mapped.
+
+import fcntl
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+MANIFEST_NAME = 'manifest.json'
+# A pool used within this many seconds is not evicted
+MIN_IDLE_SECONDS = 3600
+
+
+def _get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            total += os.path.getsize(os.path.join(dir_path, file_name))
+    return total
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class _ManifestLock:
+    # Exclusive lock on the manifest, held for a with block
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_path, 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+
+
+class PoolCache:
+    def __init__(self, cache_dir, max_bytes=None, min_idle_seconds=MIN_IDLE_SECONDS):
+        self.cache_dir = cache_dir
+        # Disk budget. None is no limit.
+        self.max_bytes = max_bytes
+        self.min_idle_seconds = min_idle_seconds
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+        # Entries as last read from disk
+        self.entries = self._read_manifest()
+
+    def _lock(self):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        return _ManifestLock(self.manifest_path + '.lock')
+
+    def _read_manifest(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as json_file:
+                entries = json.load(json_file)
+        except ValueError:
+            # A corrupt manifest only loses the bookkeeping, the pools are still on disk
+            print "Warning, unreadable pool cache manifest, starting a new one"
+            return {}
+        # json gives back unicode
+        return dict((str(name), entry) for name, entry in entries.iteritems())
+
+    def _write_manifest(self):
+        # Only called with the lock held. Written to a temporary file and renamed into place, so a reader never sees
+        # a partial manifest.
+        temp_handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=MANIFEST_NAME + '.')
+        with os.fdopen(temp_handle, 'w') as json_file:
+            json.dump(self.entries, json_file, indent=1, sort_keys=True)
+        os.rename(temp_path, self.manifest_path)
+
+    def _full_paths(self, name):
+        return [os.path.join(self.cache_dir, str(file_name)) for file_name in self.entries[name]['files']]
+
+    def _mark_used(self, name):
+        # Record that this process uses the pool
+        self.entries[name]['last_used'] = time.time()
+        self.entries[name]['host'] = socket.gethostname()
+        self.entries[name]['pid'] = os.getpid()
+
+    def add(self, name, file_names, description=None):
+        # Record a newly written pool, made of file_names within the cache directory, then evict to fit the budget.
+        with self._lock():
+            self.entries = self._read_manifest()
+            now = time.time()
+            self.entries[name] = {'files': list(file_names),
+                                  'created': now,
+                                  'size_bytes': 0,
+                                  'description': description}
+            self._mark_used(name)
+            self.entries[name]['size_bytes'] = sum(_get_size(path) for path in self._full_paths(name)
+                                                   if os.path.exists(path))
+            self._evict(keep=name)
+            self._write_manifest()
+
+    def touch(self, name, file_names=None):
+        # Record a use of a pool. A pool made before the manifest existed is added to it.
+        with self._lock():
+            self.entries = self._read_manifest()
+            if name in self.entries:
+                self._mark_used(name)
+                self._write_manifest()
+                return
+        if file_names is not None:
+            self.add(name, file_names)
+
+    def remove(self, name):
+        with self._lock():
+            self.entries = self._read_manifest()
+            if name in self.entries:
+                self._remove(name)
+                self._write_manifest()
+
+    def _remove(self, name):
+        for path in self._full_paths(name):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        del self.entries[name]
+
+    def total_bytes(self):
+        return sum(entry['size_bytes'] for entry in self.entries.itervalues())
+
+    def _in_use(self, name):
+        # Used recently, or by another process that is still running
+        entry = self.entries[name]
+        if time.time() - entry['last_used'] < self.min_idle_seconds:
+            return True
+        if entry.get('pid') is None or entry['pid'] == os.getpid():
+            return False
+        if entry.get('host') != socket.gethostname():
+            # Cannot tell if a process on another machine is running, so only its idle time counts
+            return False
+        return _is_running(entry['pid'])
+
+    def evict(self, keep=None):
+        # Remove the least recently used pools, other than keep and those in use, until the cache is within the
+        # budget.
+        with self._lock():
+            self.entries = self._read_manifest()
+            evicted = self._evict(keep)
+            if len(evicted) > 0:
+                self._write_manifest()
+        return evicted
+
+    def _evict(self, keep=None):
+        if self.max_bytes is None:
+            return []
+        evicted = []
+        for name in sorted(self.entries.keys(), key=lambda entry_name: self.entries[entry_name]['last_used']):
+            if self.total_bytes() <= self.max_bytes:
+                break
+            if name == keep or self._in_use(name):
+                continue
+            print "Evicting pool " + name + " from the cache"
+            self._remove(name)
+            evicted.append(name)
+        return evicted
+
+    def report(self):
+        # One line per pool with its size and age, most recently used first
+        now = time.time()
+        lines = ["Pool cache: " + str(len(self.entries)) + " pools, " +
+                 "%.1f MB" % (self.total_bytes() / 2.0**20) +
+                 ("" if self.max_bytes is None else " of %.1f MB" % (self.max_bytes / 2.0**20))]
+        for name in sorted(self.entries.keys(), key=lambda entry_name: -self.entries[entry_name]['last_used']):
+            entry = self.entries[name]
+            lines.append("\t%s %.1f MB, made %.1f days ago, used %.1f days ago" %
+                         (name, entry['size_bytes'] / 2.0**20,
+                          (now - entry['created']) / 86400.0, (now - entry['last_used']) / 86400.0))
+        return '\n'.join(lines)
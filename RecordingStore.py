@@ -0,0 +1,124 @@
+# Binary copy of a raw ibeo recording, so the csv text only has to be parsed once.
+# Every column is a flat binary file in file row order, with a json description of the column types. The store also
+# keeps the (ObjectId, Timestamp) sort order of the rows and where each ObjectId starts in that order, so the rows of
+# any set of objects can be read, and disambiguated, without sorting or scanning the whole recording again.
+#
+# Columns are read with np.memmap, so only the rows that are used are read from disk.
+
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+
+RECORDING_STORE_VERSION = 1
+CONVERT_CHUNK_ROWS = 1000000
+
+
+class RecordingStore:
+    def __init__(self, column_names, columns, sort_order, object_offsets):
+        self.column_names = list(column_names)
+        self.columns = columns
+        # Rows in (ObjectId, Timestamp) order. Ties keep file order.
+        self.sort_order = sort_order
+        # Start of each ObjectId in sort_order, and the end of the last
+        self.object_offsets = object_offsets
+
+    @classmethod
+    def convert(cls, path, chunks):
+        # Write the dataframes from chunks, the rows of a recording in file order, into a new store at path.
+        # Written to a temporary directory and then moved into place, so an interrupted conversion is never loaded.
+        temp_path = path + '.tmp'
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        column_names = None
+        column_types = None
+        num_rows = 0
+        for chunk_df in chunks:
+            if column_names is None:
+                column_names = list(chunk_df.columns)
+                column_types = [chunk_df[name].values.dtype.str for name in column_names]
+            for column_idx, name in enumerate(column_names):
+                with open(os.path.join(temp_path, 'column_%03d.bin' % column_idx), 'ab') as column_file:
+                    chunk_df[name].values.astype(column_types[column_idx]).tofile(column_file)
+            num_rows += len(chunk_df)
+        if column_names is None:
+            shutil.rmtree(temp_path)
+            raise ValueError("No data to convert into " + path)
+
+        object_ids = np.fromfile(os.path.join(temp_path, 'column_%03d.bin' % column_names.index('ObjectId')),
+                                 dtype=column_types[column_names.index('ObjectId')])
+        timestamps = np.fromfile(os.path.join(temp_path, 'column_%03d.bin' % column_names.index('Timestamp')),
+                                 dtype=column_types[column_names.index('Timestamp')])
+        sort_order = np.lexsort((timestamps, object_ids))
+        sorted_ids = object_ids[sort_order]
+        if num_rows == 0:
+            object_offsets = np.zeros(1, dtype=np.int64)
+        else:
+            object_offsets = np.append(np.append(0, np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1), num_rows)
+        np.save(os.path.join(temp_path, 'sort_order.npy'), sort_order.astype(np.int64))
+        np.save(os.path.join(temp_path, 'object_offsets.npy'), object_offsets.astype(np.int64))
+        description = {'version': RECORDING_STORE_VERSION,
+                       'column_names': column_names,
+                       'column_types': column_types,
+                       'num_rows': num_rows}
+        with open(os.path.join(temp_path, 'store.json'), 'w') as json_file:
+            json.dump(description, json_file)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(temp_path, path)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        # Returns None if there is no (compatible) store at path.
+        if not os.path.isfile(os.path.join(path, 'store.json')):
+            return None
+        with open(os.path.join(path, 'store.json'), 'r') as json_file:
+            description = json.load(json_file)
+        if description['version'] != RECORDING_STORE_VERSION:
+            return None
+        # json gives back unicode
+        column_names = [str(name) for name in description['column_names']]
+        columns = {}
+        for column_idx, name in enumerate(column_names):
+            dtype = np.dtype(str(description['column_types'][column_idx]))
+            if description['num_rows'] == 0:
+                columns[name] = np.empty(0, dtype=dtype)
+            else:
+                columns[name] = np.memmap(os.path.join(path, 'column_%03d.bin' % column_idx), dtype=dtype, mode='r',
+                                          shape=(description['num_rows'],))
+        return cls(column_names, columns,
+                   np.load(os.path.join(path, 'sort_order.npy'), mmap_mode='r'),
+                   np.load(os.path.join(path, 'object_offsets.npy')))
+
+    def __len__(self):
+        return len(self.sort_order)
+
+    def num_objects(self):
+        return len(self.object_offsets) - 1
+
+    def get_objects(self, start, end):
+        # All rows of the objects [start, end) in ObjectId order, as a dataframe in file order with the file row as
+        # the index, and the (ObjectId, Timestamp) order of the rows of that dataframe.
+        sorted_rows = np.asarray(self.sort_order[self.object_offsets[start]:self.object_offsets[end]])
+        file_rows = np.sort(sorted_rows)
+        data = {}
+        for name in self.column_names:
+            data[name] = np.asarray(self.columns[name][file_rows])
+        objects_df = pd.DataFrame(data, index=file_rows, columns=self.column_names)
+        return objects_df, np.searchsorted(file_rows, sorted_rows)
+
+    def iter_object_chunks(self, chunk_rows=None):
+        # Yields (dataframe, sort order) for groups of whole objects of about chunk_rows rows, in ObjectId order.
+        # Without a chunk size the whole recording is a single chunk.
+        if chunk_rows is None:
+            yield self.get_objects(0, self.num_objects())
+            return
+        start = 0
+        while start < self.num_objects():
+            end = np.searchsorted(self.object_offsets, self.object_offsets[start] + chunk_rows, side='right') - 1
+            end = min(max(end, start + 1), self.num_objects())
+            yield self.get_objects(start, end)
+            start = end
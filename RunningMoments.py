@@ -0,0 +1,76 @@
+# Streaming per-feature mean and variance, for the encoder normalization parameters.
+# Batches of rows are folded in with the Chan et al. parallel update of Welford's algorithm, so the data never has to be
+# held in memory at once, and the moments of separate workers or separate parts of a pool can be merged exactly.
+# All sums are kept in float64.
+
+import numpy as np
+import json
+import os
+
+
+class RunningMoments:
+    def __init__(self, num_features, count=0, mean=None, m2=None):
+        self.num_features = num_features
+        self.count = count
+        # Mean and the sum of squared differences from the mean, per feature
+        self.mean = np.zeros(num_features, dtype=np.float64) if mean is None else np.asarray(mean, dtype=np.float64)
+        self.m2 = np.zeros(num_features, dtype=np.float64) if m2 is None else np.asarray(m2, dtype=np.float64)
+
+    def update(self, rows):
+        # Add a [rows, features] batch
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.num_features)
+        if len(rows) == 0:
+            return self
+        batch_mean = np.mean(rows, axis=0)
+        batch_m2 = np.sum(np.square(rows - batch_mean), axis=0)
+        return self._combine(len(rows), batch_mean, batch_m2)
+
+    def merge(self, other):
+        # Add the moments of another accumulator, e.g. from a worker process
+        return self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count, mean, m2):
+        if count == 0:
+            return self
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (float(count) / total)
+        self.m2 = self.m2 + m2 + np.square(delta) * (float(self.count) * count / total)
+        self.count = total
+        return self
+
+    def get_mean(self):
+        return self.mean
+
+    def get_var(self):
+        # Population variance, as np.var
+        if self.count == 0:
+            return np.full(self.num_features, np.nan)
+        return self.m2 / self.count
+
+    def get_std(self):
+        return np.sqrt(self.get_var())
+
+    def to_dict(self):
+        return {'num_features': self.num_features,
+                'count': self.count,
+                'mean': self.mean.tolist(),
+                'm2': self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, description):
+        return cls(description['num_features'], description['count'], description['mean'], description['m2'])
+
+    def save(self, path):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        # Returns None if there are no saved moments at path.
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as json_file:
+            return cls.from_dict(json.load(json_file))
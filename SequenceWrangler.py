@@ -7,42 +7,85 @@ import sys
 import os
 import dill as pickle
 import utils
-import pathos.multiprocessing as mp
+import TrackStore
+import DensePool
+import WindowPool
+import RunningMoments
+import PoolCache
+import WrangleExecutor
+import TrackFilters
+import ibeoCSVImporter
+import functools
+import copy
 
 # Class to take a list of continuous, contiguous data logs that need to be collated and split for the batch handler
 # This generates sequences of proper lengths (history track and ground truth prediction track) in the parameters file
-# WARNING - ANY change to this file (including comments) invalidates the hash and the Wrangler runs again.
+# The pool cache is keyed on the code of the files below (but not their comments), the parameters that change the pool
+# and POOL_FORMAT_VERSION. Increment the version for a change that alters the pool in a way the code digest misses.
+POOL_FORMAT_VERSION = 1
+POOL_SOURCE_FILES = ['ibeoCSVImporter.py', 'SequenceWrangler.py', 'IntersectionGeometry.py', 'intersections.json',
+                     'DensePool.py', 'TrackStore.py', 'RunningMoments.py', 'WindowPool.py', 'TrackFilters.py']
 
 
 class SequenceWrangler:
-    def __init__(self, parameters, sourcename, n_folds=5, training=0.55, val=0.2, test=0.25):
+    def __init__(self, parameters, sourcename, n_folds=5, training=0.55, val=0.2, test=0.25, pool_dir='data_pool'):
         self.n_folds = n_folds
         self.parameters = parameters.parameters
+        # The importer settings are read from the same parameters
+        self.ingest_parameters = parameters
         #TODO Normalize the below splits
         self.training_split = training
         self.val_split = val
         self.test_split = test
-        self.pool_dir = 'data_pool'
+        self.pool_dir = pool_dir
         self.sourcename = sourcename
         self.trainval_idxs = None
         self.test_idxs = None
         self.encoder_means = None
         self.encoder_vars = None
         self.encoder_stddev = None
+        self.encoder_moments = None
+        # The array backed pool that master_pool is a view of, a DensePool or a WindowPool
+        self.dense_pool = None
+        # See get_track_store_name
+        self.track_store_name = None
+        try:
+            pool_cache_max_bytes = self.parameters['pool_cache_max_bytes']
+        except KeyError:
+            pool_cache_max_bytes = None
+        self.pool_cache = PoolCache.PoolCache(self.pool_dir, pool_cache_max_bytes)
         return
 
+    def get_pool_inputs(self):
+        # Everything the ibeo master pool depends on. The tracks are identified by the name the importer keeps them
+        # under, which changes with the contents of the recordings and the ingest settings, or by data_filename.
+        return {'format_version': POOL_FORMAT_VERSION,
+                'sources': list(self.sourcename),
+                'data_filename': self.parameters.get('data_filename'),
+                'track_store': self.get_track_store_name(),
+                'code': utils.get_source_digest(POOL_SOURCE_FILES),
+                'ibeo_data_columns': list(self.parameters['ibeo_data_columns']),
+                'observation_steps': self.parameters['observation_steps'],
+                'prediction_steps': self.parameters['prediction_steps'],
+                'subsample': self.parameters.get('subsample'),
+                'track_padding': self.parameters.get('track_padding'),
+                'track_filters': [track_filter.describe()
+                                  for track_filter in TrackFilters.get_track_filters(self.parameters)]}
+
+    def get_track_store_name(self):
+        # Found once, as the recordings are fingerprinted to find it
+        if self.track_store_name is None:
+            self.track_store_name = ibeoCSVImporter.get_track_store_name(self.ingest_parameters, self.sourcename)
+        return self.track_store_name
+
     def get_pool_filename(self):
         ibeo = True
         if ibeo:
             filename = "pool_ckpt_ibeo_" + \
                        ''.join([x[0] + x[-1] + '-' for x in self.parameters['ibeo_data_columns']]) + \
                        "obs-" + str(self.parameters["observation_steps"]) + \
-                       "_pred-" + str(self.parameters["prediction_steps"]) + \
-                        str(hash(tuple(self.sourcename))
-                            + hash(self.parameters['reject_stopped_vehicles_before_intersection_enable'])
-                            + hash(self.parameters['reject_stopped_vehicles_before_intersection_speed'])
-                            + hash(self.parameters['reject_stopped_vehicles_before_intersection_duration'])
-                            + utils.get_library_hash()) + \
+                       "_pred-" + str(self.parameters["prediction_steps"]) + "-" + \
+                       utils.get_value_fingerprint(self.get_pool_inputs()) + \
                        ".pkl"
         else:
             filename = "pool_ckpt_" +\
@@ -52,64 +95,139 @@ class SequenceWrangler:
 
         return filename
 
+    def get_pool_name(self):
+        # Name of the pool in the cache manifest, and the stem of its files
+        return os.path.splitext(self.get_pool_filename())[0]
+
+    def get_dense_pool_path(self):
+        return os.path.join(self.pool_dir, self.get_pool_name() + '.dense')
+
+    def get_window_pool_path(self):
+        return os.path.join(self.pool_dir, self.get_pool_name() + '.windows')
+
+    def _use_window_pool(self):
+        try:
+            return self.parameters['lazy_window_pool']
+        except KeyError:
+            return False
+
+    def get_moments_path(self):
+        return os.path.join(self.pool_dir, self.get_pool_name() + '.moments.json')
+
     def load_from_checkpoint(self,):
         #Function that returns True if data can be loaded, else false.
 
         if not os.path.exists(self.pool_dir):
             return False
+        # The pool is memory mapped, so the samples are only read as they are used. Either layout is used if it is
+        # there, the window pool first if that is the one asked for.
+        pool_layouts = [(DensePool.DensePool, self.get_dense_pool_path()),
+                        (WindowPool.WindowPool, self.get_window_pool_path())]
+        if self._use_window_pool():
+            pool_layouts.reverse()
+        for pool_class, pool_path in pool_layouts:
+            self.dense_pool = pool_class.load(pool_path)
+            if self.dense_pool is not None:
+                break
+        if self.dense_pool is not None:
+            print "Reading pool cache from disk..."
+            self.master_pool = self.dense_pool.to_frame()
+            self._load_encoder_moments()
+            self.pool_cache.touch(self.get_pool_name(), [os.path.basename(pool_path),
+                                                         os.path.basename(self.get_moments_path())])
+            print self.pool_cache.report()
+            return True
+        # Else the pickle of earlier versions
         file_path = os.path.join(self.pool_dir, self.get_pool_filename())
         file_exists = os.path.isfile(file_path)
         if not file_exists:
             return False
         print "Reading pool cache from disk..."
         self.master_pool = pd.read_pickle(file_path)
+        self._load_encoder_moments()
+        self.pool_cache.touch(self.get_pool_name(), [self.get_pool_filename(),
+                                                     os.path.basename(self.get_moments_path())])
 
         return True
 
-    def load_splits_from_checkpoint(self, filename):
+    def _save_master_pool(self, window_pool=None):
+        # window_pool is the WindowPool the master pool was made from. Without one, the master pool is saved as a
+        # DensePool.
         if not os.path.exists(self.pool_dir):
-            return False
-        file_path = os.path.join(self.pool_dir, filename)
-        file_exists = os.path.isfile(file_path)
-        if not file_exists:
-            return False
-        print "Reading cached crossfold pool data..."
-        with open(file_path, 'rb') as pkl_file:
-            try:
-                from_pickle = pickle.load(pkl_file)
-            except ImportError:
-                print "Cache miss due to incompatible pandas version between saving and loading"
-                return False
-            self.crossfold_pool = from_pickle['crossfold_pool']
-            self.test_pool = from_pickle['test_pool']
-            return True
+            os.makedirs(self.pool_dir)
+        if window_pool is not None:
+            pool_path = self.get_window_pool_path()
+            self.dense_pool = window_pool
+        else:
+            pool_path = self.get_dense_pool_path()
+            self.dense_pool = DensePool.DensePool.from_frame(self.master_pool)
+        self.dense_pool.save(pool_path)
+        # The normalization parameters are saved with the pool, so a pool loaded from disk has them without another
+        # pass over the samples
+        self.encoder_moments = self._compute_encoder_moments()
+        self.encoder_moments.save(self.get_moments_path())
+        self._set_encoder_stats()
+        self.pool_cache.add(self.get_pool_name(), [os.path.basename(pool_path),
+                                                   os.path.basename(self.get_moments_path())],
+                            description=self.get_pool_inputs())
+        print self.pool_cache.report()
+
+    def _load_encoder_moments(self):
+        self.encoder_moments = RunningMoments.RunningMoments.load(self.get_moments_path())
+        if self.encoder_moments is None:
+            # A pool saved before the moments were
+            self.encoder_moments = self._compute_encoder_moments()
+            self.encoder_moments.save(self.get_moments_path())
+        self._set_encoder_stats()
+
+    def _compute_encoder_moments(self):
+        # Every timestep of the pool is counted once: the first row of each encoder sample, as the samples of a
+        # track step along by one, and the remaining rows of the last sample.
+        # The samples are read in blocks, so the pool is never gathered all at once.
+        num_samples = len(self.master_pool)
+        if num_samples == 0:
+            raise ValueError("Cannot compute encoder normalization parameters of an empty pool. Were all tracks "
+                             "discarded?")
+        moments = None
+        for block_start in xrange(0, num_samples, 100000):
+            rows = np.arange(block_start, min(block_start + 100000, num_samples))
+            if self.dense_pool is not None:
+                encoder_samples = self.dense_pool.get_array('encoder_sample', rows)
+            else:
+                encoder_samples = np.stack(self.master_pool.encoder_sample.values[rows])
+            if moments is None:
+                moments = RunningMoments.RunningMoments(encoder_samples.shape[-1])
+            moments.update(encoder_samples[:, 0, :])
+        moments.update(encoder_samples[-1, 1:, :])
+        return moments
+
+    def _set_encoder_stats(self):
+        # Same dtype as the encoder samples
+        self.encoder_means = self.encoder_moments.get_mean().astype(np.float32)
+        self.encoder_vars = self.encoder_moments.get_var().astype(np.float32)
+        self.encoder_stddev = self.encoder_moments.get_std().astype(np.float32)
 
     def split_into_evaluation_pools(self, trainval_idxs=None, test_idxs=None, test_csv=None):
-        # I want to cache the pool concat
-        # So I need a unique id from master pool --> self.get_pool_filename
-        # I also want a unique id for the crossfold_indicies. Only if that is deterministic. I'll have to check
-        #
+        # The crossfold and test pools are selected by track from the master pool. The rows of each sub-pool are
+        # also kept as self.crossfold_rows and self.test_rows
         seed = 42296 #np.random.randint(4294967296)
         print "Using seed: " + str(seed) + " for test/train split"
 
-        encoder_pool = []
-        for encoder_data in self.master_pool.encoder_sample.iteritems():
-            encoder_values = encoder_data[1]
-            encoder_pool.append(encoder_values[0])
-            last_encoder = encoder_values
-        encoder_pool.extend(encoder_values[1:])
-        encoder_pool = np.array(encoder_pool)
-
-        #Compute averages here
-        self.encoder_means = np.mean(encoder_pool, axis=0)
-        self.encoder_vars = np.var(encoder_pool, axis=0)
-        self.encoder_stddev = np.std(encoder_pool, axis=0)
+        # Normally computed when the pool was generated or loaded
+        if self.encoder_moments is None:
+            self.encoder_moments = self._compute_encoder_moments()
+            self._set_encoder_stats()
 
         print "Encoder means: " + str(self.encoder_means)
         print "Encoder vars: " + str(self.encoder_vars)
         print "Encoder standard deviations: " + str(self.encoder_stddev)
 
-        raw_indices = self.master_pool.track_idx.unique()
+        # Index the rows of every track once. Tracks are in order of first appearance, rows in pool order.
+        track_codes, raw_indices = pd.factorize(self.master_pool.track_idx.values)
+        track_rows = np.argsort(track_codes, kind='mergesort')
+        track_lengths = np.bincount(track_codes, minlength=len(raw_indices))
+        # By construction, the labels are consistent across all sample values for a track, so use its first row
+        track_first_rows = track_rows[np.append(0, np.cumsum(track_lengths)[:-1])]
 
         # origin_destination_class_list = self.master_pool.track_class.unique()
 
@@ -119,12 +237,7 @@ class SequenceWrangler:
             class_to_fit = 'track_class'
 
         # rebuild track_class vector
-        raw_classes = []
-        for raw_idx in raw_indices:
-            #Get the first results that matches the track_idx and return its destination class
-            #by construction, this data is consistent across all sample values for that track
-            track_class = self.master_pool[self.master_pool.track_idx==raw_idx][class_to_fit].unique()
-            raw_classes.append(track_class[0])
+        raw_classes = list(self.master_pool[class_to_fit].values[track_first_rows])
 
         st_encoder = preprocessing.LabelEncoder()
         st_encoder.fit(raw_classes)
@@ -134,15 +247,11 @@ class SequenceWrangler:
             # if we are not loading a model from a checkpoint
             if test_csv is not None:
                 # if we are doing a full intersection holdout.
-                self.trainval_idxs = []
-                self.test_idxs = []
-                for track_idx in raw_indices:
-                    if test_csv in self.master_pool[self.master_pool.track_idx == track_idx]['csv_name'].unique()[0]:
-                        self.test_idxs.append(track_idx)
-                    else:
-                        self.trainval_idxs.append(track_idx)
-                self.test_idxs = np.array(self.test_idxs)
-                self.trainval_idxs = np.array(self.trainval_idxs)
+                is_test = np.array([test_csv in csv_name
+                                    for csv_name in self.master_pool['csv_name'].values[track_first_rows]],
+                                   dtype=bool)
+                self.test_idxs = raw_indices[is_test]
+                self.trainval_idxs = raw_indices[~is_test]
             else:
                 self.trainval_idxs, self.test_idxs = train_test_split(raw_indices,  # BREAK HERE
                                                         test_size=self.test_split,
@@ -152,62 +261,32 @@ class SequenceWrangler:
             self.trainval_idxs = trainval_idxs
             self.test_idxs = test_idxs
 
-        # Cache the test/train/val splits. The concats take forever.
-        cache_name = self.get_pool_filename() + '-' + str(abs(hash(tuple(self.trainval_idxs))
-                                                              + utils.get_library_hash())) + '.pkl'
-        if not self.load_splits_from_checkpoint(cache_name):
-            print "Crossfold cache miss, calculating splits and making sub-pools"
-            #cache miss
-            crossfold_idx_lookup = np.array(self.trainval_idxs)
-
-            #Now I need the class of each track in trainval_idx
-            trainval_class = []
-            for trainval_idx in self.trainval_idxs:
-                track_class = self.master_pool[self.master_pool.track_idx==trainval_idx]['track_class'].unique()
-                trainval_class.append(track_class[0])
-
-            skf = StratifiedKFold(n_splits=self.n_folds,random_state=seed)
-            crossfold_indicies = [list(skf.split(self.trainval_idxs, trainval_class))[0]] # I only use one fold anyway
-            crossfold_pool = [[[], []] for x in xrange(self.n_folds)]
-            test_pool = []
-
-            #Now iterate over each track, and dump it into the apropriate crossfold sub-pool or test pool
-            for track_raw_idx in raw_indices:
-                # For each pool
-                for fold_idx in range(len(crossfold_indicies)):
-                    # For train or validate in the pool
-                    for trainorval_pool_idx in range(len(crossfold_indicies[fold_idx])):
-                        # If the crossfold_list index of the track matches
-                        if track_raw_idx in crossfold_idx_lookup[crossfold_indicies[fold_idx][trainorval_pool_idx]]:
-
-                            #Here, I want to append all data in the master pool that is from the track
-                            crossfold_pool[fold_idx][trainorval_pool_idx].append(
-                                self.master_pool[self.master_pool['track_idx']==track_raw_idx]
-                            )
-                            #print "Added track " + str(track_raw_idx) + " to cf pool " + str(fold_idx) + \
-                            #      (" train" if trainorval_pool_idx is 0 else " test")
-                # else it must exist in the test_pool
-                if track_raw_idx in self.test_idxs:
-                    test_pool.append(
-                            self.master_pool[self.master_pool['track_idx'] == track_raw_idx]
-                    )
-                    #print "Added track " + str(track_raw_idx) + " to test pool"
-
-            print "concatenating pools"
-            for fold_idx in range(len(crossfold_indicies)):
-                for trainorval_pool_idx in range(len(crossfold_indicies[fold_idx])):
-                    crossfold_pool[fold_idx][trainorval_pool_idx] = pd.concat(crossfold_pool[fold_idx][trainorval_pool_idx])
-
-            self.crossfold_pool = crossfold_pool
-            self.test_pool = pd.concat(test_pool)
-
-            to_pickle = {}
-            to_pickle['crossfold_pool'] = crossfold_pool
-            to_pickle['test_pool'] = pd.concat(test_pool)
-            file_path = os.path.join(self.pool_dir, cache_name)
-            with open(file_path, 'wb') as pkl_file:
-                pickle.dump(to_pickle, pkl_file)
-            print "wrote crossfolding cache"
+        def _rows_of_tracks(track_idxs):
+            # Rows of the master pool that belong to any of track_idxs, in track order then pool order.
+            return track_rows[np.repeat(np.in1d(raw_indices, track_idxs), track_lengths)]
+
+        crossfold_idx_lookup = np.array(self.trainval_idxs)
+
+        #Now I need the class of each track in trainval_idx
+        track_class = self.master_pool['track_class'].values[track_first_rows]
+        trainval_class = list(track_class[pd.Index(raw_indices).get_indexer(crossfold_idx_lookup)])
+
+        skf = StratifiedKFold(n_splits=self.n_folds,random_state=seed)
+        crossfold_indicies = [list(skf.split(self.trainval_idxs, trainval_class))[0]] # I only use one fold anyway
+
+        # Each sub-pool is a single selection of rows from the master pool.
+        self.crossfold_rows = [[[], []] for x in xrange(self.n_folds)]
+        crossfold_pool = [[[], []] for x in xrange(self.n_folds)]
+        for fold_idx in range(len(crossfold_indicies)):
+            # For train or validate in the pool
+            for trainorval_pool_idx in range(len(crossfold_indicies[fold_idx])):
+                rows = _rows_of_tracks(crossfold_idx_lookup[crossfold_indicies[fold_idx][trainorval_pool_idx]])
+                self.crossfold_rows[fold_idx][trainorval_pool_idx] = rows
+                crossfold_pool[fold_idx][trainorval_pool_idx] = self.master_pool.iloc[rows]
+        self.test_rows = _rows_of_tracks(self.test_idxs)
+
+        self.crossfold_pool = crossfold_pool
+        self.test_pool = self.master_pool.iloc[self.test_rows]
         return
 
     # This function will generate the data pool for the dataset from the natualistic driving data set.
@@ -277,10 +356,7 @@ class SequenceWrangler:
                 continue
 
         self.master_pool = pd.concat(master_pool)
-        if not os.path.exists(self.pool_dir):
-            os.makedirs(self.pool_dir)
-        file_path = os.path.join(self.pool_dir, self.get_pool_filename())
-        self.master_pool.to_pickle(file_path)
+        self._save_master_pool()
 
         return
 
@@ -320,10 +396,24 @@ class SequenceWrangler:
 
         return single_track
 
-    def _split_and_slice_tracks_multiprocess_helper(self, args):
-        return self._split_and_slice_tracks(*args)
+    def _prepare_track(self, single_track, track_raw_idx, data_columns, track_filters):
+        # The part of wrangling that does not depend on the observation or prediction length. Returns the filtered,
+        # subsampled track, or None if it is rejected.
+
+        # Filters such as rejecting vehicles that stopped before the intersection. See TrackFilters.
+        for track_filter in track_filters:
+            if not track_filter.accepts(single_track):
+                # Reject track.
+                return None
+
+        single_track = single_track.iloc[::self.parameters['subsample']]
+        return single_track[data_columns]
 
-    def _split_and_slice_tracks(self, single_track, track_raw_idx, des_encoder, dest_1hot_enc, data_columns):
+    def _window_track(self, single_track, track_idx, track_raw_idxs, des_encoder, dest_1hot_enc, data_columns,
+                      horizons, windows=True):
+        # Slice a prepared track into samples, for each (observation_steps, prediction_steps) in horizons.
+        # With windows=False, the samples are not sliced out. Each horizon gives the track's windows for
+        # WindowPool.from_tracks instead, or None if the track is too short.
 
         # Forces continuity b/w crossfold template and test template
         def _generate_ibeo_template(track_idx, track_class, origin, destination, destination_vec):
@@ -339,62 +429,153 @@ class SequenceWrangler:
                                  }, index=[0])
 
         # Lookup the index in the original collection
-        # Get data
-        # rint "Wrangling track: " + str(track_raw_idx) + " of: " + str(len(ibeo_track_list))
-        sys.stdout.write("\rWrangling track:  %04d" % (track_raw_idx))
-        sys.stdout.flush()
-
-        wrangle_time = time.time()
-        #single_track = ibeo_track_list[track_raw_idx]
-
-        # If we want to filter tracks based on whether they came to a complete stop before the intersection, and are
-        # therefore unpredictable. It is an extremely hard problem to predict when a car will start going again,
-        # but a stationary car is a safe car, so we omit these from the data.
-        if self.parameters['reject_stopped_vehicles_before_intersection_enable']:
-            stop_length = int(25 * self.parameters['reject_stopped_vehicles_before_intersection_duration'])
-            stop_speed = self.parameters['reject_stopped_vehicles_before_intersection_speed']
-            track_before_intersection = single_track[single_track.distance < 0]  # Consider making this 1 or 2 or settable
-            for search_idx in range(len(track_before_intersection) - stop_length):
-                # if the car has stopped for too long before entering the intersection
-                if all(track_before_intersection.iloc[search_idx:search_idx + stop_length].AbsVelocity < stop_speed):
-                    # Reject track.
-                    return None
-
-
-        single_track = single_track.iloc[::self.parameters['subsample']]
-        # Pad end of tracks with the last value, and flag it is padding
-        if self.parameters['track_padding']:
-            single_track = self._pad_single_track(single_track, self.parameters['prediction_steps'])
-        origin = single_track.iloc[0]['origin']
-        destination = single_track.iloc[0]['destination']
-        destination_vec = des_encoder.transform([destination])
-        # Limit the df to only meaningful data
-        data_for_encoders = self._extract_ibeo_data_for_encoders(single_track)
-
-        # Do not scale here. Scaling is to be done as the first network layer.
-        df_template = _generate_ibeo_template(track_raw_idx, origin + "-" + destination, origin, destination,
-                                              destination_vec)
-        # Instead, I am going to give the new track slicer a list for distance, as I have pre-computed it.
-
-        track_pool = self._track_slicer(data_for_encoders,
-                                        self.parameters['observation_steps'],
-                                        self.parameters['prediction_steps'],
-                                        df_template,  # Metadata that is static across the whole track
-                                        distance=single_track['distance'],  # metadata that changes in the track.
-                                        distance_to_exit=single_track['distance_to_exit'],
-                                        additional_df=single_track[data_columns],
-                                        # Everything else. Useful for post network analysis
-                                        padding_vec=single_track['trackwise_padding'])
-        return track_pool
-
-    def generate_master_pool_ibeo(self, ibeo_track_list):
+        track_raw_idx = track_raw_idxs[track_idx]
+        track_pools = []
+        for observation_steps, prediction_steps in horizons:
+            horizon_track = single_track
+            # Pad end of tracks with the last value, and flag it is padding
+            if self.parameters['track_padding']:
+                horizon_track = self._pad_single_track(horizon_track, prediction_steps)
+            origin = horizon_track.iloc[0]['origin']
+            destination = horizon_track.iloc[0]['destination']
+            destination_vec = des_encoder.transform([destination])
+            # Limit the df to only meaningful data
+            data_for_encoders = self._extract_ibeo_data_for_encoders(horizon_track)
+
+            # Do not scale here. Scaling is to be done as the first network layer.
+            df_template = _generate_ibeo_template(track_raw_idx, origin + "-" + destination, origin, destination,
+                                                  destination_vec)
+            # Instead, I am going to give the new track slicer a list for distance, as I have pre-computed it.
+
+            track_pool = self._track_slicer(data_for_encoders,
+                                            observation_steps,
+                                            prediction_steps,
+                                            df_template,  # Metadata that is static across the whole track
+                                            distance=horizon_track['distance'],  # metadata that changes in the track.
+                                            distance_to_exit=horizon_track['distance_to_exit'],
+                                            additional_df=horizon_track[data_columns],
+                                            # Everything else. Useful for post network analysis
+                                            padding_vec=horizon_track['trackwise_padding'],
+                                            windows=windows)
+            if not windows:
+                track_pool = self._get_track_windows(track_pool, df_template, data_for_encoders,
+                                                     horizon_track['trackwise_padding'].values)
+            track_pools.append(track_pool)
+        return track_pools
+
+    def _get_track_windows(self, metadata_df, df_template, track_data, track_padding):
+        # The windows of a track for WindowPool.from_tracks, from the metadata _track_slicer made without windows
+        if len(metadata_df) == 0:
+            return None
+        # The window columns follow the template columns, as they do in the sample frame
+        num_template_columns = len(df_template.columns)
+        column_names = list(metadata_df.columns[:num_template_columns]) + WindowPool.WINDOW_COLUMNS + \
+            list(metadata_df.columns[num_template_columns:])
+        # One destination per track
+        dest_1_hot = df_template['dest_1_hot'].values[0]
+        return {'column_names': column_names,
+                'track_data': track_data,
+                'track_padding': track_padding,
+                'metadata': metadata_df.drop('dest_1_hot', axis=1),
+                'arrays': {'dest_1_hot': np.tile(dest_1_hot, (len(metadata_df), 1))}}
+
+    def get_prepared_tracks_path(self):
+        # The prepared tracks do not depend on the observation or prediction length, so they are shared by every pool
+        # made from the same tracks.
+        prepared_inputs = self.get_pool_inputs()
+        del prepared_inputs['observation_steps']
+        del prepared_inputs['prediction_steps']
+        return os.path.join(self.pool_dir, "tracks_ckpt_ibeo_" + utils.get_value_fingerprint(prepared_inputs) +
+                            ".tracks")
+
+    def _get_executor(self):
+        # Workers read the tracks from a memory mapped store, by track index. None or 0 workers uses every core.
+        try:
+            wrangle_workers = self.parameters['wrangle_workers']
+        except KeyError:
+            wrangle_workers = None
+        try:
+            wrangle_chunk_tracks = self.parameters['wrangle_chunk_tracks']
+        except KeyError:
+            wrangle_chunk_tracks = None
+        return WrangleExecutor.WrangleExecutor(wrangle_workers, wrangle_chunk_tracks, temp_dir=self.pool_dir)
+
+    def _get_data_columns(self):
+        # Don't put everything in the pool, it takes forever.
+        data_columns = ['index', 'ObjectId', 'Timestamp', 'ObjectPredAge', 'Classification',
+          'ObjBoxOrientation', 'csv_name',
+          'Object_X', 'Object_Y', 'uniqueId', 'origin',
+          'destination', 'AbsVelocity', 'distance', 'distance_to_exit',
+                        'relative_destination', 'relative_x','relative_y','relative_angle']
+        data_columns.extend(self.parameters['ibeo_data_columns'])
+        return list(set(data_columns))
+
+    def _prepare_tracks(self, ibeo_track_list):
+        # The filtered and subsampled tracks, as a memory mapped TrackStore. They are cached in the pool directory,
+        # so a change of observation or prediction length only has to window them again.
+        prepared_path = self.get_prepared_tracks_path()
+        prepared_tracks = TrackStore.TrackStore.load(prepared_path)
+        if prepared_tracks is not None:
+            print "Reading prepared tracks from disk..."
+            self.pool_cache.touch(os.path.basename(prepared_path), [os.path.basename(prepared_path)])
+            return prepared_tracks
 
         # get the unique list of origins and destinations:
         # Add all the first rows of each track
-        labelling_list = [track.iloc[0] for track in ibeo_track_list]
-        labelling_df = pd.concat(labelling_list)
-        destinations = labelling_df["destination"].unique()
-        origins = labelling_df["origin"].unique()
+        if isinstance(ibeo_track_list, TrackStore.TrackStore):
+            # Labels can be read from the (memory mapped) columns without building every track
+            destinations = pd.unique(ibeo_track_list.first_values("destination"))
+        else:
+            labelling_list = [track.iloc[0] for track in ibeo_track_list]
+            labelling_df = pd.concat(labelling_list)
+            destinations = labelling_df["destination"].unique()
+
+        # The normalization parameters are computed from the samples of each pool, and saved with it. See
+        # _compute_encoder_moments.
+
+        executor = self._get_executor()
+        print "Preparing " + str(len(ibeo_track_list)) + " tracks with " + str(executor.workers) + " workers"
+        prepared_list = executor.map_tracks(functools.partial(self._prepare_track,
+                                                              data_columns=self._get_data_columns(),
+                                                              track_filters=TrackFilters.get_track_filters(
+                                                                  self.parameters)),
+                                            ibeo_track_list, label="Preparing track")
+        track_raw_idxs = [track_raw_idx for track_raw_idx in range(len(prepared_list))
+                          if prepared_list[track_raw_idx] is not None]
+        # The labels of every track, rejected or not, so the encoders are the same as for the full track list
+        attributes = {'num_tracks': len(ibeo_track_list),
+                      'track_raw_idxs': track_raw_idxs,
+                      'destinations': list(destinations)}
+        if not os.path.exists(self.pool_dir):
+            os.makedirs(self.pool_dir)
+        TrackStore.TrackStore.from_track_list([prepared_list[track_raw_idx] for track_raw_idx in track_raw_idxs],
+                                              attributes).save(prepared_path)
+        self.pool_cache.add(os.path.basename(prepared_path), [os.path.basename(prepared_path)])
+        return TrackStore.TrackStore.load(prepared_path)
+
+    def _for_horizon(self, observation_steps, prediction_steps):
+        # A wrangler for the same tracks with another observation and prediction length
+        wrangler = copy.copy(self)
+        wrangler.parameters = dict(self.parameters)
+        wrangler.parameters['observation_steps'] = observation_steps
+        wrangler.parameters['prediction_steps'] = prediction_steps
+        return wrangler
+
+    def generate_master_pool_ibeo(self, ibeo_track_list, extra_horizons=None):
+        # extra_horizons is a list of further (observation_steps, prediction_steps) to make pools for in the same pass
+        # over the tracks. Their pools are saved to the pool directory, to be loaded by a wrangler with those
+        # parameters. It defaults to parameters['wrangle_extra_horizons'].
+        if extra_horizons is None:
+            try:
+                extra_horizons = self.parameters['wrangle_extra_horizons']
+            except KeyError:
+                extra_horizons = []
+        horizons = [(self.parameters['observation_steps'], self.parameters['prediction_steps'])]
+        horizons.extend([tuple(horizon) for horizon in extra_horizons if tuple(horizon) != horizons[0]])
+
+        prepared_tracks = self._prepare_tracks(ibeo_track_list)
+        # json gives back unicode
+        destinations = [str(destination) for destination in prepared_tracks.attributes['destinations']]
 
         # Convert destination into a list of indicies
         des_encoder = preprocessing.LabelEncoder()
@@ -412,65 +593,39 @@ class SequenceWrangler:
         that both are picked with an even dataset.
         """
 
-        #COMPUTE NORM PARAMS HERE
-        # 1 - Collect all the encoder data. Ever.
-        # 2 - computer normalization parameters.
-        # 3 - save these parameters -- to be pickled for the batchhandler, or pre-computed here?
-        #       Either way, they need to be saved somewhere, and coupled with the data_pool
-
-        print "Computing batch normalization parameters."
-        encoder_data = np.empty([0,len(self.parameters["ibeo_data_columns"])])
-        for track_raw_idx in range(len(ibeo_track_list)):
-            single_track = ibeo_track_list[track_raw_idx]
-            data_for_encoders = self._extract_ibeo_data_for_encoders(single_track)
-            encoder_data = np.append(encoder_data,data_for_encoders,axis=0)
-        #encoder_data = pd.concat(encoder_data_list)
-        encoder_means = np.mean(encoder_data, axis=0)
-        encoder_vars = np.var(encoder_data, axis=0)
-        encoder_stddev = np.std(encoder_data, axis=0)
-
-        print "Encoder means: " + str(encoder_means)
-        print "Encoder vars: " + str(encoder_vars)
-        print "Encoder standard deviations: " + str(encoder_stddev)
-
-        master_pool = []
-        # Don't put everything in the pool, it takes forever.
-        data_columns = ['index', 'ObjectId', 'Timestamp', 'ObjectPredAge', 'Classification',
-          'ObjBoxOrientation', 'csv_name',
-          'Object_X', 'Object_Y', 'uniqueId', 'origin',
-          'destination', 'AbsVelocity', 'distance', 'distance_to_exit',
-                        'relative_destination', 'relative_x','relative_y','relative_angle']
-        data_columns.extend(self.parameters['ibeo_data_columns'])
-        data_columns = list(set(data_columns))
-
-        pool = mp.Pool(processes=7)
-        args = []
-        # For all tracks
-        for track_raw_idx in range(len(ibeo_track_list)):
-
-            single_track = ibeo_track_list[track_raw_idx]
-            args.append([single_track, track_raw_idx, des_encoder, dest_1hot_enc, data_columns])
-            #_split_and_slice_tracks_multiprocess_helper
-            #track_pool = self._split_and_slice_tracks(single_track, track_raw_idx, des_encoder, dest_1hot_enc, data_columns)
-
-            #master_pool.append(track_pool)
-                #print "wrangle time: " + str(time.time()-wrangle_time)
-        master_pool = pool.map(self._split_and_slice_tracks_multiprocess_helper, args)
-
-        sys.stdout.write("\t\t\t\t%4s" % "[ OK ]")
-        sys.stdout.write("\r\n")
-        sys.stdout.flush()
-
-        self.master_pool = pd.concat(master_pool)
-        discarded_tracks = len(ibeo_track_list) - len(self.master_pool.track_idx.unique())
-        print "Discarded " + str(discarded_tracks) + " tracks"
-        print "Passed " + str(len(self.master_pool.track_idx.unique())) + " tracks"
+        executor = self._get_executor()
+        print "Wrangling " + str(len(prepared_tracks)) + " tracks with " + str(executor.workers) + " workers"
+        track_pools = executor.map_tracks(functools.partial(self._window_track,
+                                                            track_raw_idxs=prepared_tracks.attributes['track_raw_idxs'],
+                                                            des_encoder=des_encoder,
+                                                            dest_1hot_enc=dest_1hot_enc,
+                                                            data_columns=self._get_data_columns(),
+                                                            horizons=horizons,
+                                                            # The window pool never needs the samples sliced out
+                                                            windows=not self._use_window_pool()),
+                                          prepared_tracks)
+
+        for horizon_idx in range(len(horizons)):
+            if horizon_idx == 0:
+                wrangler = self
+            else:
+                wrangler = self._for_horizon(*horizons[horizon_idx])
+                print "Pool for observation_steps " + str(horizons[horizon_idx][0]) + \
+                      ", prediction_steps " + str(horizons[horizon_idx][1])
+            window_pool = None
+            if self._use_window_pool():
+                # Each track is stored once, and the master pool is windows onto it, as when it is loaded
+                window_pool = WindowPool.WindowPool.from_tracks(
+                    [track_pool[horizon_idx] for track_pool in track_pools if track_pool[horizon_idx] is not None],
+                    *horizons[horizon_idx])
+                wrangler.master_pool = window_pool.to_frame()
+            else:
+                wrangler.master_pool = pd.concat([track_pool[horizon_idx] for track_pool in track_pools])
+            discarded_tracks = prepared_tracks.attributes['num_tracks'] - len(wrangler.master_pool.track_idx.unique())
+            print "Discarded " + str(discarded_tracks) + " tracks"
+            print "Passed " + str(len(wrangler.master_pool.track_idx.unique())) + " tracks"
 
-        #TODO save master to pickle
-        if not os.path.exists(self.pool_dir):
-            os.makedirs(self.pool_dir)
-        file_path = os.path.join(self.pool_dir, self.get_pool_filename())
-        self.master_pool.to_pickle(file_path)
+            wrangler._save_master_pool(window_pool)
 
         return
 
@@ -545,8 +700,11 @@ class SequenceWrangler:
     #   For example: destination label, or vehicle type etc.
     # additional DF is any data that changes per training sample. Padding is a special case, as it changes per data sample, not
     # per training sample
+    # With windows=False the encoder_sample, decoder_sample and trackwise_padding columns are left out, for a
+    # WindowPool that gathers them from the track itself.
     def _track_slicer(self, track, encoder_steps, decoder_steps, df_template,
-                      bbox=None,distance=None,distance_to_exit=None, additional_df=None, padding_vec=None):
+                      bbox=None,distance=None,distance_to_exit=None, additional_df=None, padding_vec=None,
+                      windows=True):
         """
         creates new data frame based on previous observation
           * example:
@@ -564,31 +722,62 @@ class SequenceWrangler:
         if bbox is not None:
             dis = self._dis_from_ref_line(track, bbox)
 
-        sample_collection = []
-        for i in range(len(track) - (encoder_steps+decoder_steps)+1):
-            sample_dataframe = df_template.copy()
-            sample_dataframe["encoder_sample"] = pd.Series([track[i: i + encoder_steps]], dtype=object)
-            sample_dataframe["decoder_sample"] = pd.Series([track[i + encoder_steps:i + (encoder_steps + decoder_steps)]],
-                                                           dtype=object)
-            if padding_vec is not None:
-                # .values --> Pandas tries to be smart later, and it just breaks my indexing
-                sample_dataframe["trackwise_padding"] = pd.Series([padding_vec.values[i + encoder_steps:i + (encoder_steps + decoder_steps)]],
-                                                           dtype=object)
-            if bbox is not None:
-                sample_dataframe["distance"] = dis[i+encoder_steps-1]  # distance for the last element given to encoder
-            if distance is not None:
-                sample_dataframe["distance"] = distance[i+encoder_steps-1]
-            if distance_to_exit is not None:
-                sample_dataframe["distance_to_exit"] = distance_to_exit[i+encoder_steps-1]
-            if additional_df is not None:
-                for col_name in additional_df.columns:
-                    if col_name is 'distance' or col_name is 'distance_to_exit':
-                        continue
-                    sample_dataframe[col_name] = additional_df[col_name][i+encoder_steps-1]
-            sample_dataframe["track_time_idx"] = i
-
-            sample_collection.append(pd.DataFrame(sample_dataframe))
-        return pd.concat(sample_collection)
+        # All windows are made at once. The encoder/decoder samples of each window are views into the track array,
+        # and the per window metadata is gathered as whole columns.
+        track = np.asarray(track)
+        num_samples = len(track) - (encoder_steps+decoder_steps)+1
+        # Position of the last element given to the encoder
+        last_encoder_idx = np.arange(num_samples) + encoder_steps - 1
+
+        def _windows(values, start, length):
+            # [num_samples, length, ...] strided view, window i is values[start + i:start + i + length]
+            values = values[start:]
+            return np.lib.stride_tricks.as_strided(values, shape=(num_samples, length) + values.shape[1:],
+                                                   strides=(values.strides[0],) + values.strides)
+
+        def _object_column(windows):
+            column = np.empty(num_samples, dtype=object)
+            for sample_idx in xrange(num_samples):
+                column[sample_idx] = windows[sample_idx]
+            return column
+
+        def _at_last_encoder_idx(series):
+            # The metadata series are looked up by index label, as they were one sample at a time.
+            positions = series.index.get_indexer(last_encoder_idx)
+            if (positions < 0).any():
+                raise KeyError(last_encoder_idx[positions < 0][0])
+            return series.values[positions]
+
+        sample_columns = [(col_name, np.repeat(df_template[col_name].values, num_samples))
+                          for col_name in df_template.columns]
+        if windows:
+            sample_columns.append(("encoder_sample", _object_column(_windows(track, 0, encoder_steps))))
+            sample_columns.append(("decoder_sample", _object_column(_windows(track, encoder_steps, decoder_steps))))
+        if padding_vec is not None and windows:
+            # .values --> Pandas tries to be smart later, and it just breaks my indexing
+            sample_columns.append(("trackwise_padding",
+                                   _object_column(_windows(padding_vec.values, encoder_steps, decoder_steps))))
+        if bbox is not None:
+            sample_columns.append(("distance", dis[last_encoder_idx]))  # distance for the last element given to encoder
+        if distance is not None:
+            sample_columns.append(("distance", _at_last_encoder_idx(distance)))
+        if distance_to_exit is not None:
+            sample_columns.append(("distance_to_exit", _at_last_encoder_idx(distance_to_exit)))
+        if additional_df is not None:
+            for col_name in additional_df.columns:
+                if col_name == 'distance' or col_name == 'distance_to_exit':
+                    continue
+                sample_columns.append((col_name, _at_last_encoder_idx(additional_df[col_name])))
+        sample_columns.append(("track_time_idx", np.arange(num_samples)))
+
+        # A later column of the same name replaces the earlier one, but keeps its position
+        column_names = []
+        column_values = {}
+        for col_name, values in sample_columns:
+            if col_name not in column_values:
+                column_names.append(col_name)
+            column_values[col_name] = values
+        return pd.DataFrame(column_values, columns=column_names, index=np.zeros(num_samples, dtype=np.int64))
 
     # unused?
     def split_sequence_collection(self, collection, encoder_steps, decoder_steps, labels):
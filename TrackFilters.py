@@ -0,0 +1,57 @@
+# Filters that reject whole tracks before they are sliced into samples.
+# A filter has accepts(track) -> bool and describe(), a json-able description of the filter and its settings that is
+# part of the pool cache key. get_track_filters builds the enabled filters from the parameters; a new filter only
+# needs a class here and an entry there.
+
+import numpy as np
+
+
+def has_run(mask, run_length):
+    # Whether mask has run_length consecutive True values, found with a single cumulative sum.
+    # As the original loop, a run that ends on the last element is not counted.
+    mask = np.asarray(mask, dtype=bool)
+    num_windows = len(mask) - run_length
+    if num_windows <= 0:
+        return False
+    true_count = np.append(0, np.cumsum(mask))
+    return bool(np.any(true_count[run_length:run_length + num_windows] - true_count[:num_windows] == run_length))
+
+
+class TrackFilter:
+    def accepts(self, track):
+        raise NotImplementedError
+
+    def describe(self):
+        raise NotImplementedError
+
+
+class StoppedBeforeIntersectionFilter(TrackFilter):
+    # Rejects tracks that came to a complete stop before the intersection, and are therefore unpredictable. It is an
+    # extremely hard problem to predict when a car will start going again, but a stationary car is a safe car, so we
+    # omit these from the data.
+    def __init__(self, stop_speed, stop_duration, sample_rate=25):
+        self.stop_speed = stop_speed
+        self.stop_duration = stop_duration
+        self.stop_length = int(sample_rate * stop_duration)
+
+    def accepts(self, track):
+        # NaN compares as False, as it did in pandas
+        with np.errstate(invalid='ignore'):
+            before_intersection = track.distance.values < 0  # Consider making this 1 or 2 or settable
+            speed = track.AbsVelocity.values[before_intersection]
+            # if the car has stopped for too long before entering the intersection
+            return not has_run(speed < self.stop_speed, self.stop_length)
+
+    def describe(self):
+        return {'filter': 'stopped_before_intersection',
+                'stop_speed': self.stop_speed,
+                'stop_duration': self.stop_duration}
+
+
+def get_track_filters(parameters):
+    track_filters = []
+    if parameters['reject_stopped_vehicles_before_intersection_enable']:
+        track_filters.append(StoppedBeforeIntersectionFilter(
+            parameters['reject_stopped_vehicles_before_intersection_speed'],
+            parameters['reject_stopped_vehicles_before_intersection_duration']))
+    return track_filters
@@ -0,0 +1,175 @@
+# Columnar storage for a list of tracks, where each track is a dataframe with the same columns.
+# Every column is held as one contiguous array across all tracks, with an offset index marking where each track starts.
+# String columns (csv_name, origin, destination etc.) are stored as categorical codes.
+# On disk a store is a directory of .npy files and a json description. It does not depend on the pandas version, and
+# can be memory mapped so that only the tracks that are used are read.
+#
+# The store behaves as a list of dataframes: len(store), store[i] and iteration all work, so it can be passed anywhere
+# that previously took the track list.
+
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+
+TRACK_STORE_VERSION = 1
+
+
+class TrackStore:
+    def __init__(self, column_names, columns, offsets, index, categories=None, attributes=None):
+        self.column_names = list(column_names)
+        # name -> array of values, or of codes into categories for string columns
+        self.columns = columns
+        self.offsets = offsets
+        # The dataframe index of every row
+        self.index = index
+        self.categories = {} if categories is None else categories
+        # Small amount of metadata that is saved with the store
+        self.attributes = {} if attributes is None else attributes
+        # Directory the store was loaded from, if any. Other processes can map the same store from there.
+        self.path = None
+
+    @classmethod
+    def from_track_list(cls, track_list, attributes=None):
+        lengths = [len(track) for track in track_list]
+        offsets = np.append(0, np.cumsum(lengths)).astype(np.int64)
+        if len(track_list) == 0:
+            return cls([], {}, offsets, np.empty(0, dtype=np.int64), attributes=attributes)
+        column_names = list(track_list[0].columns)
+        index = np.concatenate([track.index.values for track in track_list])
+        columns = {}
+        categories = {}
+        for name in column_names:
+            columns[name] = np.concatenate([track[name].values for track in track_list])
+            if columns[name].dtype == object:
+                columns[name], categories[name] = cls._encode(columns[name])
+        return cls(column_names, columns, offsets, index, categories, attributes)
+
+    @classmethod
+    def from_dataframe(cls, df, track_column, attributes=None):
+        # Split a single dataframe holding many tracks into a store, one track per value of track_column. Tracks are
+        # ordered by first appearance and rows keep their order and index labels within each track, the same as
+        # [df[df[track_column] == value] for value in df[track_column].unique()], but with a single sort.
+        codes, uniques = pd.factorize(df[track_column].values)
+        # Rows without a track value do not belong to any track
+        order = np.argsort(codes, kind='mergesort')
+        order = order[codes[order] >= 0]
+        lengths = np.bincount(codes[order], minlength=len(uniques))
+        offsets = np.append(0, np.cumsum(lengths)).astype(np.int64)
+        column_names = list(df.columns)
+        columns = {}
+        categories = {}
+        for name in column_names:
+            columns[name] = df[name].values[order]
+            if columns[name].dtype == object:
+                columns[name], categories[name] = cls._encode(columns[name])
+        return cls(column_names, columns, offsets, df.index.values[order], categories, attributes)
+
+    @classmethod
+    def concatenate(cls, stores):
+        # Join several stores into one. The categories of string columns are merged.
+        stores = [store for store in stores if len(store) > 0]
+        if len(stores) == 0:
+            return cls([], {}, np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64))
+        column_names = stores[0].column_names
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for store in stores:
+            offsets.append(store.offsets[1:] + offsets[-1][-1])
+        columns = {}
+        categories = {}
+        for name in column_names:
+            if name in stores[0].categories:
+                columns[name], categories[name] = cls._encode(
+                    np.concatenate([store.get_column(name) for store in stores]))
+            else:
+                columns[name] = np.concatenate([store.columns[name] for store in stores])
+        return cls(column_names, columns, np.concatenate(offsets),
+                   np.concatenate([store.index for store in stores]), categories)
+
+    @staticmethod
+    def _encode(values):
+        codes, uniques = pd.factorize(values)
+        return codes.astype(np.int32), np.asarray(uniques, dtype=object)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, track_idx):
+        if isinstance(track_idx, slice):
+            return [self[i] for i in range(*track_idx.indices(len(self)))]
+        if track_idx < 0:
+            track_idx += len(self)
+        if track_idx < 0 or track_idx >= len(self):
+            raise IndexError("track index out of range")
+        return self.get_rows(self.offsets[track_idx], self.offsets[track_idx + 1])
+
+    def __iter__(self):
+        for track_idx in range(len(self)):
+            yield self[track_idx]
+
+    def get_rows(self, start, end):
+        # Dataframe of the rows [start, end) of the concatenated tracks.
+        data = {}
+        for name in self.column_names:
+            data[name] = self._decode(name, self.columns[name][start:end])
+        return pd.DataFrame(data, index=np.asarray(self.index[start:end]), columns=self.column_names)
+
+    def get_column(self, name):
+        # A single column over all tracks.
+        return self._decode(name, self.columns[name])
+
+    def first_values(self, name):
+        # Value of a column at the first row of every track. Useful for per-track labels such as origin.
+        return self._decode(name, self.columns[name][self.offsets[:-1]])
+
+    def _decode(self, name, values):
+        if name in self.categories:
+            # Code -1 is a missing value, which is mapped to the NaN appended to the end
+            return np.append(self.categories[name], np.nan)[values]
+        return np.asarray(values)
+
+    def save(self, path):
+        # Write to a temporary directory and then move it into place, so an interrupted write is never loaded.
+        temp_path = path + '.tmp'
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        np.save(os.path.join(temp_path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(temp_path, 'index.npy'), self.index)
+        for column_idx, name in enumerate(self.column_names):
+            np.save(os.path.join(temp_path, 'column_%03d.npy' % column_idx), self.columns[name])
+        description = {'version': TRACK_STORE_VERSION,
+                       'column_names': self.column_names,
+                       'categories': dict((name, list(values)) for name, values in self.categories.iteritems()),
+                       'attributes': self.attributes}
+        with open(os.path.join(temp_path, 'store.json'), 'w') as json_file:
+            json.dump(description, json_file)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        # Returns None if there is no (compatible) store at path.
+        if not os.path.isfile(os.path.join(path, 'store.json')):
+            return None
+        with open(os.path.join(path, 'store.json'), 'r') as json_file:
+            description = json.load(json_file)
+        if description['version'] != TRACK_STORE_VERSION:
+            return None
+        # json gives back unicode
+        column_names = [str(name) for name in description['column_names']]
+        columns = {}
+        for column_idx, name in enumerate(column_names):
+            columns[name] = np.load(os.path.join(path, 'column_%03d.npy' % column_idx), mmap_mode=mmap_mode)
+        categories = {}
+        for name, values in description['categories'].iteritems():
+            categories[str(name)] = np.array([value.encode('utf-8') for value in values], dtype=object)
+        attributes = dict((str(key), value) for key, value in description['attributes'].iteritems())
+        store = cls(column_names, columns,
+                    np.load(os.path.join(path, 'offsets.npy')),
+                    np.load(os.path.join(path, 'index.npy'), mmap_mode=mmap_mode),
+                    categories, attributes)
+        store.path = path
+        return store
@@ -15,9 +15,13 @@ import utils_draw_graphs
 import utils
 
 class TrainingManager:
-    def __init__(self, cf_pool, test_pool, encoder_means, encoder_stddev, parameter_dict):
+    def __init__(self, cf_pool, test_pool, encoder_means, encoder_stddev, parameter_dict, array_pool=None, cf_rows=None):
         self.cf_pool = cf_pool
         self.test_pool = test_pool
+        # The array backed pool the sub-pools were selected from, and the rows of it in each crossfold pool. See
+        # BatchHandler.
+        self.array_pool = array_pool
+        self.cf_rows = cf_rows
         self.parameter_dict = parameter_dict
         self.hyper_results_logfile = "hyper.csv"
         self.encoder_means = encoder_means
@@ -58,7 +62,8 @@ class TrainingManager:
             #### TRAINING
             if not final_run:
                 step_start_time = time.time()
-                batch_frame = training_batch_handler.get_minibatch()
+                # Only the sample arrays are needed to train, so skip the dataframe
+                batch_frame = training_batch_handler.get_minibatch_arrays()
                 # print "Time to get batch: " + str(time.time()-step_start_time)
 
                 train_x, train_future, weights, train_labels, track_padded = \
@@ -313,14 +318,18 @@ class TrainingManager:
                 try:
                     training_batch_handler = training_batch_handler_cache[hash(tuple(np.sort(train_pool.uniqueId.unique())))]
                 except KeyError:
-                    training_batch_handler = BatchHandler.BatchHandler(train_pool, self.parameter_dict, True)
+                    training_batch_handler = BatchHandler.BatchHandler(train_pool, self.parameter_dict, True,
+                                                                       self.array_pool,
+                                                                       self._get_cf_rows(cf_fold, 0))
                 except AttributeError:
                     print 'This should not be attainable, as crossfold==2 is invalid'
 
                 try:
                     validation_batch_handler = validation_batch_handler_cache[hash(tuple(np.sort(val_pool.uniqueId.unique())))]
                 except KeyError:
-                    validation_batch_handler = BatchHandler.BatchHandler(val_pool, self.parameter_dict, False)
+                    validation_batch_handler = BatchHandler.BatchHandler(val_pool, self.parameter_dict, False,
+                                                                         self.array_pool,
+                                                                         self._get_cf_rows(cf_fold, 1))
                 except AttributeError:
                     print 'This should not be attainable, as crossfold==2 is invalid'
 
@@ -444,8 +453,17 @@ class TrainingManager:
         # TODO eval_metric_type_reportwriter?
         return best_params
 
-    def long_train_network(self, params, train_pool, val_pool, test_pool, checkpoint=None, test_network_only=False):
+    def _get_cf_rows(self, fold_idx, trainorval_pool_idx):
+        if self.cf_rows is None:
+            return None
+        return self.cf_rows[fold_idx][trainorval_pool_idx]
+
+    # pool_rows are the rows of the array pool in (train_pool, val_pool, test_pool), if they came from one
+    def long_train_network(self, params, train_pool, val_pool, test_pool, checkpoint=None, test_network_only=False,
+                           pool_rows=None):
         self.parameter_dict = params
+        if pool_rows is None:
+            pool_rows = (None, None, None)
 
         # Run for many minutes, or until loss decays significantly.
         self.parameter_dict['training_early_stop'] = self.parameter_dict['long_training_time']
@@ -455,9 +473,12 @@ class TrainingManager:
         else:
             log_file_name = "best-" + str(time.time())
 
-        training_batch_handler = BatchHandler.BatchHandler(train_pool, self.parameter_dict, True)
-        validation_batch_handler = BatchHandler.BatchHandler(val_pool, self.parameter_dict, False)
-        test_batch_handler = BatchHandler.BatchHandler(test_pool, self.parameter_dict, False)
+        training_batch_handler = BatchHandler.BatchHandler(train_pool, self.parameter_dict, True,
+                                                           self.array_pool, pool_rows[0])
+        validation_batch_handler = BatchHandler.BatchHandler(val_pool, self.parameter_dict, False,
+                                                             self.array_pool, pool_rows[1])
+        test_batch_handler = BatchHandler.BatchHandler(test_pool, self.parameter_dict, False,
+                                                       self.array_pool, pool_rows[2])
 
         # Add input_size, num_classes
         self.parameter_dict['input_size'] = training_batch_handler.get_input_size()
@@ -0,0 +1,68 @@
+# Pools for the unit tests, made by the real SequenceWrangler from small synthetic ibeo tracks.
+import numpy as np
+import pandas as pd
+import SequenceWrangler
+
+
+class FixtureParameters:
+    # Stands in for the parameters module
+    def __init__(self, parameters):
+        self.parameters = parameters
+
+
+def make_parameters(**overrides):
+    parameters = {'ibeo_data_columns': ['relative_x', 'relative_y', 'relative_angle', 'AbsVelocity'],
+                  'observation_steps': 3,
+                  'prediction_steps': 5,
+                  'subsample': 1,
+                  'track_padding': True,
+                  'reject_stopped_vehicles_before_intersection_enable': False,
+                  'wrangle_workers': 1,
+                  'batch_size': 10,
+                  'input_mask': [1, 1, 1, 1],
+                  'augmentation_chance': 0.0,
+                  'aug_function': np.random.uniform,
+                  'aug_range': (-3, 3)}
+    parameters.update(overrides)
+    return FixtureParameters(parameters)
+
+
+def make_tracks(num_tracks=20, seed=0):
+    # Tracks from the north, half going straight through to the south and half turning left to the east
+    random_state = np.random.RandomState(seed)
+    tracks = []
+    for track_idx in range(num_tracks):
+        track_length = random_state.randint(15, 30)
+        turning = track_idx % 2 == 1
+        relative_x = np.cumsum(random_state.rand(track_length)) * (1.0 if turning else 0.1)
+        relative_y = np.cumsum(random_state.rand(track_length) + 0.5) - 10
+        speed = 5 + random_state.rand(track_length)
+        tracks.append(pd.DataFrame({'index': np.arange(track_length),
+                                    'ObjectId': track_idx + 1,
+                                    'Timestamp': 1.5e9 + np.arange(track_length) * 0.04,
+                                    'ObjectPredAge': 0,
+                                    'Classification': 5,
+                                    'ObjBoxOrientation': random_state.rand(track_length),
+                                    'csv_name': 'split_fixture-recording_01.csv',
+                                    'Object_X': relative_x,
+                                    'Object_Y': relative_y,
+                                    'uniqueId': track_idx + 1,
+                                    'origin': 'north',
+                                    'destination': 'east' if turning else 'south',
+                                    'relative_destination': 'left' if turning else 'straight',
+                                    'AbsVelocity': speed,
+                                    'distance': relative_y,
+                                    'distance_to_exit': relative_y - 30,
+                                    'relative_x': relative_x,
+                                    'relative_y': relative_y,
+                                    'relative_angle': random_state.rand(track_length)}))
+    return tracks
+
+
+def make_wrangler(pool_dir, **overrides):
+    # A wrangler whose pool has been generated (in pool_dir) and split
+    wrangler = SequenceWrangler.SequenceWrangler(make_parameters(**overrides), ['split_fixture-recording_01.csv'],
+                                                 pool_dir=pool_dir)
+    wrangler.generate_master_pool_ibeo(make_tracks())
+    wrangler.split_into_evaluation_pools()
+    return wrangler
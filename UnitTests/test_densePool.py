@@ -0,0 +1,28 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import numpy as np
+import DensePool
+from UnitTests import pool_fixtures
+
+
+class TestDensePool(TestCase):
+
+    def test_save_load(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            wrangler = pool_fixtures.make_wrangler(temp_dir)
+            pool_df = wrangler.master_pool
+            dense_pool = DensePool.DensePool.load(wrangler.get_dense_pool_path())
+            self.assertEqual(len(dense_pool), len(pool_df))
+            self.assertEqual(dense_pool.get_array('encoder_sample').shape, (len(pool_df), 3, 4))
+            loaded_df = dense_pool.to_frame()
+            self.assertEqual(list(loaded_df.columns), list(pool_df.columns))
+            self.assertEqual(list(loaded_df.origin), list(pool_df.origin))
+            for original, loaded in zip(pool_df.decoder_sample, loaded_df.decoder_sample):
+                np.testing.assert_array_equal(original, loaded)
+            subset_df = dense_pool.to_frame([3, 1])
+            self.assertEqual(list(subset_df.track_time_idx), [3, 1])
+            np.testing.assert_array_equal(subset_df.encoder_sample.iloc[0], pool_df.encoder_sample.iloc[3])
+        finally:
+            shutil.rmtree(temp_dir)
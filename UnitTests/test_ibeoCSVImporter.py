@@ -0,0 +1,159 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+import numpy as np
+import pandas as pd
+import ibeoCSVImporter
+import SequenceWrangler
+from UnitTests import pool_fixtures
+
+# Matched to the leith-croydon-2 intersection in intersections.json
+RECORDING_NAME = '20170427-stationary-2-leith-croydon-synthetic.csv'
+
+
+def _make_object(object_id, start_time, x, y, classification=5):
+    return pd.DataFrame({'ObjectId': object_id,
+                         'Timestamp': start_time + np.arange(len(x)) * 0.04,
+                         'trackedByStationaryModel': 0,
+                         'mobile': 1,
+                         'ObjectPredAge': 0,
+                         'Classification': classification,
+                         'ObjBoxCenter_X': x,
+                         'ObjBoxCenter_Y': y,
+                         'ObjBoxOrientation': 0.0,
+                         'AbsVelocity_X': 0.0,
+                         'AbsVelocity_Y': 12.5})
+
+
+def make_recording(path):
+    # Objects in 0.5m steps, so the path lengths are exact:
+    # ObjectId 1 goes north to south.
+    # ObjectId 2 turns left from north to east, then after a gap the sensor re-uses it for a car going south to north.
+    # ObjectId 3 is seen too few times, ObjectId 4 is a bike, and ObjectId 5 never reaches a gate.
+    north_to_south_y = np.arange(15.0, -25.5, -0.5)
+    left_turn_x = np.append(np.full(31, -21.5), np.arange(-21.0, -4.5, 0.5))
+    left_turn_y = np.append(np.arange(15.0, -0.5, -0.5), np.zeros(33))
+    south_to_north_y = np.arange(-30.0, 15.5, 0.5)
+    objects = [_make_object(1, 0.0, np.full(len(north_to_south_y), -21.5), north_to_south_y),
+               _make_object(2, 0.0, left_turn_x, left_turn_y),
+               _make_object(2, 10.0, np.full(len(south_to_north_y), -31.5), south_to_north_y),
+               _make_object(3, 1.0, np.full(3, -21.5), np.arange(3.0)),
+               _make_object(4, 1.0, np.full(60, -21.5), np.arange(15.0, -15.0, -0.5), classification=3),
+               _make_object(5, 2.0, np.full(40, -40.0), np.arange(40) * 0.5)]
+    recording = pd.concat(objects, ignore_index=True)
+    # Rows are in time order, as the sensor writes them
+    recording = recording.iloc[np.argsort(recording.Timestamp.values, kind='mergesort')]
+    recording.to_csv(path, index=False, columns=list(objects[0].columns))
+
+
+class TestIbeoCSVImporter(TestCase):
+
+    def setUp(self):
+        # The importer reads and caches in data/ of the working directory
+        self.original_dir = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        os.makedirs('data')
+        make_recording(os.path.join('data', RECORDING_NAME))
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.temp_dir)
+
+    def _import(self, **overrides):
+        return ibeoCSVImporter.ibeoCSVImporter(pool_fixtures.make_parameters(**overrides),
+                                               RECORDING_NAME).get_track_list()
+
+    def test_unique_ids(self):
+        # uniqueIds are given in ObjectId then time order to every vehicle track, labelled or not. The re-used
+        # ObjectId 2 is two tracks, and the bike and the object seen three times get none.
+        tracks = self._import()
+        self.assertEqual([track.uniqueId.iloc[0] for track in tracks], [1, 2, 3])
+        self.assertEqual([track.ObjectId.iloc[0] for track in tracks], [1, 2, 2])
+        for track in tracks:
+            self.assertEqual(len(track.uniqueId.unique()), 1)
+            self.assertTrue(np.all(np.diff(track.Timestamp.values) > 0))
+        self.assertEqual(tracks[2].Timestamp.iloc[0], 10.0)
+
+    def test_labels(self):
+        # The object that never reaches a gate is not labelled, and so not imported
+        tracks = self._import()
+        self.assertEqual([track.origin.iloc[0] for track in tracks], ['north', 'north', 'south'])
+        self.assertEqual([track.destination.iloc[0] for track in tracks], ['south', 'east', 'north'])
+        self.assertEqual([track.relative_destination.iloc[0] for track in tracks], ['straight', 'left', 'straight'])
+        for track in tracks:
+            self.assertEqual(len(track.origin.unique()), 1)
+            self.assertEqual(len(track.destination.unique()), 1)
+            np.testing.assert_allclose(track.AbsVelocity.values, 12.5)
+
+    def test_read_workers_share_cache(self):
+        # Chunks are the same rows with parallel reads, so the tracks and their cache entry are too
+        tracks = self._import(ingest_chunk_rows=50, ingest_max_open_rows=1000)
+        cache_files = os.listdir(os.path.join('data', 'ingest_cache'))
+        shutil.rmtree('data/ingest_cache')
+        for file_name in os.listdir('data'):
+            if file_name.endswith('.tracks'):
+                shutil.rmtree(os.path.join('data', file_name))
+        parallel_tracks = self._import(ingest_chunk_rows=50, ingest_max_open_rows=1000, ingest_read_workers=2)
+        self.assertEqual(os.listdir(os.path.join('data', 'ingest_cache')), cache_files)
+        self.assertEqual(len(parallel_tracks), len(tracks))
+        for track, parallel_track in zip(tracks, parallel_tracks):
+            pd.testing.assert_frame_equal(track, parallel_track)
+
+    def test_edited_recording_is_imported_again(self):
+        self.assertEqual(len(self._import()), 3)
+        # Only the first object remains
+        recording = pd.read_csv(os.path.join('data', RECORDING_NAME))
+        recording[recording.ObjectId == 1].to_csv(os.path.join('data', RECORDING_NAME), index=False)
+        tracks = self._import()
+        self.assertEqual(len(tracks), 1)
+        self.assertEqual(tracks[0].destination.iloc[0], 'south')
+
+    def test_ingest_settings_change_the_store(self):
+        # Every setting that changes the imported tracks gives a store of its own
+        settings = [{},
+                    {'ingest_float32': True},
+                    {'ingest_chunk_rows': 100},
+                    {'ingest_chunk_rows': 100, 'ingest_max_open_rows': 1000},
+                    {'ingest_binary_recordings': True}]
+        for overrides in settings:
+            tracks = self._import(**overrides)
+            self.assertEqual(tracks[0].Object_X.dtype, np.float32 if 'ingest_float32' in overrides else np.float64)
+        track_stores = [file_name for file_name in os.listdir('data') if file_name.endswith('.tracks')]
+        self.assertEqual(len(track_stores), len(settings))
+
+    def test_trim_and_distance(self):
+        # Tracks are trimmed to within the intersection proximity, and to 5m past the first point in the destination
+        # gate. distance is from the last point in the origin gate, distance_to_exit from the first in the destination.
+        expected_lengths = [77, 52, 77]
+        expected_distance = [(-9.0, 29.0), (-9.0, 16.5), (-15.0, 23.0)]
+        expected_distance_to_exit = [(-33.0, 5.0), (-20.5, 5.0), (-33.0, 5.0)]
+        for batched in [False, True]:
+            tracks = self._import(ingest_batched_distance=batched)
+            self.assertEqual([len(track) for track in tracks], expected_lengths)
+            for track_idx in range(len(tracks)):
+                track = tracks[track_idx]
+                np.testing.assert_allclose(track.distance.values[[0, -1]], expected_distance[track_idx], atol=1e-9)
+                np.testing.assert_allclose(track.distance_to_exit.values[[0, -1]],
+                                           expected_distance_to_exit[track_idx], atol=1e-9)
+                np.testing.assert_allclose(np.diff(track.distance.values), 0.5)
+            # The north to south track leaves its origin gate at y=6, and reaches its destination gate at y=-18
+            self.assertEqual(tracks[0].Object_Y.values[tracks[0].distance.values == 0.0], [6.0])
+            self.assertEqual(tracks[0].Object_Y.values[tracks[0].distance_to_exit.values == 0.0], [-18.0])
+
+    def test_pools_keyed_on_the_tracks(self):
+        # The track store name is found without importing, and the pools made from the tracks are keyed on it
+        def get_pool_filename(**overrides):
+            return SequenceWrangler.SequenceWrangler(pool_fixtures.make_parameters(**overrides), [RECORDING_NAME],
+                                                     pool_dir='data_pool').get_pool_filename()
+        track_store_name = ibeoCSVImporter.get_track_store_name(pool_fixtures.make_parameters(), RECORDING_NAME)
+        self.assertEqual(os.listdir('data'), [RECORDING_NAME])
+        self._import()
+        self.assertTrue(os.path.isdir(os.path.join('data', track_store_name + '.tracks')))
+        pool_filenames = [get_pool_filename(), get_pool_filename(ingest_float32=True),
+                          get_pool_filename(data_filename='downloaded')]
+        recording = pd.read_csv(os.path.join('data', RECORDING_NAME))
+        recording[recording.ObjectId == 1].to_csv(os.path.join('data', RECORDING_NAME), index=False)
+        pool_filenames.append(get_pool_filename())
+        self.assertEqual(len(set(pool_filenames)), len(pool_filenames))
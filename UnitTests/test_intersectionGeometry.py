@@ -0,0 +1,42 @@
+from unittest import TestCase
+import numpy as np
+import IntersectionGeometry
+
+
+class TestIntersectionGeometry(TestCase):
+
+    def test_lookup(self):
+        registry = IntersectionGeometry.get_registry()
+        intersection = registry.lookup('split_20170601-stationary-3-leith-croydon_01.csv')
+        self.assertEqual(sorted(intersection.origin_gates.keys()), ['north', 'south'])
+        self.assertEqual(intersection.relative_ring, ['north', 'east', 'south', 'west'])
+        origin, rotation = intersection.entrance_transform('east')
+        self.assertEqual(list(origin), [-13.9, 0.7])
+        self.assertEqual(list(rotation), [0, 1])
+        self.assertIsNone(registry.lookup('unknown-intersection'))
+
+    def test_which_gate(self):
+        intersection = IntersectionGeometry.get_registry().lookup('oliver-wyndora')
+        x = np.array([-9.0, -27.0, 0.0])
+        y = np.array([-10.0, -1.0, 0.0])
+        gate = intersection.which_gate(x, y, 'origin')
+        self.assertEqual(intersection.origin_labels[gate[0]], 'north')
+        self.assertEqual(intersection.origin_labels[gate[1]], 'south')
+        self.assertEqual(gate[2], IntersectionGeometry.NO_GATE)
+        self.assertEqual(intersection.in_gate(x, y, 'origin', gate[0]).tolist(), [True, False, False])
+
+    def test_to_relative(self):
+        intersection = IntersectionGeometry.get_registry().lookup('queen-hanks')
+        entrance_idx = intersection.entrance_index(['north', 'north', 'south'])
+        # The entrance origin maps to zero, and travelling in the entrance direction is travelling up the y axis, at
+        # a relative angle of zero
+        x = np.array([38.5, 37.5, 21.7])
+        y = np.array([-3.0, -3.0, -3.8])
+        orientation = np.array([np.pi, np.pi, 0.0])
+        relative_x, relative_y, relative_angle = intersection.to_relative(x, y, orientation, entrance_idx)
+        np.testing.assert_allclose(relative_x, [0.0, 0.0, 0.0], atol=1e-9)
+        np.testing.assert_allclose(relative_y, [0.0, 1.0, 0.0], atol=1e-9)
+        np.testing.assert_allclose(relative_angle, [0.0, 0.0, 0.0], atol=1e-9)
+        # A single streamed point
+        point = intersection.to_relative(37.5, -3.0, np.pi, intersection.entrance_index('north'))
+        np.testing.assert_allclose(point[:2], [0.0, 1.0], atol=1e-9)
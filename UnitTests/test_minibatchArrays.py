@@ -0,0 +1,124 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import BatchHandler
+from UnitTests import pool_fixtures
+
+
+def _previous_get_minibatch(batch_handler):
+    # BatchHandler.get_minibatch as it was before the batches were gathered as arrays
+    parameters = batch_handler.parameters
+    batch_size = batch_handler.batch_size
+    input_mask = pd.Series([np.tile(parameters['input_mask'], (parameters['observation_steps'], 1))
+                            for x in range(batch_size)],
+                           dtype=object, index=([0] * batch_size))
+    if batch_handler.training:
+        batch_idxs = np.random.choice(batch_handler.balanced_idxs, batch_size, replace=False)
+    else:
+        batch_idxs = np.random.choice(range(len(batch_handler.data_pool)), batch_size, replace=False)
+
+    batch_frame = batch_handler.data_pool.iloc[batch_idxs].copy()
+    num_columns = batch_frame.encoder_sample.iloc[0].shape[1]
+    if batch_handler.training and parameters['augmentation_chance'] > 0.001:
+        aug = pd.Series([np.tile([parameters['aug_function'](*parameters['aug_range']),
+                                  parameters['aug_function'](*parameters['aug_range'])] + [0.0] * (num_columns - 2),
+                                 (parameters['observation_steps'], 1))
+                         for x in range(batch_size)],
+                        dtype=object, index=([0] * batch_size))
+        aug_mask = pd.Series([np.tile([np.random.choice([1.0, 0.0], p=[parameters['augmentation_chance'],
+                                                                       1 - parameters['augmentation_chance']])]
+                                      * num_columns,
+                                      (parameters['observation_steps'], 1))
+                              for x in range(batch_size)],
+                             dtype=object, index=([0] * batch_size))
+        batch_frame.encoder_sample = batch_frame.encoder_sample + (aug * aug_mask)
+    batch_frame.encoder_sample = batch_frame.encoder_sample * input_mask
+    return batch_frame.assign(batchwise_padding=np.zeros(batch_size, dtype=bool))
+
+
+class TestMinibatchArrays(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.wranglers = [pool_fixtures.make_wrangler(os.path.join(cls.temp_dir, 'dense')),
+                         pool_fixtures.make_wrangler(os.path.join(cls.temp_dir, 'windows'), lazy_window_pool=True)]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def _make_batch_handler(self, wrangler, training, with_array_pool=True):
+        # On the training pool. The input mask zeroes the third column, and only the first two can be augmented.
+        batch_parameters = dict(wrangler.parameters, input_mask=[1, 1, 0, 1], augmentation_chance=0.5)
+        # The class balancing is random
+        np.random.seed(0)
+        if with_array_pool:
+            return BatchHandler.BatchHandler(wrangler.crossfold_pool[0][0], batch_parameters, training,
+                                             wrangler.dense_pool, wrangler.crossfold_rows[0][0])
+        return BatchHandler.BatchHandler(wrangler.crossfold_pool[0][0], batch_parameters, training)
+
+    def test_matches_previous_get_minibatch(self):
+        for wrangler in self.wranglers:
+            for training in [True, False]:
+                batch_handler = self._make_batch_handler(wrangler, training)
+                np.random.seed(1)
+                expected_frame = _previous_get_minibatch(batch_handler)
+                np.random.seed(1)
+                batch_frame = batch_handler.get_minibatch()
+                np.random.seed(1)
+                batch = batch_handler.get_minibatch_arrays()
+                self.assertEqual(list(batch_frame.uniqueId), list(expected_frame.uniqueId))
+                self.assertEqual(list(batch_frame.track_time_idx), list(expected_frame.track_time_idx))
+                self.assertEqual(list(batch_handler.data_pool.track_time_idx.values[batch['batch_idxs']]),
+                                 list(expected_frame.track_time_idx))
+                for column_name in ['encoder_sample', 'decoder_sample', 'trackwise_padding', 'dest_1_hot',
+                                    'batchwise_padding']:
+                    expected = np.stack(expected_frame[column_name].values)
+                    np.testing.assert_array_equal(np.stack(batch_frame[column_name].values), expected)
+                    np.testing.assert_array_equal(batch[column_name], expected)
+                self.assertTrue(np.all(batch['encoder_sample'][:, :, 2] == 0))
+
+    def test_gathers_from_array_pool(self):
+        # The same batches with and without the array pool
+        for wrangler in self.wranglers:
+            with_array_pool = self._make_batch_handler(wrangler, True)
+            frame_only = self._make_batch_handler(wrangler, True, with_array_pool=False)
+            np.random.seed(2)
+            batch = with_array_pool.get_minibatch_arrays()
+            np.random.seed(2)
+            frame_batch = frame_only.get_minibatch_arrays()
+            self.assertEqual(batch['encoder_sample'].shape, (10, 3, 4))
+            for column_name in batch:
+                np.testing.assert_array_equal(batch[column_name], frame_batch[column_name])
+
+    def test_format_minibatch_arrays(self):
+        batch_handler = self._make_batch_handler(self.wranglers[0], False)
+        batch = batch_handler.get_minibatch_arrays()
+        observations, futures, weights, labels, padding = batch_handler.format_minibatch_arrays(
+            batch['encoder_sample'], batch['decoder_sample'], batch['batchwise_padding'], batch['trackwise_padding'])
+        self.assertEqual(observations.shape, (3, 10, 4))
+        self.assertEqual(futures.shape, (5, 10, 4))
+        self.assertEqual(weights.shape, (5, 10))
+        self.assertEqual(padding.dtype, np.bool)
+        self.assertTrue(labels is None)
+        np.testing.assert_array_equal(observations[1], batch['encoder_sample'][:, 1])
+        np.testing.assert_array_equal(padding[4], batch['trackwise_padding'][:, 4])
+        # The list layout matches, for arrays and for the columns of a batch frame
+        batch_frame = batch_handler.get_minibatch()
+        for args in [(batch['encoder_sample'], batch['decoder_sample'], batch['batchwise_padding'],
+                      batch['trackwise_padding']),
+                     (batch_frame['encoder_sample'], batch_frame['decoder_sample'], batch_frame['batchwise_padding'],
+                      batch_frame['trackwise_padding'])]:
+            observation_list, future_list, weight_list, label_list, padding_list = \
+                batch_handler.format_minibatch_data(*args)
+            self.assertEqual(len(observation_list), 3)
+            self.assertEqual(len(future_list), 5)
+            self.assertEqual(observation_list[0].dtype, np.float32)
+            self.assertEqual(label_list, [])
+            np.testing.assert_array_equal(observation_list[2], np.stack(args[0])[:, 2])
+            np.testing.assert_array_equal(weight_list[0], np.logical_not(args[2]).astype(np.float32))
+            np.testing.assert_array_equal(padding_list[3], np.stack(args[3])[:, 3])
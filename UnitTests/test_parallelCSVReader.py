@@ -0,0 +1,47 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+import numpy as np
+import pandas as pd
+import ParallelCSVReader
+
+
+class TestParallelCSVReader(TestCase):
+
+    def test_ranges_match_read_csv(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'recording.csv')
+            pd.DataFrame({'ObjectId': np.arange(500) % 7,
+                          'Timestamp': np.arange(500) * 0.04,
+                          'Flags': np.arange(500)},
+                         columns=['ObjectId', 'Flags', 'Timestamp']).to_csv(path, index=False)
+            expected = pd.read_csv(path, usecols=['ObjectId', 'Timestamp'], dtype={'ObjectId': np.int32})
+            reader = ParallelCSVReader.ParallelCSVReader(path)
+            ranges = reader.get_byte_ranges(100)
+            self.assertTrue(len(ranges) > 1)
+            self.assertEqual(ranges[-1][1], os.path.getsize(path))
+            result = pd.concat(reader.iter_ranges(usecols=['ObjectId', 'Timestamp'], dtype={'ObjectId': np.int32},
+                                                  range_bytes=100))
+            pd.testing.assert_frame_equal(expected, result)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_chunks_match_read_csv(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'recording.csv')
+            pd.DataFrame({'ObjectId': np.arange(500) % 7,
+                          'Timestamp': np.arange(500) * 0.04},
+                         columns=['ObjectId', 'Timestamp']).to_csv(path, index=False)
+            expected = list(pd.read_csv(path, dtype={'ObjectId': np.int32}, chunksize=60))
+            # Ranges both smaller and larger than a chunk
+            for range_bytes in [100, 3000]:
+                chunks = list(ParallelCSVReader.ParallelCSVReader(path).iter_chunks(60, dtype={'ObjectId': np.int32},
+                                                                                    range_bytes=range_bytes))
+                self.assertEqual(len(chunks), len(expected))
+                for expected_chunk, chunk in zip(expected, chunks):
+                    pd.testing.assert_frame_equal(expected_chunk, chunk)
+        finally:
+            shutil.rmtree(temp_dir)
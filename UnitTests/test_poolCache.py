@@ -0,0 +1,64 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+import time
+import PoolCache
+
+
+class TestPoolCache(TestCase):
+
+    def _write_pool(self, cache_dir, name, num_bytes):
+        with open(os.path.join(cache_dir, name + '.pkl'), 'wb') as pool_file:
+            pool_file.write('x' * num_bytes)
+        return [name + '.pkl']
+
+    def test_lru_eviction(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = PoolCache.PoolCache(cache_dir, max_bytes=2500, min_idle_seconds=0)
+            cache.add('a', self._write_pool(cache_dir, 'a', 1000))
+            cache.add('b', self._write_pool(cache_dir, 'b', 1000))
+            # 'a' is now the most recently used
+            time.sleep(0.01)
+            cache.touch('a')
+            cache.add('c', self._write_pool(cache_dir, 'c', 1000))
+            self.assertEqual(sorted(cache.entries.keys()), ['a', 'c'])
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, 'b.pkl')))
+            self.assertEqual(cache.total_bytes(), 2000)
+
+            # The manifest is persisted
+            reloaded = PoolCache.PoolCache(cache_dir)
+            self.assertEqual(sorted(reloaded.entries.keys()), ['a', 'c'])
+            self.assertEqual(reloaded.entries['c']['size_bytes'], 1000)
+            self.assertTrue('a' in reloaded.report())
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_shared_manifest(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            # Two processes with the cache open at once keep each other's entries
+            first = PoolCache.PoolCache(cache_dir, max_bytes=2500, min_idle_seconds=0)
+            second = PoolCache.PoolCache(cache_dir, max_bytes=2500, min_idle_seconds=0)
+            first.add('a', self._write_pool(cache_dir, 'a', 1000))
+            second.add('b', self._write_pool(cache_dir, 'b', 1000))
+            self.assertEqual(sorted(PoolCache.PoolCache(cache_dir).entries.keys()), ['a', 'b'])
+
+            # 'a' is the least recently used, but it is in use by another running process, so 'b' goes instead
+            entries = first._read_manifest()
+            entries['a']['pid'] = os.getppid()
+            first.entries = entries
+            with first._lock():
+                first._write_manifest()
+            time.sleep(0.01)
+            second.touch('b')
+            second.add('c', self._write_pool(cache_dir, 'c', 1000))
+            self.assertEqual(sorted(second.entries.keys()), ['a', 'c'])
+
+            # Nothing used recently is evicted
+            recent = PoolCache.PoolCache(cache_dir, max_bytes=1000)
+            recent.add('d', self._write_pool(cache_dir, 'd', 1000))
+            self.assertEqual(sorted(recent.entries.keys()), ['a', 'c', 'd'])
+        finally:
+            shutil.rmtree(cache_dir)
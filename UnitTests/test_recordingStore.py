@@ -0,0 +1,30 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+import numpy as np
+import pandas as pd
+import RecordingStore
+
+
+class TestRecordingStore(TestCase):
+
+    def test_convert_and_chunk(self):
+        df = pd.DataFrame({'ObjectId': np.array([3, 1, 3, 2, 1, 1], dtype=np.int32),
+                           'Timestamp': [0.2, 0.1, 0.1, 0.3, 0.0, 0.05],
+                           'Object_X': np.arange(6, dtype=np.float64)},
+                          columns=['ObjectId', 'Timestamp', 'Object_X'])
+        temp_dir = tempfile.mkdtemp()
+        try:
+            store = RecordingStore.RecordingStore.convert(os.path.join(temp_dir, 'test.recording'),
+                                                          [df.iloc[:4], df.iloc[4:]])
+            self.assertEqual(store.num_objects(), 3)
+            whole_df, sort_order = next(store.iter_object_chunks())
+            pd.testing.assert_frame_equal(df, whole_df, check_index_type=False)
+            self.assertEqual(list(sort_order), list(np.lexsort((df.Timestamp.values, df.ObjectId.values))))
+            # Chunks hold whole objects, in ObjectId order, with the file row as the index
+            chunks = list(store.iter_object_chunks(chunk_rows=2))
+            self.assertEqual([list(chunk_df.index) for chunk_df, order in chunks], [[1, 4, 5], [3], [0, 2]])
+            self.assertEqual(list(chunks[0][1]), [1, 2, 0])
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,40 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+import numpy as np
+import RunningMoments
+
+
+class TestRunningMoments(TestCase):
+
+    def test_update_and_merge(self):
+        rows = np.random.RandomState(0).normal(5.0, 3.0, size=(1000, 3))
+        moments = RunningMoments.RunningMoments(3)
+        for start in range(0, 1000, 170):
+            moments.update(rows[start:start + 170])
+        self.assertTrue(np.allclose(moments.get_mean(), np.mean(rows, axis=0)))
+        self.assertTrue(np.allclose(moments.get_var(), np.var(rows, axis=0)))
+        self.assertTrue(np.allclose(moments.get_std(), np.std(rows, axis=0)))
+
+        # As if the halves were done by two workers
+        first = RunningMoments.RunningMoments(3).update(rows[:300])
+        second = RunningMoments.RunningMoments(3).update(rows[300:])
+        first.merge(second).merge(RunningMoments.RunningMoments(3))
+        self.assertEqual(first.count, 1000)
+        self.assertTrue(np.allclose(first.get_mean(), np.mean(rows, axis=0)))
+        self.assertTrue(np.allclose(first.get_var(), np.var(rows, axis=0)))
+
+    def test_save_load(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'moments.json')
+            self.assertIsNone(RunningMoments.RunningMoments.load(path))
+            moments = RunningMoments.RunningMoments(2).update([[1.0, 2.0], [3.0, 6.0]])
+            moments.save(path)
+            loaded = RunningMoments.RunningMoments.load(path)
+            self.assertEqual(loaded.count, 2)
+            self.assertTrue(np.array_equal(loaded.get_mean(), [2.0, 4.0]))
+            self.assertTrue(np.array_equal(loaded.get_var(), [1.0, 4.0]))
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,26 @@
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import TrackFilters
+
+
+class TestTrackFilters(TestCase):
+
+    def test_has_run(self):
+        # The same as checking every window in turn
+        random_state = np.random.RandomState(0)
+        for _ in range(200):
+            mask = random_state.rand(random_state.randint(0, 30)) < 0.7
+            run_length = random_state.randint(0, 8)
+            expected = any(all(mask[start:start + run_length]) for start in range(len(mask) - run_length))
+            self.assertEqual(TrackFilters.has_run(mask, run_length), expected)
+
+    def test_stopped_before_intersection(self):
+        track_filter = TrackFilters.StoppedBeforeIntersectionFilter(stop_speed=1, stop_duration=0.12)
+        self.assertEqual(track_filter.stop_length, 3)
+        track = pd.DataFrame({'distance': [-5.0, -4, -3, -2, -1, 0, 1, 2],
+                              'AbsVelocity': [5.0, 0.5, 0.5, 0.5, 5, 0, 0, 0]})
+        self.assertFalse(track_filter.accepts(track))
+        # Stopped after the intersection is fine
+        track.loc[2, 'AbsVelocity'] = 5.0
+        self.assertTrue(track_filter.accepts(track))
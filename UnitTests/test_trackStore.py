@@ -0,0 +1,63 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+import numpy as np
+import pandas as pd
+import TrackStore
+
+
+class TestTrackStore(TestCase):
+
+    def _make_tracks(self):
+        track_a = pd.DataFrame({'Object_X': np.arange(5, dtype=np.float64),
+                                'uniqueId': [1] * 5,
+                                'origin': ['north'] * 5,
+                                'trackwise_padding': [False] * 5},
+                               columns=['Object_X', 'uniqueId', 'origin', 'trackwise_padding'])
+        track_b = pd.DataFrame({'Object_X': np.arange(3, dtype=np.float64) + 10,
+                                'uniqueId': [2] * 3,
+                                'origin': ['south'] * 3,
+                                'trackwise_padding': [False, False, True]},
+                               columns=['Object_X', 'uniqueId', 'origin', 'trackwise_padding'],
+                               index=[7, 8, 9])
+        return [track_a, track_b]
+
+    def test_round_trip(self):
+        tracks = self._make_tracks()
+        store = TrackStore.TrackStore.from_track_list(tracks)
+        self.assertEqual(len(store), 2)
+        for original, stored in zip(tracks, store):
+            pd.testing.assert_frame_equal(original, stored)
+
+    def test_save_load_mmap(self):
+        tracks = self._make_tracks()
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'test.tracks')
+            TrackStore.TrackStore.from_track_list(tracks, attributes={'ids_used': 2}).save(path)
+            store = TrackStore.TrackStore.load(path)
+            self.assertEqual(store.attributes['ids_used'], 2)
+            self.assertEqual(list(store.first_values('origin')), ['north', 'south'])
+            pd.testing.assert_frame_equal(tracks[1], store[-1])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_concatenate(self):
+        tracks = self._make_tracks()
+        store = TrackStore.TrackStore.concatenate([TrackStore.TrackStore.from_track_list(tracks[1:]),
+                                                   TrackStore.TrackStore.from_track_list([]),
+                                                   TrackStore.TrackStore.from_track_list(tracks[:1])])
+        self.assertEqual(len(store), 2)
+        pd.testing.assert_frame_equal(tracks[1], store[0])
+        pd.testing.assert_frame_equal(tracks[0], store[1])
+
+    def test_from_dataframe(self):
+        df = pd.DataFrame({'uniqueId': [4, 2, 4, 2, 9, 4],
+                           'Object_X': np.arange(6, dtype=np.float64),
+                           'origin': ['east', 'west', 'east', 'west', 'north', 'east']},
+                          columns=['uniqueId', 'Object_X', 'origin'], index=[10, 11, 12, 13, 14, 15])
+        store = TrackStore.TrackStore.from_dataframe(df, 'uniqueId')
+        self.assertEqual(len(store), 3)
+        for uid, stored in zip(df.uniqueId.unique(), store):
+            pd.testing.assert_frame_equal(df[df.uniqueId == uid], stored)
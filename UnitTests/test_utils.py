@@ -0,0 +1,48 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os
+import utils
+
+
+class TestUtils(TestCase):
+
+    def test_source_digest_ignores_comments(self):
+        source_dir = tempfile.mkdtemp()
+        try:
+            source_path = os.path.join(source_dir, 'source.py')
+            with open(source_path, 'w') as source_file:
+                source_file.write('x = 1\n')
+            digest = utils.get_source_digest([source_path])
+            with open(source_path, 'w') as source_file:
+                source_file.write('# A comment\n\nx = 1  # and another\n')
+            self.assertEqual(utils.get_source_digest([source_path]), digest)
+            with open(source_path, 'w') as source_file:
+                source_file.write('x = 2\n')
+            self.assertNotEqual(utils.get_source_digest([source_path]), digest)
+        finally:
+            shutil.rmtree(source_dir)
+
+    def test_file_fingerprint_sees_middle_edit(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            data_path = os.path.join(data_dir, 'recording.csv')
+            with open(data_path, 'wb') as data_file:
+                data_file.write('a' * 100)
+            os.utime(data_path, (1000000000, 1000000000))
+            fingerprint = utils.get_file_fingerprint(data_path, sample_bytes=10)
+            self.assertEqual(utils.get_file_fingerprint(data_path, sample_bytes=10), fingerprint)
+            # Same size, same sampled start and end
+            with open(data_path, 'wb') as data_file:
+                data_file.write('a' * 50 + 'b' + 'a' * 49)
+            os.utime(data_path, (1000000001, 1000000001))
+            self.assertNotEqual(utils.get_file_fingerprint(data_path, sample_bytes=10), fingerprint)
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_value_fingerprint_is_stable(self):
+        # Independent of the order of dict keys, and the same in every process
+        fingerprint = utils.get_value_fingerprint({'sources': ['a.csv'], 'observation_steps': 3})
+        self.assertEqual(utils.get_value_fingerprint({'observation_steps': 3, 'sources': ['a.csv']}), fingerprint)
+        self.assertEqual(len(fingerprint), 32)
+        self.assertNotEqual(utils.get_value_fingerprint({'sources': ['b.csv'], 'observation_steps': 3}), fingerprint)
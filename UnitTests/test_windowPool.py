@@ -0,0 +1,40 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+import WindowPool
+from UnitTests import pool_fixtures
+
+
+class TestWindowPool(TestCase):
+
+    def test_matches_dense_pool(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            dense_wrangler = pool_fixtures.make_wrangler(os.path.join(temp_dir, 'dense'))
+            window_wrangler = pool_fixtures.make_wrangler(os.path.join(temp_dir, 'windows'), lazy_window_pool=True)
+            window_pool = window_wrangler.dense_pool
+            self.assertTrue(isinstance(window_pool, WindowPool.WindowPool))
+            # Each padded track is stored once
+            self.assertEqual(len(window_pool.track_data),
+                             sum(len(track) + 5 for track in pool_fixtures.make_tracks()))
+
+            dense_df = dense_wrangler.master_pool
+            window_df = window_wrangler.master_pool
+            self.assertEqual(list(window_df.columns), list(dense_df.columns))
+            self.assertEqual(list(window_df.track_time_idx), list(dense_df.track_time_idx))
+            self.assertEqual(list(window_df.distance), list(dense_df.distance))
+            for name in WindowPool.WINDOW_COLUMNS + ['dest_1_hot']:
+                np.testing.assert_array_equal(np.stack(window_df[name].values), np.stack(dense_df[name].values))
+                np.testing.assert_array_equal(window_pool.get_array(name, [5, 0]),
+                                              np.stack(dense_df[name].values[[5, 0]]))
+            np.testing.assert_array_equal(window_wrangler.encoder_means, dense_wrangler.encoder_means)
+
+            # The saved pool is loaded back as windows
+            loaded_pool = WindowPool.WindowPool.load(window_wrangler.get_window_pool_path())
+            self.assertEqual(len(loaded_pool), len(dense_df))
+            np.testing.assert_array_equal(loaded_pool.get_array('decoder_sample'),
+                                          np.stack(dense_df.decoder_sample.values))
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,26 @@
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import TrackStore
+import WrangleExecutor
+
+
+def _track_summary(track, track_idx):
+    return track_idx, track['origin'].iloc[0], float(track['x'].sum())
+
+
+class TestWrangleExecutor(TestCase):
+
+    def _make_tracks(self):
+        return [pd.DataFrame({'x': np.arange(track_idx + 1, dtype=np.float64),
+                              'origin': ['north' if track_idx % 2 else 'south'] * (track_idx + 1)})
+                for track_idx in range(11)]
+
+    def test_map_tracks(self):
+        tracks = self._make_tracks()
+        expected = [_track_summary(track, track_idx) for track_idx, track in enumerate(tracks)]
+        for workers, chunk_tracks in [(1, None), (2, None), (3, 2)]:
+            executor = WrangleExecutor.WrangleExecutor(workers, chunk_tracks)
+            self.assertEqual(executor.map_tracks(_track_summary, tracks), expected)
+            self.assertEqual(executor.map_tracks(_track_summary, TrackStore.TrackStore.from_track_list(tracks)),
+                             expected)
@@ -0,0 +1,171 @@
+# Lazy layout of a sample pool, such as the SequenceWrangler master pool.
+# Consecutive samples of a track are windows that step along the track by one, so each track's data is stored only
+# once, and a sample is just the row its window starts at. The encoder sample of row i is
+# track_data[window_starts[i]:window_starts[i] + encoder_steps], and the decoder sample follows straight on from it.
+# This is roughly (observation_steps + prediction_steps) times smaller than holding every window.
+#
+# The pool is made from the tracks as they are wrangled (from_tracks), so the windows are never sliced out. They are
+# gathered on demand, with fancy indexing for a batch of rows (get_array), or as views for the dataframe layout
+# (to_frame). The interface is that of DensePool, and the files on disk are laid out the same way.
+
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import TrackStore
+import DensePool
+
+WINDOW_POOL_VERSION = 1
+# Columns that are gathered from the track data, and the offset and length of their window
+WINDOW_COLUMNS = ['encoder_sample', 'decoder_sample', 'trackwise_padding']
+
+
+class WindowPool:
+    def __init__(self, column_names, track_data, track_padding, window_starts, encoder_steps, decoder_steps,
+                 arrays, metadata):
+        self.column_names = list(column_names)
+        # [rows, features] data of all tracks, and whether each row is padding
+        self.track_data = track_data
+        self.track_padding = track_padding
+        # Row of track_data at which each sample's encoder window starts
+        self.window_starts = window_starts
+        self.encoder_steps = encoder_steps
+        self.decoder_steps = decoder_steps
+        # Other per sample arrays (dest_1_hot), as in DensePool
+        self.arrays = arrays
+        self.metadata = metadata
+
+    @classmethod
+    def from_tracks(cls, tracks, encoder_steps, decoder_steps):
+        # Pool of the windows of every track, stepping along it by one. Each of tracks is a dict of
+        #   column_names  - column order of the dataframe layout, the same for every track
+        #   track_data    - [rows, features] data the encoder and decoder windows are taken from
+        #   track_padding - [rows] whether each row is padding, or None
+        #   metadata      - a row per window of everything but the window columns and arrays
+        #   arrays        - other [windows, ...] per sample arrays (dest_1_hot)
+        if len(tracks) == 0:
+            raise ValueError("Cannot make a window pool without any tracks")
+        window_starts = []
+        next_row = 0
+        for track in tracks:
+            num_windows = len(track['track_data']) - encoder_steps - decoder_steps + 1
+            if num_windows != len(track['metadata']):
+                raise ValueError("A track of " + str(len(track['track_data'])) + " rows has " + str(num_windows) +
+                                 " windows, not " + str(len(track['metadata'])))
+            window_starts.append(next_row + np.arange(num_windows))
+            next_row += len(track['track_data'])
+        track_padding = None
+        if tracks[0]['track_padding'] is not None:
+            track_padding = np.concatenate([track['track_padding'] for track in tracks])
+        arrays = {}
+        for array_name in tracks[0]['arrays']:
+            arrays[array_name] = np.concatenate([track['arrays'][array_name] for track in tracks])
+        metadata = TrackStore.TrackStore.from_track_list([pd.concat([track['metadata'] for track in tracks])])
+        return cls(tracks[0]['column_names'], np.concatenate([track['track_data'] for track in tracks]),
+                   track_padding, np.concatenate(window_starts), encoder_steps, decoder_steps, arrays, metadata)
+
+    def __len__(self):
+        return len(self.window_starts)
+
+    def _window(self, column_name):
+        # Source array, and offset and length of the window of a gathered column
+        if column_name == 'encoder_sample':
+            return self.track_data, 0, self.encoder_steps
+        if column_name == 'decoder_sample':
+            return self.track_data, self.encoder_steps, self.decoder_steps
+        return self.track_padding, self.encoder_steps, self.decoder_steps
+
+    def get_array(self, column_name, rows=None):
+        # Dense [N, ...] array of a per sample array column, for all rows or an array of row indices.
+        # The windows are gathered, so this is a copy.
+        if column_name not in WINDOW_COLUMNS:
+            array = self.arrays[dict(DensePool.DENSE_COLUMNS)[column_name]]
+            return array if rows is None else array[rows]
+        starts = self.window_starts if rows is None else self.window_starts[rows]
+        source, offset, length = self._window(column_name)
+        return np.asarray(source)[starts[:, np.newaxis] + offset + np.arange(length)]
+
+    def get_metadata(self, rows=None):
+        metadata_df = self.metadata.get_rows(0, len(self))
+        if rows is not None:
+            metadata_df = metadata_df.iloc[rows]
+        return metadata_df
+
+    def to_frame(self, rows=None):
+        # The pool in the dataframe layout, for all rows or an array of row indices. Each sample's arrays are views
+        # into the track data, so this does not copy any windows.
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows)
+        metadata_df = self.get_metadata(rows)
+        starts = np.asarray(self.window_starts)[rows]
+        data = {}
+        for name in self.column_names:
+            if name in WINDOW_COLUMNS:
+                source, offset, length = self._window(name)
+                source = np.asarray(source)
+                column = np.empty(len(rows), dtype=object)
+                for sample_idx in xrange(len(rows)):
+                    window_start = starts[sample_idx] + offset
+                    column[sample_idx] = source[window_start:window_start + length]
+                data[name] = column
+            elif name == 'dest_1_hot':
+                dense = np.asarray(self.arrays['dest_1_hot'])
+                column = np.empty(len(rows), dtype=object)
+                for sample_idx in xrange(len(rows)):
+                    column[sample_idx] = dense[rows[sample_idx]]
+                data[name] = column
+            else:
+                data[name] = metadata_df[name].values
+        return pd.DataFrame(data, columns=self.column_names, index=metadata_df.index)
+
+    def save(self, path):
+        # Write to a temporary directory and then move it into place, so an interrupted write is never loaded.
+        temp_path = path + '.tmp'
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+        np.save(os.path.join(temp_path, 'track_data.npy'), self.track_data)
+        if self.track_padding is not None:
+            np.save(os.path.join(temp_path, 'track_padding.npy'), self.track_padding)
+        np.save(os.path.join(temp_path, 'window_starts.npy'), self.window_starts)
+        for array_name, array in self.arrays.iteritems():
+            np.save(os.path.join(temp_path, array_name + '.npy'), array)
+        self.metadata.save(os.path.join(temp_path, 'metadata.tracks'))
+        description = {'version': WINDOW_POOL_VERSION,
+                       'column_names': self.column_names,
+                       'encoder_steps': self.encoder_steps,
+                       'decoder_steps': self.decoder_steps,
+                       'padding': self.track_padding is not None,
+                       'arrays': sorted(self.arrays.keys())}
+        with open(os.path.join(temp_path, 'pool.json'), 'w') as json_file:
+            json.dump(description, json_file)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode='c'):
+        # Returns None if there is no (compatible) pool at path.
+        if not os.path.isfile(os.path.join(path, 'pool.json')):
+            return None
+        with open(os.path.join(path, 'pool.json'), 'r') as json_file:
+            description = json.load(json_file)
+        if description['version'] != WINDOW_POOL_VERSION:
+            return None
+        metadata = TrackStore.TrackStore.load(os.path.join(path, 'metadata.tracks'), mmap_mode=mmap_mode)
+        if metadata is None:
+            return None
+        track_padding = None
+        if description['padding']:
+            track_padding = np.load(os.path.join(path, 'track_padding.npy'), mmap_mode=mmap_mode)
+        # json gives back unicode
+        arrays = {}
+        for array_name in description['arrays']:
+            arrays[str(array_name)] = np.load(os.path.join(path, str(array_name) + '.npy'), mmap_mode=mmap_mode)
+        return cls([str(name) for name in description['column_names']],
+                   np.load(os.path.join(path, 'track_data.npy'), mmap_mode=mmap_mode),
+                   track_padding,
+                   np.load(os.path.join(path, 'window_starts.npy'), mmap_mode=mmap_mode),
+                   description['encoder_steps'], description['decoder_steps'], arrays, metadata)
@@ -0,0 +1,102 @@
+# Runs a per-track function over every track of a TrackStore with a pool of worker processes.
+# The workers memory map the store themselves and are only sent [start, end) ranges of track indices, so no track data
+# is pickled to them. Results come back a chunk at a time through imap_unordered, and are returned in track order, the
+# same as a serial map over the tracks.
+
+import os
+import shutil
+import sys
+import tempfile
+import pathos.multiprocessing as mp
+import TrackStore
+
+# Set in each worker process by _init_worker
+_worker_store = None
+_worker_function = None
+
+
+def _init_worker(store_path, track_function):
+    global _worker_store, _worker_function
+    _worker_store = TrackStore.TrackStore.load(store_path)
+    _worker_function = track_function
+
+
+def _run_chunk(track_range):
+    # Run in a worker process.
+    start, end = track_range
+    return start, [_worker_function(_worker_store[track_idx], track_idx) for track_idx in xrange(start, end)]
+
+
+def get_worker_count(workers=None):
+    # None or 0 uses every core
+    if workers is None or workers < 1:
+        return mp.cpu_count()
+    return workers
+
+
+class WrangleExecutor:
+    def __init__(self, workers=None, chunk_tracks=None, temp_dir=None):
+        self.workers = get_worker_count(workers)
+        # Tracks per task. By default about four tasks per worker, so the workers finish at about the same time.
+        self.chunk_tracks = chunk_tracks
+        # Where a track list is written as a store for the workers to map
+        self.temp_dir = temp_dir
+
+    def _get_chunks(self, num_tracks):
+        chunk_tracks = self.chunk_tracks
+        if chunk_tracks is None:
+            chunk_tracks = min(100, max(1, num_tracks // (4 * self.workers)))
+        return [(start, min(start + chunk_tracks, num_tracks)) for start in xrange(0, num_tracks, chunk_tracks)]
+
+    def map_tracks(self, track_function, tracks, label="Wrangling track"):
+        # [track_function(track, track_idx) for every track], for a list of tracks or a TrackStore.
+        num_tracks = len(tracks)
+        if self.workers == 1 or num_tracks <= 1:
+            results = []
+            for track_idx in xrange(num_tracks):
+                results.append(track_function(tracks[track_idx], track_idx))
+                self._print_progress(label, track_idx + 1, num_tracks)
+            self._print_done()
+            return results
+
+        # The workers need a store on disk to map
+        store_path = getattr(tracks, 'path', None)
+        temp_path = None
+        if store_path is None:
+            if not isinstance(tracks, TrackStore.TrackStore):
+                tracks = TrackStore.TrackStore.from_track_list(tracks)
+            if self.temp_dir is not None and not os.path.exists(self.temp_dir):
+                os.makedirs(self.temp_dir)
+            temp_path = tempfile.mkdtemp(dir=self.temp_dir)
+            store_path = os.path.join(temp_path, 'tracks')
+            tracks.save(store_path)
+
+        results = [None] * num_tracks
+        pool = mp.Pool(processes=self.workers, initializer=_init_worker, initargs=(store_path, track_function))
+        try:
+            done = 0
+            for start, chunk_results in pool.imap_unordered(_run_chunk, self._get_chunks(num_tracks)):
+                results[start:start + len(chunk_results)] = chunk_results
+                done += len(chunk_results)
+                self._print_progress(label, done, num_tracks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            if temp_path is not None:
+                shutil.rmtree(temp_path)
+        self._print_done()
+        return results
+
+    @staticmethod
+    def _print_progress(label, done, total):
+        sys.stdout.write("\r%s: %6d of %6d" % (label, done, total))
+        sys.stdout.flush()
+
+    @staticmethod
+    def _print_done():
+        sys.stdout.write("\t\t\t\t%4s" % "[ OK ]")
+        sys.stdout.write("\r\n")
+        sys.stdout.flush()
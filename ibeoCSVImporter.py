@@ -9,28 +9,116 @@ import struct
 from bokeh.plotting import figure, show
 from bokeh.io import output_notebook
 import os
+import hashlib
+import itertools
 import dill as pickle
 import utils
+import TrackStore
+import ParallelCSVReader
+import RecordingStore
+import IntersectionGeometry
+import pathos.multiprocessing as mp
+
+# Recording is at 25Hz. Any larger gap between samples of the same ObjectId is considered a new track.
+TRACK_GAP_SECONDS = 0.07
+# Increment when a change to this file alters the imported tracks, to invalidate the per-recording ingest cache.
+INGEST_CACHE_VERSION = 2
+
+# The raw ibeo csv has ~50 columns, but only the below are used by the importer and the SequenceWrangler. They are read
+# with compact types where this is lossless. Any other raw column named in parameters['ibeo_data_columns'] is also read.
+INGEST_COLUMN_TYPES = [('ObjectId', np.int32),
+                       ('Timestamp', np.float64),  # Seconds since epoch, needs double precision
+                       ('trackedByStationaryModel', np.int8),
+                       ('mobile', np.int8),
+                       ('ObjectPredAge', np.int32),
+                       ('Classification', np.int32),
+                       ('ObjBoxCenter_X', np.float64),
+                       ('ObjBoxCenter_Y', np.float64),
+                       ('ObjBoxOrientation', np.float64),
+                       ('AbsVelocity_X', np.float64),
+                       ('AbsVelocity_Y', np.float64)]
+IBEO_RAW_COLUMNS = ['ObjectId', 'Flags', 'trackedByStationaryModel', 'mobile', 'motionModelValidated', 'ObjectAge',
+                    'Timestamp', 'ObjectPredAge', 'Classification', 'ClassCertainty', 'ClassAge', 'ObjBoxCenter_X',
+                    'ObjBoxCenter_Y', 'ObjBoxCenterSigma_X', 'ObjBoxCenterSigma_Y', 'ObjBoxSize_X', 'ObjBoxSize_Y',
+                    'ObjCourseAngle', 'ObjCourseAngleSigma', 'ObjBoxOrientation', 'ObjBoxOrientationSigma',
+                    'RelVelocity_X', 'RelVelocity_Y', 'RelVelocitySigma_X', 'RelVelocitySigma_Y', 'AbsVelocity_X',
+                    'AbsVelocity_Y', 'AbsVelocitySigma_X', 'AbsVelocitySigma_Y', 'RefPointLocation',
+                    'RefPointCoords_X', 'RefPointCoords_Y', 'RefPointCoordsSigma_X', 'RefPointCoordsSigma_Y',
+                    'RefPointPosCorrCoeffs', 'ObjPriority', 'ObjExtMeasurement', 'EgoLatitude', 'EgoLongitude',
+                    'EgoAltitude', 'EgoHeadingRad', 'EgoPosTimestamp', 'GPSFixStatus']
+
+
+def get_track_store_name(parameters, csv_name):
+    # Name the tracks of csv_name are kept under, data/<name>.tracks, found without importing them. Anything made from
+    # the tracks can be keyed on it.
+    return ibeoCSVImporter(parameters, csv_name, import_tracks=False).track_store_name
+
 
 class ibeoCSVImporter:
-    def __init__(self, parameters, csv_name):
+    def __init__(self, parameters, csv_name, import_tracks=True):
         self.unique_id_idx = int(1) #Made object global as disambig is called multiple times now.
         if isinstance(csv_name,str):
             csv_name = [csv_name]
         self.labelled_track_list = []
+        self.ingest_cache_dir = 'data/ingest_cache'
+        self.recording_cache_dir = 'data/recording_cache'
         self._cumulative_dest_list = []
         self._cumulative_origin_list = []
+        self.ingest_dtypes = self._get_ingest_schema(parameters.parameters)
+        self.intersections = IntersectionGeometry.get_registry()
+        # Compute the intersection distance of all tracks in a recording together
+        try:
+            self.batched_distance = parameters.parameters['ingest_batched_distance']
+        except KeyError:
+            self.batched_distance = False
+        # Number of processes parsing each raw csv
+        try:
+            self.read_workers = parameters.parameters['ingest_read_workers']
+        except KeyError:
+            self.read_workers = 1
+        # Most rows of open tracks carried from one chunk to the next when streaming a csv. None is the chunk size.
+        try:
+            self.max_open_rows = parameters.parameters['ingest_max_open_rows']
+        except KeyError:
+            self.max_open_rows = None
+        # Convert each raw csv once into a binary RecordingStore, and import from that
+        try:
+            self.binary_recordings = parameters.parameters['ingest_binary_recordings']
+        except KeyError:
+            self.binary_recordings = False
+        # Optionally stream each recording in chunks so memory is bound by the chunk size and not the file size.
+        # This allows the full, unsplit recordings to be read directly.
+        try:
+            chunk_rows = parameters.parameters['ingest_chunk_rows']
+        except KeyError:
+            chunk_rows = None
+        # Recordings may be processed in parallel, one per worker process.
+        try:
+            ingest_workers = parameters.parameters['ingest_workers']
+        except KeyError:
+            ingest_workers = 1
         # Check if I have cached this already
-        # name it after a hash of the csv_names and the file data. Or read from the given filename
+        # name it after the recordings, their contents and how they are imported. Or read from the given filename
         try:
             cache_name = parameters.parameters['data_filename']
-            print "loading data from: " + cache_name
+            from_raw_csv = False
         except KeyError:
-            cache_name = abs(hash(tuple(csv_name)) + utils.get_library_hash(['ibeoCSVImporter.py']))
+            cache_name = self._get_track_store_key(csv_name, chunk_rows)
+            from_raw_csv = True
+        self.track_store_name = str(cache_name)
+        if not import_tracks:
+            return
+        if from_raw_csv:
             print "Loading from raw CSV's, 10+hours."
+        else:
+            print "loading data from: " + cache_name
+
+        # The columnar track store is the format the data takes if parsing from the original csv's. It is memory
+        # mapped, so tracks are only read from disk when they are used.
+        store_path = 'data/' + str(cache_name) + ".tracks"
+        track_store = TrackStore.TrackStore.load(store_path)
 
-        # Try to load a pkl as this was the original file format, and will be the format the data takes if
-        # parsing from the original csv's
+        # Else try to load a pkl as this was the original file format
         file_path = 'data/' + str(cache_name) + ".pkl"
         csv_filetype = False
         # Else try for a csv which was the downloaded dataset
@@ -39,7 +127,13 @@ class ibeoCSVImporter:
             file_path = 'data/' + str(cache_name) + ".csv"
 
         imported = False
-        if os.path.isfile(file_path):
+        if track_store is not None:
+            self.labelled_track_list = track_store
+            imported = True
+            # Grab some labels for the summary printer
+            for csv in csv_name:
+                self.lookup_intersection_extent(csv)
+        elif os.path.isfile(file_path):
             try:
                 if csv_filetype:
                     raise ImportError
@@ -55,11 +149,11 @@ class ibeoCSVImporter:
                 file_path = 'data/' + str(cache_name) + ".csv"
                 try:
                     csv_df = pd.read_csv(file_path)
-                    self.labelled_track_list = []
                     # The original data inthe pkl is a list of each track. Split it up to match formats.
-                    for uid in csv_df.uniqueId.unique():
-                        sub_df = csv_df[csv_df.uniqueId==uid]
-                        self.labelled_track_list.append(sub_df)
+                    self.labelled_track_list = TrackStore.TrackStore.from_dataframe(csv_df, 'uniqueId')
+                    del csv_df
+                    # Keep it as a track store, so the csv only has to be parsed once
+                    self.labelled_track_list.save(store_path)
 
                     imported = True
                     # Grab some labels for the summary printer
@@ -69,133 +163,255 @@ class ibeoCSVImporter:
                     imported = False
 
         if not imported:
-            for csv_file in csv_name:
-                print "No cached csv data found. Double check the parameters file if you do not have CSV's present"
-                print "If you have not downloaded the dataset from http://its.acfr.usyd.edu.au/datasets/ do so now"
-                print "Reading CSV " + csv_file
-                try:
-                    input_df = pd.read_csv('data/' + csv_file)
-                except IOError:
-                    print "Went looking for the original CSVs files (~250GiB worth). Files not found. Did you mean to"
-                    print "use the dataset available at http://its.acfr.usyd.edu.au/datasets/ ?"
-                    exit(1)
-                input_df['csv_name'] = [csv_file]*len(input_df)
-                self.lookup_intersection_extent(csv_file)
-                parsed_df = self._parse_ibeo_df(input_df)
-                input_df = None
-                #print "Disambiguating tracks"
-                disambiguated_df = self._disambiguate_df(parsed_df)
-                parsed_df = None
-                labelled_track_list = self._label_df(disambiguated_df)
-                #print "Calculating intersection distance"
-
-                sub_track_list = self._calculate_intersection_distance(labelled_track_list)
-                trimmed_tracks = self._trim_tracks(sub_track_list)
-                related_tracks = self._add_relative_tracks(trimmed_tracks)
-                self.labelled_track_list.extend(trimmed_tracks)
-                print "#### CUMULATIVE SUMMARY ####"
-                self._print_collection_summary()
-                self._print_collection_summary(relative=True)
-                # write pkl
-            with open(file_path, 'wb') as pkl_file:
-                pickle.dump(self.labelled_track_list, pkl_file)
+            self._import_recordings(csv_name, chunk_rows, ingest_workers)
+            self.labelled_track_list.save(store_path)
 
         self._print_collection_summary()
         self._print_collection_summary(relative=True)
 
+    def _import_recording(self, csv_file, chunk_rows=None):
+        # Read, label and trim all tracks from a single recording. uniqueIds continue from self.unique_id_idx
+        self.lookup_intersection_extent(csv_file)
+        tracks = []
+        if self.binary_recordings:
+            # Chunks are whole objects in ObjectId order, so chunking does not change the tracks
+            recording_store = self._get_recording_store(csv_file)
+            for input_df, sort_order in recording_store.iter_object_chunks(chunk_rows):
+                input_df['csv_name'] = [csv_file]*len(input_df)
+                tracks.extend(self._process_recording_df(input_df, sort_order))
+            return tracks
+        for input_df in self._read_recording(csv_file, chunk_rows):
+            tracks.extend(self._process_recording_df(input_df))
+        return tracks
+
+    def _get_recording_store(self, csv_file):
+        # Binary copy of the raw csv, converted on first use. It is keyed only on the csv file and the columns read,
+        # so changes to the importer do not require the csv to be parsed again.
+        key = hashlib.md5(str((utils.get_file_fingerprint('data/' + csv_file),
+                               sorted([(name, np.dtype(dtype).str) for name, dtype in self.ingest_dtypes.iteritems()])
+                               ))).hexdigest()
+        store_path = os.path.join(self.recording_cache_dir, os.path.splitext(csv_file)[0] + '-' + key + '.recording')
+        recording_store = RecordingStore.RecordingStore.load(store_path)
+        if recording_store is None:
+            print "Converting CSV " + csv_file + " to binary"
+            if not os.path.exists(self.recording_cache_dir):
+                os.makedirs(self.recording_cache_dir)
+            if self.read_workers > 1:
+                reader = ParallelCSVReader.ParallelCSVReader('data/' + csv_file, self.read_workers)
+                chunks = reader.iter_ranges(usecols=self.ingest_dtypes.keys(), dtype=self.ingest_dtypes,
+                                            range_bytes=RecordingStore.CONVERT_CHUNK_ROWS * reader.row_bytes)
+            else:
+                chunks = pd.read_csv('data/' + csv_file, usecols=self.ingest_dtypes.keys(), dtype=self.ingest_dtypes,
+                                     chunksize=RecordingStore.CONVERT_CHUNK_ROWS)
+            recording_store = RecordingStore.RecordingStore.convert(store_path, chunks)
+        return recording_store
+
+    def _get_recording_cache_path(self, csv_file, chunk_rows):
+        # Per recording cache, keyed on the content of the csv and anything that changes how it is imported.
+        # The combined track store is keyed on these keys (see _get_track_store_key), so every setting that changes the
+        # tracks must be here: ingest_float32 and the raw columns read (ingest_dtypes), ingest_chunk_rows,
+        # ingest_max_open_rows, ingest_binary_recordings and ingest_batched_distance.
+        key = hashlib.md5(str((utils.get_file_fingerprint('data/' + csv_file), INGEST_CACHE_VERSION,
+                               chunk_rows, self.batched_distance, self.intersections.lookup(csv_file).fingerprint,
+                               self.binary_recordings,
+                               self._get_max_open_rows(chunk_rows),
+                               sorted([(name, np.dtype(dtype).str) for name, dtype in self.ingest_dtypes.iteritems()])
+                               ))).hexdigest()
+        return os.path.join(self.ingest_cache_dir, os.path.splitext(csv_file)[0] + '-' + key + '.tracks')
+
+    def _get_track_store_key(self, csv_name, chunk_rows):
+        # Key of the track store of all recordings in csv_name. It is made from the key of each recording in the ingest
+        # cache, so it changes with the contents of any recording and with every setting that changes the tracks.
+        recording_keys = []
+        for csv_file in csv_name:
+            if os.path.isfile('data/' + csv_file):
+                recording_keys.append(os.path.basename(self._get_recording_cache_path(csv_file, chunk_rows)))
+            else:
+                # _import_recordings reports the missing file
+                recording_keys.append(csv_file)
+        return utils.get_value_fingerprint([recording_keys,
+                                            utils.get_source_digest(['ibeoCSVImporter.py',
+                                                                     'IntersectionGeometry.py',
+                                                                     'intersections.json'])])
+
+    def _import_recording_cached(self, args):
+        # uniqueIds are local to the recording and start from 1, so that the recording can be imported on its own,
+        # in a worker process, or loaded from cache. The number of ids used is kept with the tracks so they can be
+        # made globally unique when merging.
+        csv_file, chunk_rows = args
+        cache_path = self._get_recording_cache_path(csv_file, chunk_rows)
+        track_store = TrackStore.TrackStore.load(cache_path, mmap_mode=None)
+        if track_store is not None:
+            print "Loaded cached tracks for " + csv_file
+            return track_store
+        print "Reading CSV " + csv_file
+        self.unique_id_idx = int(1)
+        tracks = self._import_recording(csv_file, chunk_rows)
+        track_store = TrackStore.TrackStore.from_track_list(tracks, attributes={'ids_used': self.unique_id_idx - 1})
+        # The store is written then renamed, such that an interrupted ingest never leaves a partial cache.
+        track_store.save(cache_path)
+        return track_store
+
+    def _import_recordings(self, csv_name, chunk_rows, ingest_workers=1):
+        # Import every recording, reusing any that are already in the ingest cache. With more than one worker, each
+        # recording is imported in its own process. The merge is in csv_name order, offsetting each recording's local
+        # ids by the ids used before it, so the result is the same as reading all recordings in sequence.
+        missing_files = [csv_file for csv_file in csv_name if not os.path.isfile('data/' + csv_file)]
+        if len(missing_files) > 0:
+            print "No cached csv data found. Double check the parameters file if you do not have CSV's present"
+            print "If you have not downloaded the dataset from http://its.acfr.usyd.edu.au/datasets/ do so now"
+            print "Went looking for the original CSVs files (~250GiB worth). Files not found: " + str(missing_files)
+            print "Did you mean to use the dataset available at http://its.acfr.usyd.edu.au/datasets/ ?"
+            exit(1)
+        if not os.path.exists(self.ingest_cache_dir):
+            os.makedirs(self.ingest_cache_dir)
+        args = [(csv_file, chunk_rows) for csv_file in csv_name]
+        pool = None
+        if ingest_workers > 1:
+            print "Reading " + str(len(csv_name)) + " CSVs with " + str(ingest_workers) + " workers"
+            # The workers cannot start processes of their own, so each reads its recording alone. This does not change
+            # the tracks, or the cache entries they are kept in.
+            self.read_workers = 1
+            pool = mp.Pool(processes=ingest_workers)
+            results = pool.imap(self._import_recording_cached, args)
+        else:
+            results = itertools.imap(self._import_recording_cached, args)
+        # Importing in this process resets self.unique_id_idx, so keep the global count separately.
+        next_unique_id = self.unique_id_idx
+        recording_stores = []
+        try:
+            # Merged as each recording arrives, rather than once all of them are in memory
+            for csv_file, track_store in itertools.izip(csv_name, results):
+                if len(track_store) > 0:
+                    track_store.columns['uniqueId'] = track_store.columns['uniqueId'] + (next_unique_id - 1)
+                next_unique_id += track_store.attributes['ids_used']
+                recording_stores.append(track_store)
+                # Gate labels for the summary printer
+                self.lookup_intersection_extent(csv_file)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.unique_id_idx = next_unique_id
+        self.labelled_track_list = TrackStore.TrackStore.concatenate(recording_stores)
+
+    def _get_ingest_schema(self, parameters):
+        # Columns to read from the raw csv and their types.
+        # Measurements can optionally be read as float32, halving their memory, at the cost of small differences in
+        # the computed distances and in the labels of points that are right on the edge of a gate.
+        try:
+            measurement_type = np.float32 if parameters['ingest_float32'] else np.float64
+        except KeyError:
+            measurement_type = np.float64
+        ingest_dtypes = {}
+        for name, dtype in INGEST_COLUMN_TYPES:
+            ingest_dtypes[name] = measurement_type if dtype is np.float64 and name != 'Timestamp' else dtype
+        try:
+            for name in parameters['ibeo_data_columns']:
+                if name in IBEO_RAW_COLUMNS and name not in ingest_dtypes:
+                    ingest_dtypes[name] = measurement_type
+        except KeyError:
+            pass
+        return ingest_dtypes
+
+    def _get_max_open_rows(self, chunk_rows):
+        if chunk_rows is None:
+            return None
+        if self.max_open_rows is None:
+            return chunk_rows
+        return self.max_open_rows
+
+    def _read_recording(self, csv_file, chunk_rows=None):
+        # Yields dataframes of raw rows that can be processed independently.
+        # Without a chunk size, the whole file is yielded at once. With a chunk size, rows of tracks that may
+        # continue into the next chunk are carried over, and only rows of tracks that have ended are yielded.
+        # At most max_open_rows rows are carried, so memory is bound by the chunk size plus max_open_rows. See
+        # _split_open_tracks for what happens to tracks that would exceed it.
+        # With read workers, the file is parsed in byte ranges by several processes. The chunks are the same rows either
+        # way, so the tracks do not depend on the number of read workers.
+        reader = None
+        if self.read_workers > 1:
+            reader = ParallelCSVReader.ParallelCSVReader('data/' + csv_file, self.read_workers)
+        if chunk_rows is None:
+            if reader is not None:
+                input_df = reader.read(usecols=self.ingest_dtypes.keys(), dtype=self.ingest_dtypes)
+            else:
+                input_df = pd.read_csv('data/' + csv_file, usecols=self.ingest_dtypes.keys(), dtype=self.ingest_dtypes)
+            input_df['csv_name'] = [csv_file]*len(input_df)
+            yield input_df
+            return
+        if reader is not None:
+            chunks = reader.iter_chunks(chunk_rows, usecols=self.ingest_dtypes.keys(), dtype=self.ingest_dtypes)
+        else:
+            chunks = pd.read_csv('data/' + csv_file, usecols=self.ingest_dtypes.keys(), dtype=self.ingest_dtypes,
+                                 chunksize=chunk_rows)
+        max_open_rows = self._get_max_open_rows(chunk_rows)
+        open_df = None
+        for chunk_df in chunks:
+            chunk_df['csv_name'] = [csv_file]*len(chunk_df)
+            if open_df is not None:
+                chunk_df = pd.concat([open_df, chunk_df])
+            closed_df, open_df = self._split_open_tracks(chunk_df, max_open_rows)
+            if len(closed_df) > 0:
+                yield closed_df
+        if open_df is not None and len(open_df) > 0:
+            yield open_df
+
+    def _split_open_tracks(self, input_df, max_open_rows=None):
+        # Split a chunk into the rows of tracks that have finished, and the rows of tracks that are still being
+        # observed at the end of the chunk. A track is open if its object was seen within the disambiguation gap of
+        # the last timestamp, as the next chunk may continue it. Only the final contiguous segment of an object is
+        # carried, earlier segments are already complete.
+        # If the open tracks have more than max_open_rows rows, the longest are flushed as if they had ended, until the
+        # rest fit. The rest of a flushed track starts a new track in the next chunk. Parked objects are the usual
+        # cause, and as they never pass through a destination gate, neither part is labelled.
+        timestamps = input_df.Timestamp.values
+        object_ids = input_df.ObjectId.values
+        order = np.lexsort((timestamps, object_ids))
+        sorted_ts = timestamps[order]
+        sorted_ids = object_ids[order]
+        new_object = np.append(True, sorted_ids[1:] != sorted_ids[:-1])
+        segment_idx = np.cumsum(new_object | np.append(False, np.diff(sorted_ts) > TRACK_GAP_SECONDS))
+        last_of_object = np.append(new_object[1:], True)
+        open_segments = segment_idx[last_of_object & (sorted_ts > timestamps.max() - TRACK_GAP_SECONDS)]
+        if max_open_rows is not None:
+            segment_rows = np.bincount(segment_idx)[open_segments]
+            if segment_rows.sum() > max_open_rows:
+                # Longest first
+                by_length = np.argsort(-segment_rows, kind='mergesort')
+                flushed_rows = np.append(0, np.cumsum(segment_rows[by_length]))
+                num_flushed = np.argmax(segment_rows.sum() - flushed_rows <= max_open_rows)
+                print "\rWarning, flushing " + str(num_flushed) + " open tracks to stay within ingest_max_open_rows"
+                open_segments = open_segments[np.sort(by_length[num_flushed:])]
+        is_open = np.zeros(len(input_df), dtype=bool)
+        is_open[order] = np.in1d(segment_idx, open_segments)
+        # Copies are chunk sized, and stop pandas warning about setting values on a slice in _parse_ibeo_df
+        return input_df[~is_open].copy(), input_df[is_open].copy()
+
+    def _process_recording_df(self, input_df, sort_order=None):
+        # Full pipeline from raw rows of a single recording to the trimmed and labelled track list.
+        # sort_order is the (ObjectId, Timestamp) order of the rows, if already known.
+        parsed_df = self._parse_ibeo_df(input_df)
+        input_df = None
+        #print "Disambiguating tracks"
+        disambiguated_df = self._disambiguate_df(parsed_df, sort_order)
+        parsed_df = None
+        labelled_track_list = self._label_df(disambiguated_df)
+        #print "Calculating intersection distance"
+
+        sub_track_list = self._calculate_intersection_distance(labelled_track_list, batched=self.batched_distance)
+        trimmed_tracks = self._trim_tracks(sub_track_list)
+        related_tracks = self._add_relative_tracks(trimmed_tracks)
+        return trimmed_tracks
+
     def lookup_intersection_extent(self,csv_name):
-        #        format: x_min,x_max,y_min,y_max
-        if '20170427-stationary-2-leith-croydon' in csv_name:
-            top_exit = [-33, -30, 3, 4]
-            top_enter = [-23, -20, 6, 7]
-            right_exit = [-16, -15, -3, 2]
-            right_enter = [-16, -15, -12, -8]
-            low_exit = [-23, -21, -19, -18]
-            low_enter = [-33, -30, -16, -15]
-            intersection_centre = [-25.8, -5]
-            intersection_rotation = 0
-            self.dest_gates = {"north": top_exit, "east": right_exit, "south": low_exit}
-            self.origin_gates = {
-                "north": top_enter,
-                "east": right_enter,
-                "south": low_enter
-            }
-            self.relative_ring = ['north', 'east', 'south', 'west'] # Clockwise relation of each gate
-        if (('20170601-stationary-3-leith-croydon' in csv_name) or
-            ('stationary-4-leith-croydon' in csv_name) or
-            ('stationary-5-leith-croydon' in csv_name)):
-            # left right bottom top
-            top_exit = [-25, -16, 0, 0.5]
-            top_enter = [-12, -6, 0, 0.5]
-            right_exit = [-1.0, -0, -6, 0]
-            right_enter = [-1.0, 0.0, -17, -10]
-            left_exit = [-25, -24.1, -16, -9]
-            left_enter = [-26, -25, -7, -0]
-            intersection_centre = [-14.4, -7.5]
-            intersection_rotation = 0  # 90 degree?
-            self.dest_gates = {"north": left_exit, "east": top_exit, "south": right_exit}
-            self.origin_gates = {
-                "north": left_enter,
-                #  "east": top_enter,  # Removed the poor visibility entrance from the data, There was a fence next to the parked car.
-                "south": right_enter
-            }
-            self.relative_ring = ['north', 'east', 'south', 'west']
-        if 'queen-hanks' in csv_name:
-            # left right bottom top
-            top_exit = [26, 30, 6, 7]
-            right_exit = [41, 42, -3, 3]
-            right_enter = [41, 42, -9, -6]
-            left_enter = [18, 20, -2, 2]
-            left_exit = [18, 20, -10, -6]
-            bottom_exit = [30, 35, -14, -13]
-            self.dest_gates = {"north": right_exit, "east": bottom_exit, "west": top_exit, "south": left_exit}
-            self.origin_gates = {
-                "south": left_enter,
-                "north": right_enter
-            }
-            self.relative_ring = ['north', 'east', 'south', 'west']
-        if 'roslyn-crieff' in csv_name:
-            # left right bottom top
-            right_exit = [-12,-10,-4,2]
-            right_enter = [-12,-10,-12,-8]
-            left_enter = [-31,-29,-3,1]
-            left_exit = [-31,-29,-13,-8]
-            top_exit = [-27,-24,3,5]
-            bottom_exit = [-18,-14,-15,-13]
-            self.dest_gates = {"NW": right_exit, "NE": bottom_exit, "SW": top_exit, "SE": left_exit}
-            self.origin_gates = {
-                "SE": left_enter,
-                "NW": right_enter
-            }
-            self.relative_ring = ['NW', 'NE', 'SE', 'SW']
-        if 'oliver-wyndora' in csv_name:
-            # left right bottom top
-            right_exit = [-10, -8, -5, 0]
-            right_enter = [-10, -8, -12, -6]
-            bottom_exit = [-17, -13, -16, -14]
-            left_exit = [-28, -26, -12, -8]
-            left_enter = [-28, -26, -3, 0]
-            top_exit = [-22, -18, 4, 6]
-            self.dest_gates = {"north": right_exit, "east": bottom_exit, "west": top_exit, "south": left_exit}
-            self.origin_gates = {
-                "south": left_enter,
-                "north": right_enter
-            }
-            self.relative_ring = ['north', 'east', 'south', 'west']
-        if 'orchard-mitchell' in csv_name:
-            # left right bottom top
-            right_enter = [-11, -9, -13, -5]
-            right_exit = [-11, -9, -4, -2]
-            bottom_exit = [-23, -16, -16, -14]
-            left_exit = [-30, -28, -13, -5]
-            left_enter = [-30, -28, -5, 1]
-            top_exit = [-24, -18, 4, 6]
-            self.dest_gates = {"north": right_exit, "east": bottom_exit, "west": top_exit, "south": left_exit}
-            self.origin_gates = {
-                "south": left_enter,
-                "north": right_enter
-            }
-            self.relative_ring = ['north', 'east', 'south', 'west']
+        # The gates of each intersection are in intersections.json, see IntersectionGeometry
+        intersection = self.intersections.lookup(csv_name)
+        if intersection is not None:
+            self.intersection = intersection
+            self.dest_gates = intersection.dest_gates
+            self.origin_gates = intersection.origin_gates
+            self.relative_ring = intersection.relative_ring
         for key, value in self.dest_gates.iteritems():
             self._cumulative_dest_list.append(key)
         for key, value in self.origin_gates.iteritems():
@@ -229,11 +445,16 @@ class ibeoCSVImporter:
 
         summary_df = pd.DataFrame(np.zeros([len(orig_key_list), len(dest_key_list)]),
                                   index=orig_key_list, columns=dest_key_list)
-        for single_track in self.labelled_track_list:
-            if relative:
-                summary_df.loc[single_track.iloc[0]["origin"], single_track.iloc[0]["relative_destination"]] += 1
-            else:
-                summary_df.loc[single_track.iloc[0]["origin"], single_track.iloc[0]["destination"]] += 1
+        if isinstance(self.labelled_track_list, TrackStore.TrackStore):
+            # Read the labels straight from the columns, rather than building every track
+            origins = self.labelled_track_list.first_values("origin")
+            destinations = self.labelled_track_list.first_values("relative_destination" if relative else "destination")
+        else:
+            origins = [single_track.iloc[0]["origin"] for single_track in self.labelled_track_list]
+            destinations = [single_track.iloc[0]["relative_destination" if relative else "destination"]
+                            for single_track in self.labelled_track_list]
+        for origin, destination in zip(origins, destinations):
+            summary_df.loc[origin, destination] += 1
         # Add marginals
         summary_df["total"] = summary_df.sum(1)
         summary_df = summary_df.append(pd.Series(summary_df.sum(0), name="total"))
@@ -242,10 +463,10 @@ class ibeoCSVImporter:
         print summary_df
 
     def _in_box(self, point, extent):
-        """Return if a point is within a spatial extent."""
-        return ((point[0] >= extent[0]) and
-                (point[0] <= extent[1]) and
-                (point[1] >= extent[2]) and
+        """Return if a point is within a spatial extent. Also works element-wise on arrays of coordinates."""
+        return ((point[0] >= extent[0]) &
+                (point[0] <= extent[1]) &
+                (point[1] >= extent[2]) &
                 (point[1] <= extent[3]))
 
     def _parse_ibeo_df(self, input_df):
@@ -268,152 +489,94 @@ class ibeoCSVImporter:
 
         return input_df
 
-    def _lookup_intersection_origin_per_entrance(self, csv_name, entrance):
-        if 'oliver-wyndora' in csv_name:
-            if entrance == 'north':
-                origin = [-9.3, -5.3]
-                rotation = [-1, 0]
-            if entrance == 'south':
-                origin = [-27.7, -5.3]
-                rotation = [1, 0]
-
-        if 'roslyn-crieff' in csv_name:
-            if entrance == 'NW':
-                origin = [-11.8, -5.3]
-                rotation = [-1, 0]
-            if entrance == 'SE':
-                origin = [-30.5, -5.3]
-                rotation = [1, 0]
-
-        if 'queen-hanks' in csv_name:
-            if entrance == 'north':
-                origin = [38.5, -3.0]
-                rotation = [-1, 0]
-            if entrance == 'south':
-                origin = [21.7, -3.8]
-                rotation = [1, 0]
-
-        if 'orchard-mitchell' in csv_name:
-            if entrance == 'north':
-                origin = [-11.5, -5.3]
-                rotation = [-1, 0]
-            if entrance == 'south':
-                origin = [-28.5, -5.3]
-                rotation = [1, 0]
-
-        if 'leith-croydon' in csv_name:
-            if entrance == 'north':
-                origin = [-23.3, -7.8]
-                rotation = [1, 0]
-            if entrance == 'south':
-                origin = [-5, -7.8]
-                rotation = [-1, 0]
-            if entrance == 'east':
-                origin = [-13.9, 0.7]
-                rotation = [0, 1]
-
-        return origin, rotation
-
-    def _angle_between(self, v1, v2):
-        # Returns the angle in radians between 2D vectors 'v1' and 'v2'
-        return np.arctan2(v2[1], v2[0]) - np.arctan2(v1[1], v1[0])
-
     def _add_relative_tracks(self, tracks):
-        new_tracks = []
-        for track in tracks:
-            # Subtract origin first, then rotate.
-            # This means the new origin does not need to be rotated
-            x = track['Object_X']
-            y = track['Object_Y']
-            origin_coords, orig_vec = self._lookup_intersection_origin_per_entrance(track.csv_name.iloc[0],
-                                                                                    track.origin.iloc[0])
-            x_z = x - origin_coords[0]
-            y_z = y - origin_coords[1]
-            dest_vec = [0, 1]
-            a = self._angle_between(orig_vec, dest_vec)
-            new_x = x_z*np.cos(a) - y_z*np.sin(a)
-            new_y = x_z*np.sin(a) + y_z*np.cos(a)
-            new_a = track.ObjBoxOrientation + a
-            # shift to -pi and pi
-            # ILL-EAGLE
-            #new_a = ((new_a + 2*np.pi) % 2*np.pi) - np.pi
-            #new_a = [a if a < 2 * np.pi else a - (2*np.pi) for a in new_a]
-            # The regular coordinates were x forward, y left, carteasian angles (ccw, from x=0 axis)
-            # The relative coords are now y forward, x right, and ccw angles from y=0
-            # This makes graphing easy and convienent, but angles are annoying.
-            # Having zero at the top, +- pi radians, and the vehicles travelling upwards avoids rollover
-            new_a += np.pi/2
-            new_a = ((new_a + 2*np.pi) % (2*np.pi))
-            new_a -= np.pi
-            track['relative_x'] = new_x
-            track['relative_y'] = new_y
-            track['relative_angle'] = new_a
-            new_tracks.append(track)
-
-        return new_tracks
-
-    def _disambiguate_df(self, input_df):
-        drop_list = []
+        # Transform all tracks into the frame of their entrance together, see Intersection.to_relative
+        if len(tracks) == 0:
+            return tracks
+        lengths = np.array([len(track) for track in tracks])
+        offsets = np.append(0, np.cumsum(lengths))
+        # Entrance of every row. Tracks are from one recording, but are grouped by intersection to be safe.
+        intersection_names = [track.csv_name.iloc[0] for track in tracks]
+        relative_x = np.empty(offsets[-1])
+        relative_y = np.empty(offsets[-1])
+        relative_angle = np.empty(offsets[-1])
+        for csv_name in set(intersection_names):
+            intersection = self.intersections.lookup(csv_name)
+            track_idxs = [track_idx for track_idx in range(len(tracks)) if intersection_names[track_idx] == csv_name]
+            entrance_idx = intersection.entrance_index([tracks[track_idx].origin.iloc[0] for track_idx in track_idxs])
+            rows = np.concatenate([np.arange(offsets[track_idx], offsets[track_idx + 1]) for track_idx in track_idxs])
+            relative_x[rows], relative_y[rows], relative_angle[rows] = intersection.to_relative(
+                np.concatenate([tracks[track_idx]['Object_X'].values for track_idx in track_idxs]),
+                np.concatenate([tracks[track_idx]['Object_Y'].values for track_idx in track_idxs]),
+                np.concatenate([tracks[track_idx]['ObjBoxOrientation'].values for track_idx in track_idxs]),
+                np.repeat(entrance_idx, lengths[track_idxs]))
+
+        # Keep the precision the positions were read in
+        dtype = tracks[0]['Object_X'].dtype
+        for track_idx in range(len(tracks)):
+            track = tracks[track_idx]
+            track['relative_x'] = relative_x[offsets[track_idx]:offsets[track_idx + 1]].astype(dtype)
+            track['relative_y'] = relative_y[offsets[track_idx]:offsets[track_idx + 1]].astype(dtype)
+            track['relative_angle'] = relative_angle[offsets[track_idx]:offsets[track_idx + 1]].astype(dtype)
+
+        return tracks
+
+    def _disambiguate_df(self, input_df, sort_order=None):
+        # The sensor re-uses ObjectIds, so split every object into contiguous tracks and give each a uniqueId.
+        # All objects are handled at once on a single (ObjectId, Timestamp) sort, instead of filtering the frame once
+        # per object. uniqueIds are allocated in ObjectId then time order, the same as the original per-object loop.
+        # The sort can be given as sort_order, the stable (ObjectId, Timestamp) order of the rows of input_df.
         DROP_INDEX = -1
-        object_id_list = np.sort(input_df.ObjectId.unique())
         # Classes 4 and 5 are car, truck (maybe in that order)
         # 3 might be bike, have to check.
         # I only care about cars and trucks right now.
 
-        vehicle_df = input_df # .loc[input_df.Classification > 3, :]
-
-        disambiguated_df_list = []
-
-        for ID in object_id_list:
-            sys.stdout.write("\rDisambiguating track: %04d of %04d" % (ID, len(object_id_list)))
-            sys.stdout.flush()
-            obj_data = vehicle_df.loc[vehicle_df.ObjectId == ID, :]
-
-            # Some objects have no data at all.
-            if len(obj_data) < 5:
-                continue
-
-            obj_data = obj_data.reset_index() # Create copy, and reset the index to be contiguous
-            obj_data.rename(columns={'index': "file_index"}, inplace=True)
-            obj_data = obj_data.sort_values(['Timestamp'], ascending=True)
-
-            # Diff in its current format gives an off-by one error when passed to my splitter function.
-            # insert/delete used to shift the whole array over by one.
-            obj_diff = np.diff(obj_data['Timestamp'])
-            obj_diff = np.insert(np.delete(obj_diff, -1), [0], [0])
-
-            # Recording is at 25Hz, thus ~0.04 seconds between samples is contiguous,
-            # however, in some recordings there is jitter 0.0285, 0.0515, 0.0285, 0.0515
-            # Who knew noise was such a problem?
-            cuts = np.where(obj_diff > 0.07)[0]
-            prev_cut = 0
-            cuts = np.append(cuts, len(obj_data))
-            for cut in cuts:
-                #print obj_data.loc[prev_cut:cut, :]
-
-                # Now that we have isolated the tracks, drop any that do not meet classification requirements
-                # Note that the class may begin as `unknown', and later become classified, so do not check only for
-                #  any class > 3, but instead check all class > 3
-
-                if (obj_data.loc[prev_cut:cut-1].Classification < 4).all():
-                    obj_data.loc[prev_cut:cut-1, "uniqueId"] = DROP_INDEX
-                else:
-                    obj_data.loc[prev_cut:cut-1, "uniqueId"] = self.unique_id_idx
-                    self.unique_id_idx += 1
-
-                #print("ObjId:" + str(ID) + " UniqueId:" + str(unique_id_idx) +
-                #      " Prev:" + str(prev_cut) + " end:" + str(cut))
-                prev_cut = cut
-
-            if len(cuts) == 0:
-                cuts = [0]
-
-            obj_data.uniqueId = obj_data.uniqueId.astype(int) # Why is this a float64?
-
-            disambiguated_df_list.append(obj_data)
+        # Some objects have no data at all.
+        object_sizes = input_df.groupby('ObjectId').ObjectId.transform('size').values
+        is_vehicle_row = object_sizes >= 5
+        vehicle_df = input_df[is_vehicle_row]
+        sys.stdout.write("\rDisambiguating tracks: %04d objects" % len(vehicle_df.ObjectId.unique()))
+        sys.stdout.flush()
 
-        disambiguated_df = pd.concat(disambiguated_df_list)
-        disambiguated_df = disambiguated_df[disambiguated_df.uniqueId != DROP_INDEX]
+        # Position of each row within its object in file order. This was the index the per-object frames carried.
+        object_row_idx = vehicle_df.groupby('ObjectId').cumcount().values
+        if sort_order is None:
+            order = np.lexsort((vehicle_df.Timestamp.values, vehicle_df.ObjectId.values))
+        else:
+            # Drop the rows of small objects from the order, and renumber the rest
+            order = (np.cumsum(is_vehicle_row) - 1)[sort_order[is_vehicle_row[sort_order]]]
+        object_ids = vehicle_df.ObjectId.values[order]
+        timestamps = vehicle_df.Timestamp.values[order]
+        classification = vehicle_df.Classification.values[order]
+
+        object_start = np.ones(len(order), dtype=bool)
+        object_start[1:] = object_ids[1:] != object_ids[:-1]
+        object_end = np.ones(len(order), dtype=bool)
+        object_end[:-1] = object_start[1:]
+
+        # Recording is at 25Hz, thus ~0.04 seconds between samples is contiguous,
+        # however, in some recordings there is jitter 0.0285, 0.0515, 0.0285, 0.0515
+        # Who knew noise was such a problem?
+        # The gap before the final sample of an object never cuts the track, as the original diff was shifted by one.
+        time_diff = np.zeros(len(order))
+        time_diff[1:] = np.diff(timestamps)
+        cuts = (time_diff > TRACK_GAP_SECONDS) & ~object_start & ~object_end
+        segment_idx = np.cumsum(object_start | cuts) - 1
+        num_segments = segment_idx[-1] + 1 if len(order) > 0 else 0
+
+        # Now that we have isolated the tracks, drop any that do not meet classification requirements
+        # Note that the class may begin as `unknown', and later become classified, so do not check only for
+        #  any class > 3, but instead check all class > 3
+        is_vehicle = np.bincount(segment_idx, weights=~(classification < 4), minlength=num_segments) > 0
+        segment_ids = np.full(num_segments, DROP_INDEX, dtype=np.int64)
+        segment_ids[is_vehicle] = self.unique_id_idx + np.arange(np.count_nonzero(is_vehicle))
+        self.unique_id_idx += np.count_nonzero(is_vehicle)
+
+        unique_ids = segment_ids[segment_idx]
+        keep = unique_ids != DROP_INDEX
+        disambiguated_df = vehicle_df.iloc[order[keep]].assign(uniqueId=unique_ids[keep])
+        disambiguated_df.insert(0, 'file_index', vehicle_df.index.values[order[keep]])
+        disambiguated_df.index = object_row_idx[order[keep]]
         sys.stdout.write("\t\t\t\t%4s" % "[ OK ]")
         sys.stdout.write("\r\n")
         return disambiguated_df
@@ -435,60 +598,60 @@ class ibeoCSVImporter:
     # Instead, I only want to label them according to the gates, and calculate the distance from these gates.
 
     def _label_df(self, disambiguated_df):
+        # Every gate is tested against every point of every track at once. Per track, the origin is the gate containing
+        # the first point inside any origin gate, and the destination is the first destination gate reached after that.
+        # Where gates overlap, the last in iteration order wins as it did when looping over the gates per point.
 
         clean_tracks = []
+        if len(disambiguated_df) == 0:
+            return clean_tracks
+
+        # Group the rows of each track together, in order of appearance and then time.
+        track_codes = pd.factorize(disambiguated_df.uniqueId)[0]
+        order = np.lexsort((disambiguated_df.Timestamp.values, track_codes))
+        track_codes = track_codes[order]
+        track_starts = np.append(0, np.flatnonzero(np.diff(track_codes)) + 1)
+        track_ends = np.append(track_starts[1:], len(order))
+        sys.stdout.write("\rSorting tracks: %04d " % len(track_starts))
+        sys.stdout.flush()
 
-        for uID in disambiguated_df.uniqueId.unique():
-            # obj_data = vehicle_df[vehicle_df.ObjectId==ID]
-            obj_data = disambiguated_df.loc[disambiguated_df.uniqueId == uID, :]
-            #print("Sorting track: " + str(uID))
-            if all(obj_data.trackedByStationaryModel):
-                #print "Don't know what's going on here, but the data is incomplete for this track, skipping"
-                continue
-            sys.stdout.write("\rSorting track: %04d of %04d " % (uID,max(disambiguated_df.uniqueId.unique())))
-            sys.stdout.flush()
-            if len(obj_data) < 1:
-                continue
-
-            # I do want to be copying out my slice and adding them individually to a new collection, as this reduces size
-            obj_data = obj_data.sort_values(['Timestamp'], ascending=True).reset_index()
-
-            intersection_flag = False
-            origin_label = None
-            dest_label = None
-            for time_idx in range(0, len(obj_data)):
-                data = obj_data.iloc[time_idx]
-                o_X = data["Object_X"]
-                o_Y = data["Object_Y"]
-                if intersection_flag == False:
-                    for label, gate in self.origin_gates.iteritems():
-                        if self._in_box([o_X, o_Y], gate):
-                            origin_label = label
-                            intersection_flag = True
-
-                else:
-                    for label, gate in self.dest_gates.iteritems():
-                        if self._in_box([o_X, o_Y], gate):
-                            # if label == origin_label:
-                            #     #Skip U turns. HACK This is because in the first dataset, we have only 1 u-turn.
-                            #     # This breaks the stratifier.
-                            #     continue
-                            dest_label = label
-
-                if origin_label is not None and dest_label is not None:
-                    # Stop checking, we have categorized this track
-                    break
-
-            if origin_label is None or dest_label is None:
-                # If we never categorized this track, its garbage, skip this and check next track
-                continue
-            obj_data["origin"] = [origin_label] * len(obj_data)
-            obj_data["destination"] = [dest_label] * len(obj_data)
-            #print("ID: " + str(uID) + " Origin: " + origin_label + " Destination: " + dest_label)
-            obj_data["relative_destination"] = [self._get_relative_exit(origin_label,dest_label)] * len(obj_data)
-            obj_data = obj_data.assign(AbsVelocity=np.sqrt(np.power(obj_data['AbsVelocity_X'], 2)
-                                                           + np.power(obj_data['AbsVelocity_Y'], 2)))
-
+        o_X = disambiguated_df.Object_X.values[order]
+        o_Y = disambiguated_df.Object_Y.values[order]
+        row_idx = np.arange(len(order))
+        no_hit = len(order)
+
+        origin_gate = self.intersection.which_gate(o_X, o_Y, 'origin')
+        first_origin = np.minimum.reduceat(np.where(origin_gate != IntersectionGeometry.NO_GATE, row_idx, no_hit),
+                                           track_starts)
+        dest_gate = self.intersection.which_gate(o_X, o_Y, 'dest')
+        after_origin = row_idx > first_origin[track_codes]
+        first_dest = np.minimum.reduceat(np.where((dest_gate != IntersectionGeometry.NO_GATE) & after_origin,
+                                                  row_idx, no_hit), track_starts)
+
+        # Don't know what's going on with these, but the data is incomplete for this track, skipping
+        all_stationary = np.logical_and.reduceat(disambiguated_df.trackedByStationaryModel.values[order].astype(bool),
+                                                 track_starts)
+        # If we never categorized this track, its garbage, skip this and check next track
+        labelled = (first_origin < no_hit) & (first_dest < no_hit) & ~all_stationary
+
+        # I do want to be copying out my slice and adding them individually to a new collection, as this reduces size
+        labelled_df = disambiguated_df.iloc[order[np.repeat(labelled, track_ends - track_starts)]]
+        lengths = (track_ends - track_starts)[labelled]
+        offsets = np.append(0, np.cumsum(lengths))
+        origin_list = [self.intersection.origin_labels[gate] for gate in origin_gate[first_origin[labelled]]]
+        dest_list = [self.intersection.dest_labels[gate] for gate in dest_gate[first_dest[labelled]]]
+        relative_list = [self._get_relative_exit(origin_label, dest_label)
+                         for origin_label, dest_label in zip(origin_list, dest_list)]
+
+        # One assign per column, as keyword order is not kept
+        labelled_df = labelled_df.assign(origin=np.repeat(np.array(origin_list, dtype=object), lengths))
+        labelled_df = labelled_df.assign(destination=np.repeat(np.array(dest_list, dtype=object), lengths))
+        labelled_df = labelled_df.assign(relative_destination=np.repeat(np.array(relative_list, dtype=object), lengths))
+        labelled_df = labelled_df.assign(AbsVelocity=np.sqrt(np.power(labelled_df['AbsVelocity_X'], 2)
+                                                             + np.power(labelled_df['AbsVelocity_Y'], 2)))
+
+        for track_idx in range(len(lengths)):
+            obj_data = labelled_df.iloc[offsets[track_idx]:offsets[track_idx + 1]].reset_index()
             clean_tracks.append(obj_data)
         sys.stdout.write(" Found %d clean tracks" % (len(clean_tracks)))
         sys.stdout.write("\t\t%4s" % "[ OK ]")
@@ -499,77 +662,98 @@ class ibeoCSVImporter:
         return clean_tracks
 
     def _trim_tracks(self,long_tracks):
+        # All tracks are trimmed together. The rules are evaluated on the concatenated columns to give a single keep
+        # mask, and each track is then copied out once.
         #Intersection extent buffer.
         intersection_limits = 15
         dis_after_exit = 5
+        min_track_length = 30
         trimmed_tracks = []
-
-        intersection_xs = []
-        intersection_ys = []
-        for cardinal, box in self.dest_gates.iteritems():
-            intersection_xs.extend(box[0:1])
-            intersection_ys.extend(box[2:3])
-        for cardinal, box in self.origin_gates.iteritems():
-            intersection_xs.extend(box[0:1])
-            intersection_ys.extend(box[2:3])
-        int_x_max = max(intersection_xs)
-        int_x_min = min(intersection_xs)
-        int_y_max = max(intersection_ys)
-        int_y_min = min(intersection_ys)
-
-        for track in long_tracks:
-            debug_track = track.copy()
-            #Cut out cars that park if they are visible
-            last_moving_idx = max(track[track['AbsVelocity'] > 0.1].index)
-            last_observed_idx = max(track[track['ObjectPredAge'] == 0].index)
-            # trim_track = track.iloc[0:last_moving_idx]
-            # If they are outside the roundabout and have stopped i.e. parked
-            track.drop(track[(track.index > last_moving_idx) & (
-                             (track.Object_Y > int_y_max) |
-                             (track.Object_Y < int_y_min) |
-                             (track.Object_X > int_x_max) |
-                             (track.Object_X < int_x_min))
-                             ].index, inplace=True)
-            # If the system is guessing
-            track.drop(track[(track.index > last_observed_idx) & (
-                             (track.Object_Y > int_y_max) |
-                             (track.Object_Y < int_y_min) |
-                             (track.Object_X > int_x_max) |
-                             (track.Object_X < int_x_min))
-                             ].index, inplace=True)
-            # Or they are not in the roundabout proximity
-            track.drop(track[(track.Object_Y > ( intersection_limits + int_y_max)) |
-                             (track.Object_Y < (-intersection_limits + int_y_min)) |
-                             (track.Object_X > ( intersection_limits + int_x_max)) |
-                             (track.Object_X < (-intersection_limits + int_x_min))
-                       ].index, inplace=True)
-            # Or they have left the roundabout
-            track.drop(track[(track.distance_to_exit > dis_after_exit)].index, inplace=True)
-            #track.drop('level_0', axis=1,inplace=True)
-            # And now trim everything that is not continuous around distance zero.
-            track.reset_index(inplace=True)
-            track.drop('level_0', axis=1, inplace=True)
-
-            # and finally, check if any of the above filters have split a track in two. Keep the track that contains
-            # distance zero
-            cuts = np.where(np.diff(track.Timestamp) > 1)[0]
-            if len(cuts) > 0:
-                cuts += 1
-                cuts = np.append(np.insert(cuts, 0, 0), len(track))
-                for i in range(len(cuts)-1):
-                    #check if zero distance is in this sequence
-                    if not 0.0 in list(track.iloc[cuts[i]:cuts[i+1]].distance):
-                        track.drop(range(cuts[i],cuts[i+1]),inplace=True)
-                track.reset_index(inplace=True)
-                track.drop('level_0', axis=1, inplace=True)
-
-            if len(track) < 30:
-                continue
-
-            trimmed_tracks.append(track)
+        if len(long_tracks) == 0:
+            return trimmed_tracks
+
+        # Extent of the minimum x and minimum y corners of all gates
+        gate_bounds = np.concatenate([self.intersection.dest_bounds, self.intersection.origin_bounds])
+        int_x_max = gate_bounds[:, 0].max()
+        int_x_min = gate_bounds[:, 0].min()
+        int_y_max = gate_bounds[:, 2].max()
+        int_y_min = gate_bounds[:, 2].min()
+
+        lengths = np.array([len(track) for track in long_tracks])
+        offsets = np.append(0, np.cumsum(lengths))
+        track_starts = offsets[:-1]
+        row_track = np.repeat(np.arange(len(long_tracks)), lengths)
+        track_step = np.arange(offsets[-1]) - track_starts[row_track]
+
+        def column(name):
+            return np.concatenate([track[name].values for track in long_tracks])
+        o_X = column('Object_X')
+        o_Y = column('Object_Y')
+
+        #Cut out cars that park if they are visible
+        # (a track that never moves, or is never observed, is treated as parked/guessed from its first step)
+        last_moving_idx = np.maximum.reduceat(np.where(column('AbsVelocity') > 0.1, track_step, -1), track_starts)
+        last_observed_idx = np.maximum.reduceat(np.where(column('ObjectPredAge') == 0, track_step, -1), track_starts)
+        outside_intersection = ((o_Y > int_y_max) |
+                                (o_Y < int_y_min) |
+                                (o_X > int_x_max) |
+                                (o_X < int_x_min))
+        # If they are outside the roundabout and have stopped i.e. parked, or if the system is guessing
+        drop = outside_intersection & ((track_step > last_moving_idx[row_track]) |
+                                       (track_step > last_observed_idx[row_track]))
+        # Or they are not in the roundabout proximity
+        drop |= ((o_Y > ( intersection_limits + int_y_max)) |
+                 (o_Y < (-intersection_limits + int_y_min)) |
+                 (o_X > ( intersection_limits + int_x_max)) |
+                 (o_X < (-intersection_limits + int_x_min)))
+        # Or they have left the roundabout
+        drop |= column('distance_to_exit') > dis_after_exit
+
+        # and finally, check if any of the above filters have split a track in two. Keep the track that contains
+        # distance zero. A track without a split is kept whole.
+        kept_rows = np.flatnonzero(~drop)
+        kept_track = row_track[kept_rows]
+        timestamps = column('Timestamp')[kept_rows]
+        new_track = np.ones(len(kept_rows), dtype=bool)
+        new_track[1:] = kept_track[1:] != kept_track[:-1]
+        split = np.zeros(len(kept_rows), dtype=bool)
+        split[1:] = (np.diff(timestamps) > 1) & ~new_track[1:]
+        # Number of zero distance rows before each kept row, so any range can be checked for a zero at once
+        zero_count = np.append(0, np.cumsum(column('distance')[kept_rows] == 0.0))
+        keep = np.ones(len(kept_rows), dtype=bool)
+        segment_starts = np.flatnonzero(new_track | split)
+        segment_ends = np.append(segment_starts[1:], len(kept_rows))
+        segment_track = kept_track[segment_starts]
+        split_tracks = np.flatnonzero(np.bincount(kept_track, weights=split, minlength=len(long_tracks)) > 0)
+        for track_idx in split_tracks:
+            # The segments were dropped one at a time, and each was checked with a positional slice of the already
+            # trimmed track. So the range checked for a zero is offset by the number of rows dropped so far.
+            track_segments = np.flatnonzero(segment_track == track_idx)
+            track_end = segment_ends[track_segments[-1]]
+            num_dropped = 0
+            for segment in track_segments:
+                check_start = min(segment_starts[segment] + num_dropped, track_end)
+                check_end = min(segment_ends[segment] + num_dropped, track_end)
+                if zero_count[check_end] - zero_count[check_start] == 0:
+                    keep[segment_starts[segment]:segment_ends[segment]] = False
+                    num_dropped += segment_ends[segment] - segment_starts[segment]
+        kept_rows = kept_rows[keep]
+        kept_track = kept_track[keep]
+        kept_lengths = np.bincount(kept_track, minlength=len(long_tracks))
+        kept_offsets = np.append(0, np.cumsum(kept_lengths))
+
+        kept_step = track_step[kept_rows]
+        for track_idx in np.flatnonzero(kept_lengths >= min_track_length):
+            trimmed_tracks.append(long_tracks[track_idx].iloc[
+                                      kept_step[kept_offsets[track_idx]:kept_offsets[track_idx + 1]]
+                                  ].reset_index(drop=True))
         return trimmed_tracks
 
-    def _calculate_intersection_distance(self, labelled_track_list):
+    def _calculate_intersection_distance(self, labelled_track_list, batched=False):
+        # Distance travelled along each track, relative to the last point in its origin gate (distance), and to the
+        # first point in its destination gate (distance_to_exit).
+        if batched:
+            return self._calculate_intersection_distance_batched(labelled_track_list)
         base_idx = len(self.labelled_track_list)
         for track_idx in range(len(labelled_track_list)):
             single_track = labelled_track_list[track_idx]
@@ -582,28 +766,18 @@ class ibeoCSVImporter:
             sys.stdout.write("\rCalculating distance metric for track: %04d of %04d " % (base_idx + track_idx,
                                                                                          base_idx + len(labelled_track_list)))
             sys.stdout.flush()
-            d = np.sqrt((single_track.loc[1:, "Object_X"].values -
-                         single_track.loc[0:len(single_track)-2, "Object_X"].values) ** 2  # [0:len-2] is equiv. to [0:-1].
-                        +
-                        (single_track.loc[1:, "Object_Y"].values -
-                         single_track.loc[0:len(single_track)-2, "Object_Y"].values) ** 2)
-            #d = np.sqrt((single_track[1:, 0] - single_track[0:-1, 0]) ** 2 +
-            #            (single_track[1:, 1] - single_track[0:-1, 1]) ** 2)
+            o_X = single_track["Object_X"].values
+            o_Y = single_track["Object_Y"].values
+            d = np.sqrt((o_X[1:] - o_X[:-1]) ** 2 + (o_Y[1:] - o_Y[:-1]) ** 2)
             d = np.cumsum(np.append(0.0, d))
 
             # Find the last point in which the car is still in the origin box.
-            enter_ref_step = 0
-            for step in range(len(single_track)):
-                if self._in_box([single_track.iloc[step]["Object_X"],
-                                 single_track.iloc[step]["Object_Y"]], self.origin_gates[track_origin]):
-                    enter_ref_step = step
-                    # Do not break as it will keep overriding with the latest point in box
-
-            for step in range(len(single_track)):
-                if self._in_box([single_track.iloc[step]["Object_X"],
-                                 single_track.iloc[step]["Object_Y"]], self.dest_gates[track_dest]):
-                    exit_ref_step = step
-                    break  # I want the first step, not the last step.
+            in_origin = np.flatnonzero(self.intersection.in_gate(
+                o_X, o_Y, 'origin', self.intersection.gate_index('origin', track_origin)))
+            enter_ref_step = in_origin[-1] if len(in_origin) > 0 else 0
+            # I want the first step in the destination box, not the last step.
+            exit_ref_step = np.flatnonzero(self.intersection.in_gate(
+                o_X, o_Y, 'dest', self.intersection.gate_index('dest', track_dest)))[0]
 
             dis_from_enter = d - d[enter_ref_step]
             dis_from_exit = d - d[exit_ref_step]
@@ -615,6 +789,51 @@ class ibeoCSVImporter:
         sys.stdout.flush()
         return labelled_track_list
 
+    def _calculate_intersection_distance_batched(self, labelled_track_list):
+        # As above, but all tracks of a recording are concatenated and processed together, using the track offsets
+        # to reset the path length and to find the reference steps of each track.
+        # The path length is accumulated over the whole recording, so values may differ from the per-track
+        # computation by floating point rounding (well below a micrometre). The reference steps are still exactly 0.
+        if len(labelled_track_list) == 0:
+            return labelled_track_list
+        sys.stdout.write("\rCalculating distance metric for %04d tracks " % len(labelled_track_list))
+        sys.stdout.flush()
+        lengths = np.array([len(single_track) for single_track in labelled_track_list])
+        offsets = np.append(0, np.cumsum(lengths))
+        track_starts = offsets[:-1]
+        row_track = np.repeat(np.arange(len(labelled_track_list)), lengths)
+        track_step = np.arange(offsets[-1]) - track_starts[row_track]
+
+        o_X = np.concatenate([single_track["Object_X"].values for single_track in labelled_track_list])
+        o_Y = np.concatenate([single_track["Object_Y"].values for single_track in labelled_track_list])
+        d = np.zeros(len(o_X))
+        d[1:] = np.sqrt((o_X[1:] - o_X[:-1]) ** 2 + (o_Y[1:] - o_Y[:-1]) ** 2)
+        d[track_starts] = 0.0
+        d = np.cumsum(d)
+
+        # Gate of each track, gathered per point
+        origin_gate = np.array([self.intersection.gate_index('origin', single_track.iloc[0]['origin'])
+                                for single_track in labelled_track_list])
+        dest_gate = np.array([self.intersection.gate_index('dest', single_track.iloc[0]['destination'])
+                              for single_track in labelled_track_list])
+        in_origin = self.intersection.in_gate(o_X, o_Y, 'origin', origin_gate[row_track])
+        in_dest = self.intersection.in_gate(o_X, o_Y, 'dest', dest_gate[row_track])
+        # Last point in the origin box (or the start), first point in the destination box
+        enter_ref_step = np.maximum.reduceat(np.where(in_origin, track_step, 0), track_starts)
+        exit_ref_step = np.minimum.reduceat(np.where(in_dest, track_step, offsets[-1]), track_starts)
+
+        dis_from_enter = d - d[track_starts + enter_ref_step][row_track]
+        dis_from_exit = d - d[track_starts + exit_ref_step][row_track]
+        for track_idx in range(len(labelled_track_list)):
+            single_track = labelled_track_list[track_idx]
+            single_track["distance"] = dis_from_enter[offsets[track_idx]:offsets[track_idx + 1]]
+            single_track["distance_to_exit"] = dis_from_exit[offsets[track_idx]:offsets[track_idx + 1]]
+
+        sys.stdout.write("\t\t%4s" % "[ OK ]")
+        sys.stdout.write("\r\n")
+        sys.stdout.flush()
+        return labelled_track_list
+
         # Traversals:
         # iloc[]
         # ObjBoxCente_X
@@ -153,8 +153,10 @@ to_pickle['trainval_idxs'] = Wrangler.trainval_idxs
 to_pickle['data_pool'] = Wrangler.get_pool_filename()
 
 
+# The batches are gathered from the array backed pool the sub-pools were selected from
 trainingManager = TrainingManager.TrainingManager(cf_pool, test_pool,Wrangler.encoder_means,Wrangler.encoder_stddev,
-                                                  parameters.parameters)
+                                                  parameters.parameters, array_pool=Wrangler.dense_pool,
+                                                  cf_rows=Wrangler.crossfold_rows)
 if (parameters.parameters['hyper_search_folds'] > 0) and not test_network_only:
     best_params = trainingManager.run_hyperparameter_search()
 elif test_network_only:
@@ -179,6 +181,8 @@ print "Crossfolding finished, now training with the best parameters"
 
 full_cf_pool = pd.concat([cf_pool[0][0], cf_pool[0][1]])
 trainingManager.long_train_network(best_params, cf_pool[0][0], cf_pool[0][1], test_pool, checkpoint=checkpoint_dir,
-                                   test_network_only=test_network_only)
+                                   test_network_only=test_network_only,
+                                   pool_rows=(Wrangler.crossfold_rows[0][0], Wrangler.crossfold_rows[0][1],
+                                              Wrangler.test_rows))
 #Dumb statement for breakpoint before system finishes
 ideas = None
@@ -20,6 +20,13 @@ parameters['data_list'] = [
 parameters['test_csv'] = 'oliver-wyndora'
 parameters['data_filename'] = 'intersections-dataset' # or 'short-debug'  # comment out if reading directly from csvs
 parameters['short_wrangle'] = True
+#parameters['ingest_chunk_rows'] = 1000000  # Stream raw CSVs in chunks of this many rows. Bounds memory use.
+#parameters['ingest_max_open_rows'] = 1000000  # Rows of open tracks carried between chunks. Longer tracks are cut
+#parameters['ingest_batched_distance'] = True  # Intersection distance for all tracks of a recording at once
+#parameters['ingest_workers'] = 8  # Number of recordings to read in parallel
+#parameters['ingest_read_workers'] = 8  # Processes parsing a single large recording, when ingest_workers is 1
+#parameters['ingest_binary_recordings'] = True  # Convert each raw csv once to binary, and import from that
+#parameters['ingest_float32'] = True  # Read raw measurements as float32. Halves memory, results differ slightly
 
 # Preprocessing
 parameters['keep_large_vehicles'] = True
@@ -28,6 +35,11 @@ parameters['ibeo_data_columns'] = ["relative_x", "relative_y", "relative_angle",
 parameters['reject_stopped_vehicles_before_intersection_enable'] = False
 parameters['reject_stopped_vehicles_before_intersection_speed'] = 1  # meters per second, 1 = 3.6kph, there is sensor noise meaning no true zero
 parameters['reject_stopped_vehicles_before_intersection_duration'] = 1.0  # seconds
+#parameters['pool_cache_max_bytes'] = 50 * 2**30  # Disk budget of data_pool/. Least recently used pools are removed
+#parameters['lazy_window_pool'] = True  # Store each track once in the pool, and make the samples as windows onto it
+#parameters['wrangle_extra_horizons'] = [(10, 40), (15, 80)]  # Also make pools for these (observation, prediction) steps
+#parameters['wrangle_workers'] = 8  # Processes slicing tracks into samples. Default is every core
+#parameters['wrangle_chunk_tracks'] = 50  # Tracks per task sent to a wrangling worker
 
 # Training Parameters
 parameters["batch_size"] = 100
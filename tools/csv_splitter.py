@@ -3,6 +3,8 @@ import os
 import argparse
 
 # Derived from https://gist.github.com/jrivero/1085501#file-csv_splitter-py
+# No longer needed for the importer, which can read the full recordings directly. See ingest_chunk_rows and
+# ingest_read_workers in parameters.example.py
 parser = argparse.ArgumentParser(description='Split CSV into files of N lines')
 parser.add_argument('--rows', type=int, nargs=1, default=4000000, help='Number of lines per file')
 parser.add_argument('filename', type=str, nargs=1, help='csv filename')
@@ -1,5 +1,12 @@
 import hashlib
+import os
 import inspect
+import json
+import tokenize
+import StringIO
+
+# Resolved when imported, so relative source paths do not depend on the working directory at the time of use
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 def sanitize_params_dict(params):
@@ -17,3 +24,45 @@ def get_library_hash(file_list=None):
     for full_path in file_list:
         hash_value += abs(hash(hashlib.md5(open(full_path, 'rb').read()).hexdigest()))
     return hash_value
+
+
+def get_file_fingerprint(full_path, sample_bytes=2**20):
+    # Fingerprint of a (large) data file from its size, modification time and the data at its start and end.
+    # The content is only sampled, so hundreds of GiB are not read on every run. An edit to the middle of the file
+    # that keeps its size is caught by the modification time, but a file copied without its times is seen as changed.
+    file_hash = hashlib.md5()
+    file_stat = os.stat(full_path)
+    file_size = file_stat.st_size
+    file_hash.update(str(file_size))
+    file_hash.update(repr(file_stat.st_mtime))
+    with open(full_path, 'rb') as data_file:
+        file_hash.update(data_file.read(sample_bytes))
+        data_file.seek(max(0, file_size - sample_bytes))
+        file_hash.update(data_file.read(sample_bytes))
+    return file_hash.hexdigest()
+
+
+def get_source_digest(file_list):
+    # Stable digest of the code in file_list. Comments and blank lines of python files are left out, so documenting
+    # the code does not invalidate the caches keyed on it. Other files (e.g. json) are digested as they are.
+    # Relative paths are relative to this directory.
+    source_hash = hashlib.md5()
+    for file_path in file_list:
+        full_path = os.path.join(SOURCE_DIR, file_path)
+        with open(full_path, 'rb') as source_file:
+            source = source_file.read()
+        source_hash.update(file_path)
+        if file_path.endswith('.py'):
+            for token in tokenize.generate_tokens(StringIO.StringIO(source).readline):
+                if token[0] in (tokenize.COMMENT, tokenize.NL):
+                    continue
+                source_hash.update(repr((token[0], token[1])))
+        else:
+            source_hash.update(source)
+    return source_hash.hexdigest()
+
+
+def get_value_fingerprint(value):
+    # Stable digest of a json-able value, e.g. the parameters a cache depends on. Unlike hash(), this is the same in
+    # every interpreter and process.
+    return hashlib.md5(json.dumps(value, sort_keys=True)).hexdigest()